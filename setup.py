@@ -23,6 +23,7 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
             'launch-python-jobs-array = slurm_tools.launch_python_jobs_array:main',
+            'slurm-tools = slurm_tools.cli:main',
         ]
     },
     python_requires=">=3.6",
@@ -11,6 +11,20 @@ time='1:00:00'
 partition=shared # Default partition.
 gpu_count=0
 
+## ENVIRONMENT CACHE.
+# By default the environment is created by name with `conda create -n`. With `--hashed`,
+# environments are built in `${env_cache}/${ENV_NAME}-${SPEC_HASH}`, with the hash of the
+# sorted package specs, and `${env_cache}/${ENV_NAME}` links to the latest build.
+hashed=0
+env_cache=${HOME}/conda_envs
+cache_size=50 # Whole GB, least recently used environments are removed above this size.
+force=0
+
+## PACKED ENVIRONMENT FOR NODE-LOCAL STAGING (see `--env_name` of `launch-python-jobs-array`).
+pack=0
+pack_directory=${HOME}/conda_packs
+pack_commands=""
+
 ## GET INPUTS.
 POSITIONAL=()
 while [[ $# -gt 0 ]]
@@ -58,6 +72,42 @@ case $key in
             exit 1
         fi
     ;;
+    --hashed)
+        hashed=1
+    ;;
+    --env_cache)
+        if [ ! -z "$2" ]; then
+            env_cache=$2
+            shift
+        else
+            echo 'ERROR: "--env_cache" requires a non-empty option argument.'
+            exit 1
+        fi
+    ;;
+    --cache_size)
+        if [ ! -z "$2" ]; then
+            cache_size=$2
+            shift
+        else
+            echo 'ERROR: "--cache_size" requires a non-empty option argument.'
+            exit 1
+        fi
+    ;;
+    --force)
+        force=1
+    ;;
+    --pack)
+        pack=1
+    ;;
+    --pack_directory)
+        if [ ! -z "$2" ]; then
+            pack_directory=$2
+            shift
+        else
+            echo 'ERROR: "--pack_directory" requires a non-empty option argument.'
+            exit 1
+        fi
+    ;;
     --packages)
     if [ ! -z "$1" ]; then
         shift
@@ -77,6 +127,135 @@ if [ $gpu_count -gt 0 ]; then
     sbatch_setup_commands+=$'\n'"#SBATCH --gres gpu:${gpu_count}"
 fi
 
+package_names() {
+    # Package names of specs, e.g. `numpy` of `conda-forge::numpy>=1.24`.
+    sed -E 's/^.*:://; s/[=<>!~ ].*//' | LC_ALL=C sort -u
+}
+
+if [ $hashed -eq 1 ]; then
+    ## HASH ENVIRONMENT SPEC (`--hashed`).
+    # One spec per line in bytewise order, as `slurm_tools.env_spec.spec_hash` computes it.
+    SPEC=$(set -f; printf '%s\n' ${PACKAGES} | LC_ALL=C sort -u)
+    SPEC_ARGS=$(set -f; printf '%q ' ${SPEC})
+    SPEC_HASH=$(printf '%s\n' "${SPEC}" | sha256sum | cut -c1-16)
+    SPEC_FILE=conda-meta/slurm_tools_spec
+    LAST_USED_FILE=conda-meta/slurm_tools_last_used
+    ENV_PREFIX="${env_cache}/${ENV_NAME}-${SPEC_HASH}"
+    ENV_LINK="${env_cache}/${ENV_NAME}"
+    PACK_FILE="${pack_directory}/${ENV_NAME}-${SPEC_HASH}.tar.gz"
+    echo "environment spec hash: ${SPEC_HASH}"
+    mkdir -p ${env_cache}
+
+    if [ $force -eq 0 ] && [ -f "${ENV_PREFIX}/${SPEC_FILE}" ]; then
+        # Built before: point the link back at it and only pack it if needed.
+        ln -sfn "$(basename "${ENV_PREFIX}")" "${ENV_LINK}"
+        touch "${ENV_PREFIX}/${LAST_USED_FILE}"
+        echo "environment is up to date: ${ENV_PREFIX}"
+        if [ $pack -eq 0 ] || [ -f "${PACK_FILE}" ]; then
+            if [ $pack -eq 1 ]; then
+                ln -sfn "$(basename "${PACK_FILE}")" "${pack_directory}/${ENV_NAME}.tar.gz"
+            fi
+            exit 0
+        fi
+        build_commands="# Environment is up to date."
+    elif [ $force -eq 0 ] && [ -f "${ENV_LINK}/${SPEC_FILE}" ]; then
+        # Clone the previous build, which reuses its packages, and apply the difference of specs.
+        PREVIOUS_PREFIX=$(readlink -f "${ENV_LINK}")
+        ADDED=$(LC_ALL=C comm -13 "${PREVIOUS_PREFIX}/${SPEC_FILE}" <(printf '%s\n' "${SPEC}"))
+        REMOVED=$(LC_ALL=C comm -23 <(package_names < "${PREVIOUS_PREFIX}/${SPEC_FILE}") <(printf '%s\n' "${SPEC}" | package_names))
+        echo "building from ${PREVIOUS_PREFIX}, adding: ${ADDED//$'\n'/ }, removing: ${REMOVED//$'\n'/ }"
+        build_commands=$(/bin/cat <<EOT
+rm -rf "${ENV_PREFIX}"
+conda create -y -p "${ENV_PREFIX}" --clone "${PREVIOUS_PREFIX}"
+EOT
+)
+        if [ ! -z "${REMOVED}" ]; then
+            build_commands+=$'\n'"conda remove -y -p \"${ENV_PREFIX}\" $(set -f; printf '%q ' ${REMOVED})"
+        fi
+        if [ ! -z "${ADDED}" ]; then
+            build_commands+=$'\n'"conda install -y -p \"${ENV_PREFIX}\" $(set -f; printf '%q ' ${ADDED})"
+        fi
+    else
+        build_commands=$(/bin/cat <<EOT
+rm -rf "${ENV_PREFIX}"
+conda create -y -p "${ENV_PREFIX}" ${SPEC_ARGS}
+EOT
+)
+    fi
+
+    ## EVICT LEAST RECENTLY USED ENVIRONMENTS ABOVE `cache_size`.
+    # Environments that a link in `${env_cache}` points to are kept.
+    evict_commands=$(/bin/cat <<EOT
+## EVICT LEAST RECENTLY USED ENVIRONMENTS
+IN_USE=\$(find "${env_cache}" -maxdepth 1 -type l -exec readlink -f {} \;)
+CACHE_KB=\$(du -sk "${env_cache}" | cut -f1)
+for last_used in \$(ls -1tr "${env_cache}"/*/${LAST_USED_FILE}); do
+    if [ \${CACHE_KB} -le $((cache_size * 1024 * 1024)) ]; then
+        break
+    fi
+    prefix=\$(dirname "\$(dirname "\${last_used}")")
+    if [ -L "\${prefix}" ] || echo "\${IN_USE}" | grep -qxF "\${prefix}"; then
+        continue
+    fi
+    CACHE_KB=\$((CACHE_KB - \$(du -sk "\${prefix}" | cut -f1)))
+    echo "evicting \${prefix}"
+    rm -rf "\${prefix}"
+done
+EOT
+)
+    record_commands=$(/bin/cat <<EOT
+# The spec is written last and marks a complete build.
+printf '%s\n' ${SPEC_ARGS} > "${ENV_PREFIX}/${SPEC_FILE}"
+touch "${ENV_PREFIX}/${LAST_USED_FILE}"
+ln -sfn "$(basename "${ENV_PREFIX}")" "${ENV_LINK}"
+echo "built conda environment: ${ENV_PREFIX}"
+EOT
+)
+    # Archives are named by the spec hash like environments, so an unchanged environment
+    # is not packed again.
+    pack_source="-p \"${ENV_PREFIX}\""
+    pack_hash_command="PACK_HASH=${SPEC_HASH}"
+else
+    build_commands=$(/bin/cat <<EOT
+conda create -y -n ${ENV_NAME}
+echo "created conda environment"
+
+source activate ${ENV_NAME}
+echo "activated conda environment"
+
+conda install -y ${PACKAGES}
+echo "installed packages."
+EOT
+)
+    record_commands=""
+    evict_commands=""
+    # Archives are named by the hash of the environment's lockfile, so an unchanged
+    # environment is not packed again.
+    pack_source="-n ${ENV_NAME}"
+    pack_hash_command="PACK_HASH=\$(conda list -n ${ENV_NAME} --explicit --md5 | sha256sum | cut -c1-16)"
+fi
+
+if [ $pack -eq 1 ]; then
+    # conda-pack is kept in its own environment, outside of the packed ones.
+    # `${ENV_NAME}.tar.gz` links to the latest archive.
+    pack_commands=$(/bin/cat <<EOT
+## PACK CONDA ENVIRONMENT
+if [ ! -x "${env_cache}/_conda-pack/bin/conda-pack" ]; then
+    conda create -y -p "${env_cache}/_conda-pack" -c conda-forge conda-pack
+fi
+mkdir -p ${pack_directory}
+${pack_hash_command}
+PACK_FILE="${pack_directory}/${ENV_NAME}-\${PACK_HASH}.tar.gz"
+if [ ! -f "\${PACK_FILE}" ]; then
+    "${env_cache}/_conda-pack/bin/conda-pack" ${pack_source} -o "\${PACK_FILE}.tmp" --format tar.gz
+    mv "\${PACK_FILE}.tmp" "\${PACK_FILE}"
+fi
+ln -sfn "\$(basename "\${PACK_FILE}")" "${pack_directory}/${ENV_NAME}.tar.gz"
+echo "packed conda environment: \${PACK_FILE}"
+EOT
+)
+fi
+
 ## SET UP JOB DIRECTORIES.
 if [ ! -d ${job_directory} ]; then
   # If directory does not exist, then creates it.
@@ -119,16 +298,16 @@ echo python: \$(which python)
 echo "finished loading"
 # Activate conda environment.
 eval "\$(conda shell.bash hook)"
+# Stop before recording the spec if any step fails.
+set -e
 
+## BUILD CONDA ENVIRONMENT
+$build_commands
+$record_commands
 
-conda create -y -n ${ENV_NAME}
-echo "created conda environment"
+$pack_commands
 
-source activate ${ENV_NAME}
-echo "activated conda environment"
-
-conda install -y ${PACKAGES}
-echo "installed packages."
+$evict_commands
 
 echo "Finished."
 srun hostname
@@ -12,6 +12,12 @@ partition=shared # Default partition.
 gpu_count=0
 mempercpu='4G'
 
+## SKIP RECENT UPDATES.
+# The update job touches `update_stamp`, and no job is submitted within `min_age` days of it.
+update_stamp=${HOME}/.conda/slurm_tools_update_conda
+min_age=7
+force=0
+
 ## GET INPUTS.
 POSITIONAL=()
 while [[ $# -gt 0 ]]
@@ -59,6 +65,18 @@ case $key in
         exit 1
         fi
     ;;
+    --min_age)
+        if [ ! -z "$2" ]; then
+            min_age=$2
+            shift
+        else
+        echo 'ERROR: "--min_age" requires a non-empty option argument.'
+        exit 1
+        fi
+    ;;
+    --force)
+        force=1
+    ;;
     --env_name)
         if [ ! -z "$2" ]; then
             ENV_NAME=$2
@@ -77,6 +95,11 @@ if [ $gpu_count -gt 0 ]; then
     sbatch_setup_commands+=$'\n'"#SBATCH --gres gpu:${gpu_count}"
 fi
 
+if [ $force -eq 0 ] && [ -n "$(find "${update_stamp}" -mtime -${min_age} 2>/dev/null)" ]; then
+    echo "conda was updated less than ${min_age} days ago, use --force to update anyway."
+    exit 0
+fi
+
 ## SET UP JOB DIRECTORIES.
 if [ ! -d ${job_directory} ]; then
   # If directory does not exist, then creates it.
@@ -120,7 +143,7 @@ echo "finished loading"
 # Activate conda environment.
 eval "\$(conda shell.bash hook)"
 
-conda update -y -n base -c defaults conda
+conda update -y -n base -c defaults conda && mkdir -p "$(dirname "${update_stamp}")" && touch "${update_stamp}"
 
 echo "Finished."
 srun hostname
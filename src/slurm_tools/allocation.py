@@ -0,0 +1,236 @@
+"""Runs sbatch files in the current allocation instead of submitting them to the queue.
+
+Inside an `salloc` session (see `RequestBasicInstance` of `interactive_commands.sh`) or a
+running job, `AllocationExecutor` stands in for `submit.SbatchSubmitter`: each job, or task
+of a job array, runs the body of its sbatch file as an `srun --exclusive` job step or as a
+local process once enough of the allocated cpus are free. `#SBATCH` lines for logs, arrays,
+`--ntasks` and `--dependency` are honoured; all other resources are those of the allocation.
+"""
+
+import itertools
+import os
+from pathlib import Path
+import re
+import subprocess
+import time
+
+SRUN="srun"
+LOCAL="local"
+LAUNCHERS=(SRUN, LOCAL)
+COMPLETED="COMPLETED"
+FAILED="FAILED"
+CANCELLED="CANCELLED"
+_DIRECTIVE_PATTERN = re.compile(r"#SBATCH\s+--([\w-]+)(?:[= ]\s*(.*?))?\s*$")
+_ARRAY_PATTERN = re.compile(r"(\d+)-(\d+)(?:%(\d+))?")
+_JOB_ID_PREFIX="local"
+# Requires every dependency to end in one of these states, see `pipeline.DEPENDENCY_TYPES`.
+_SATISFIED_STATES={
+    "afterok": (COMPLETED,),
+    "afterany": (COMPLETED, FAILED, CANCELLED),
+    "afternotok": (FAILED, CANCELLED),
+    "aftercorr": (COMPLETED,),
+}
+
+
+def in_allocation(environ=os.environ):
+    """Returns `True` if running inside a slurm allocation."""
+    return "SLURM_JOB_ID" in environ
+
+
+def allocated_cpus(environ=os.environ):
+    """Returns the number of cpus of the current allocation, or of this machine outside of one."""
+    if "SLURM_NTASKS" in environ:
+        return int(environ["SLURM_NTASKS"]) * int(environ.get("SLURM_CPUS_PER_TASK", 1))
+    if "SLURM_CPUS_ON_NODE" in environ:
+        return int(environ["SLURM_CPUS_ON_NODE"])
+    return os.cpu_count()
+
+
+def parse_directives(text: str):
+    """Returns `dict` of option to value of the `#SBATCH --option=value` lines of `text`.
+
+    Options without a value (e.g. `--requeue`) map to `None`.
+    """
+    directives = {}
+    for line in text.splitlines():
+        match = _DIRECTIVE_PATTERN.match(line.strip())
+        if match is not None:
+            directives[match[1]] = match[2]
+    return directives
+
+
+def parse_dependency(dependency: str):
+    """Parses `--dependency` (e.g. `afterok:1:2,aftercorr:3`) into `(type, job_id)` pairs."""
+    pairs = []
+    for part in dependency.split(","):
+        dependency_type, *job_ids = part.split(":")
+        if dependency_type not in _SATISFIED_STATES:
+            raise ValueError(f"Unsupported dependency `{dependency_type}` in an allocation.")
+        pairs.extend((dependency_type, job_id) for job_id in job_ids)
+    return pairs
+
+
+def _log_path(pattern: str, job_id: str, array_index):
+    """Fills `%A`, `%a` and `%j` of a slurm log file name."""
+    path = pattern.strip("\"'").replace("%A", job_id).replace("%j", job_id)
+    return path.replace("%a", "" if array_index is None else str(array_index))
+
+
+class _Task(object):
+    """A job, or task of a job array, waiting for or running on cpus of the allocation."""
+
+    def __init__(self, job_id, array_index, sbatch_file, cpus, output, error, open_mode, dependencies):
+        self.job_id=job_id
+        self.array_index=array_index
+        self.sbatch_file=sbatch_file
+        self.cpus=cpus
+        self.output=output
+        self.error=error
+        self.open_mode=open_mode
+        # `List` of `(dependency_type, job_id)`.
+        self.dependencies=dependencies
+        self.process=None
+        self.state=None
+
+    @property
+    def slurm_id(self):
+        return self.job_id if self.array_index is None else f"{self.job_id}_{self.array_index}"
+
+
+class AllocationExecutor(object):
+    """Runs sbatch files on the cpus of the current allocation, see the module docstring.
+
+    `submit` starts what fits at once and `wait` runs the rest as cpus free up. Tasks start
+    in submission order, skipping tasks that do not fit or whose dependencies have not
+    finished. Tasks whose dependencies can no longer be satisfied are cancelled.
+
+    args:
+        max_cpus: Cpus to use, by default all of the allocation (`allocated_cpus`).
+        launcher: `"srun"` to run each task as a job step, `"local"` as a local process.
+        poll_interval: Seconds between checks for finished tasks in `wait`.
+    """
+
+    def __init__(self, max_cpus: int=None, launcher: str=SRUN, poll_interval: float=0.2):
+        if launcher not in LAUNCHERS:
+            raise ValueError(f"`launcher` must be one of {LAUNCHERS}.")
+        self.max_cpus=max_cpus or allocated_cpus()
+        self.launcher=launcher
+        self.poll_interval=poll_interval
+        self.tasks=[]
+        self.errors=[]
+        self._job_ids=itertools.count(1)
+        self._free_cpus=self.max_cpus
+
+    def submit(self, sbatch_file: Path, sbatch_args=()):
+        """Queues the job (or the tasks of the job array) of `sbatch_file` and returns its job id.
+
+        `sbatch_args` override the `#SBATCH` lines of the file, e.g. `--dependency`.
+        """
+        directives = parse_directives(Path(sbatch_file).read_text())
+        directives.update(parse_directives("\n".join(f"#SBATCH {a}" for a in sbatch_args)))
+        job_id = f"{_JOB_ID_PREFIX}{next(self._job_ids)}"
+        cpus = min(int(directives.get("ntasks") or 1), self.max_cpus)
+        dependencies = parse_dependency(directives["dependency"]) if directives.get("dependency") else []
+        array_indices = [None]
+        if directives.get("array"):
+            match = _ARRAY_PATTERN.fullmatch(directives["array"])
+            if match is None:
+                raise ValueError(f"Unsupported `--array={directives['array']}` in an allocation.")
+            array_indices = range(int(match[1]), int(match[2]) + 1)
+        for array_index in array_indices:
+            self.tasks.append(_Task(
+                job_id,
+                array_index,
+                sbatch_file,
+                cpus,
+                _log_path(directives.get("output") or f"slurm-{job_id}.out", job_id, array_index),
+                _log_path(directives.get("error") or f"slurm-{job_id}.out", job_id, array_index),
+                "a" if directives.get("open-mode") == "append" else "w",
+                dependencies,
+            ))
+        self._start_ready()
+        return job_id
+
+    def submit_all(self, sbatch_files):
+        """Queues each of `sbatch_files` and returns their job ids in order."""
+        return [self.submit(sbatch_file) for sbatch_file in sbatch_files]
+
+    def wait(self):
+        """Runs queued tasks until all have ended.
+
+        returns:
+            `dict` of slurm id (e.g. `local1_3` for an array task) to final state.
+        """
+        while any(t.state is None for t in self.tasks):
+            self._poll()
+            self._start_ready()
+            if any(t.state is None and t.process is not None for t in self.tasks):
+                time.sleep(self.poll_interval)
+        return self.states()
+
+    def states(self):
+        """Returns `dict` of slurm id to state, `None` for tasks that have not ended."""
+        return {t.slurm_id: t.state for t in self.tasks}
+
+    def _poll(self):
+        """Records the state of tasks that ended and frees their cpus."""
+        for task in self.tasks:
+            if task.process is None or task.state is not None:
+                continue
+            returncode = task.process.poll()
+            if returncode is not None:
+                task.state = COMPLETED if returncode == 0 else FAILED
+                self._free_cpus += task.cpus
+
+    def _dependency_state(self, task):
+        """Returns `True` if `task` may start, `False` if it never can, `None` to keep waiting."""
+        for dependency_type, job_id in task.dependencies:
+            upstream = [
+                t for t in self.tasks if t.job_id == job_id
+                and (dependency_type != "aftercorr" or t.array_index == task.array_index)
+            ]
+            if any(t.state is None for t in upstream):
+                return None
+            if not all(t.state in _SATISFIED_STATES[dependency_type] for t in upstream):
+                return False
+        return True
+
+    def _start_ready(self):
+        """Starts waiting tasks that fit in the free cpus and whose dependencies finished."""
+        progress = True
+        while progress:
+            # Cancelling a task may make the tasks that depend on it ready to be decided.
+            progress = False
+            for task in self.tasks:
+                if task.process is not None or task.state is not None:
+                    continue
+                ready = self._dependency_state(task)
+                if ready is False:
+                    task.state = CANCELLED
+                    progress = True
+                elif ready and task.cpus <= self._free_cpus:
+                    self._start(task)
+
+    def _start(self, task):
+        """Starts `task` with its logs and array index."""
+        env = dict(os.environ)
+        env["SLURM_NTASKS"] = str(task.cpus)
+        if task.array_index is not None:
+            env["SLURM_ARRAY_JOB_ID"] = task.job_id
+            env["SLURM_ARRAY_TASK_ID"] = str(task.array_index)
+        command = ["bash", str(task.sbatch_file)]
+        if self.launcher == SRUN:
+            command = [
+                "srun", "--exclusive", "--ntasks=1", f"--cpus-per-task={task.cpus}",
+                "env", f"SLURM_NTASKS={task.cpus}", *command]
+        for log in (task.output, task.error):
+            Path(log).parent.mkdir(parents=True, exist_ok=True)
+        with open(task.output, task.open_mode) as stdout:
+            if task.error == task.output:
+                task.process = subprocess.Popen(
+                    command, stdout=stdout, stderr=subprocess.STDOUT, env=env, stdin=subprocess.DEVNULL)
+            else:
+                with open(task.error, task.open_mode) as stderr:
+                    task.process = subprocess.Popen(
+                        command, stdout=stdout, stderr=stderr, env=env, stdin=subprocess.DEVNULL)
+        self._free_cpus -= task.cpus
@@ -0,0 +1,248 @@
+"""Benchmarks how launching scales with the number of rows, against a local fake slurm.
+
+Each phase of a launch is timed on generated sweeps of several sizes:
+
+- `parse`: reading the rows of the csv (`csv_util.iter_csv`).
+- `render`: rendering the sbatch text of each row from a compiled template.
+- `mkdir`: creating the job directory of each row.
+- `write`: writing the sbatch file of each row, with its directory, as `launch_conda_jobs_csv` does.
+- `submit`: submitting sbatch files to fake `sbatch` (see `fake_slurm`) with `submit.SbatchSubmitter`,
+  at most `max_submissions` of them since each call starts a process.
+- `array`: launching the whole csv as job arrays with `launch_conda_job_arrays`, split at the
+  default `MaxArraySize`.
+
+Every measurement runs in a fresh interpreter, so that its peak memory (peak resident set size)
+and the directories cached by `launch_job.make_directory` are not shared with other measurements.
+Results are `dict`s that can be saved as JSON and compared against a baseline with `compare`.
+"""
+
+import contextlib
+from concurrent import futures
+import csv
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+from slurm_tools import csv_util
+from slurm_tools import fake_slurm
+from slurm_tools import launch_job
+from slurm_tools import launch_python_job
+from slurm_tools import launch_python_jobs_array
+from slurm_tools import submit
+
+PHASES=("parse", "render", "mkdir", "write", "submit", "array")
+DEFAULT_SIZES=(1000, 10000, 100000)
+DEFAULT_MAX_SUBMISSIONS=200
+DEFAULT_TOLERANCE=0.2
+_JOB_NAME="benchmark"
+_ENV_NAME="benchmark_env"
+_SCRIPT="benchmark.py"
+_SLURM_ARGS={"time": "00:10:00", "cpu_count": 1, "mem_per_cpu": "1G"}
+
+
+def write_sweep_csv(path: Path, rows: int):
+    """Writes a csv of `rows` rows with an `experiment_id` and a few typical script arguments."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["experiment_id", "learning_rate", "seed", "model", "data"])
+        for i in range(rows):
+            writer.writerow([i, f"{10 ** -(1 + i % 5):g}", i % 10, f"model_{i % 3}", "/data/train.csv"])
+    return path
+
+
+def _peak_rss():
+    """Returns the peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _template(directory):
+    return launch_python_job.compile_conda_template(directory, _ENV_NAME, _SCRIPT, _SLURM_ARGS)
+
+
+def _setup(phase, csv_file, directory, sbatch_command, options):
+    """Prepares the inputs of `phase`, outside of the timed part.
+
+    returns:
+        `(run, rows)`: `run()` runs the phase, `rows` is the number of rows it processes.
+    """
+    directory = Path(directory)
+    if phase == "parse":
+        rows = sum(1 for _ in csv_util.iter_csv(csv_file))
+        return (lambda: sum(1 for _ in csv_util.iter_csv(csv_file))), rows
+
+    script_args = list(csv_util.iter_csv(csv_file))
+    template = _template(directory)
+    layout = {"shard_levels": options["shard_levels"], "shard_width": options["shard_width"]}
+    if phase == "render":
+        def run():
+            for row in script_args:
+                job_name = f"{_JOB_NAME}_id_{row['experiment_id']}"
+                template.render(
+                    job_name=job_name,
+                    job_directory=directory.joinpath(job_name),
+                    script_args=csv_util.dict_to_CLI_args(row),
+                )
+        return run, len(script_args)
+
+    if phase == "mkdir":
+        def run():
+            for row in script_args:
+                launch_job.make_directory(launch_job.job_directory_path(
+                    directory, f"{_JOB_NAME}_id_{row['experiment_id']}", shard_key=row["experiment_id"], **layout))
+        return run, len(script_args)
+
+    if phase == "write":
+        def run():
+            for row in script_args:
+                launch_python_jobs_array._write_row_sbatch(template, _JOB_NAME, directory, row, layout)
+        return run, len(script_args)
+
+    submitter = submit.SbatchSubmitter(
+        max_workers=options["submit_workers"], max_retries=0, sbatch_command=sbatch_command)
+    if phase == "submit":
+        sbatch_files = [
+            launch_python_jobs_array._write_row_sbatch(template, _JOB_NAME, directory, row, layout)[0]
+            for row in script_args[:options["max_submissions"]]
+        ]
+
+        def run():
+            submitter.submit_all(sbatch_files)
+            if submitter.errors:
+                raise submit.SubmissionError(f"{len(submitter.errors)} submissions to fake `sbatch` failed.")
+        return run, len(sbatch_files)
+
+    if phase == "array":
+        def run():
+            launch_python_jobs_array.launch_conda_job_arrays(
+                _JOB_NAME, directory, _ENV_NAME, _SCRIPT, csv_file, _SLURM_ARGS, submitter=submitter)
+        return run, len(script_args)
+
+    raise ValueError(f"`phase` must be one of {PHASES}.")
+
+
+def _measure(phase, csv_file, directory, sbatch_command, options):
+    """Runs `phase` once in this process and returns its seconds, rows and memory."""
+    run, rows = _setup(phase, csv_file, directory, sbatch_command, options)
+    baseline_rss = _peak_rss()
+    # Launchers print progress, which is not part of the measurement.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+    peak_rss = _peak_rss()
+    return {
+        "rows": rows,
+        "seconds": seconds,
+        "peak_rss_bytes": peak_rss,
+        "rss_growth_bytes": peak_rss - baseline_rss,
+    }
+
+
+def run_benchmarks(
+    sizes=DEFAULT_SIZES,
+    phases=PHASES,
+    directory: Path=None,
+    repeat: int=1,
+    latency: float=0.0,
+    submit_workers: int=4,
+    max_submissions: int=DEFAULT_MAX_SUBMISSIONS,
+    shard_levels: int=0,
+    shard_width: int=2,
+    progress=None,
+):
+    """Times each of `phases` on a generated sweep of each of `sizes` rows, see the module docstring.
+
+    args:
+        directory: Directory for the generated sweeps, by default a temporary directory
+            that is removed afterwards.
+        repeat: Number of times to run each measurement, keeping the fastest.
+        latency: Seconds each call of fake `sbatch` waits before returning a job id.
+        max_submissions: Maximum number of rows submitted by the `submit` phase.
+        shard_levels, shard_width: Layout of job directories, see `launch_job.shard_path`.
+        progress: Optionally, called with each result as it is measured.
+
+    returns:
+        report: `dict` with the `environment`, the `settings` and a `list` of `results`, each
+            with `phase`, `size`, `rows`, `seconds`, `rows_per_second`, `peak_rss_bytes` and
+            `rss_growth_bytes` (growth of the peak during the phase).
+    """
+    unknown = [p for p in phases if p not in PHASES]
+    if unknown:
+        raise ValueError(f"Unknown phases {unknown}, must be some of {PHASES}.")
+    options = {
+        "submit_workers": submit_workers,
+        "max_submissions": max_submissions,
+        "shard_levels": shard_levels,
+        "shard_width": shard_width,
+    }
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "created": time.time(),
+        },
+        "settings": {"sizes": list(sizes), "phases": list(phases), "repeat": repeat, "latency": latency, **options},
+        "results": [],
+    }
+    with contextlib.ExitStack() as stack:
+        if directory is None:
+            directory = stack.enter_context(tempfile.TemporaryDirectory(prefix="slurm_tools_benchmark_"))
+        directory = Path(directory)
+        executables = fake_slurm.install(directory.joinpath("bin"), latency=latency)
+        for size in sizes:
+            csv_file = write_sweep_csv(directory.joinpath(f"sweep_{size}.csv"), size)
+            for phase in phases:
+                measurements = []
+                for attempt in range(repeat):
+                    run_directory = directory.joinpath(f"{phase}_{size}_{attempt}")
+                    # A fresh interpreter for each measurement, see the module docstring.
+                    with futures.ProcessPoolExecutor(
+                            max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                        measurements.append(executor.submit(
+                            _measure, phase, csv_file, run_directory, str(executables["sbatch"]), options).result())
+                fastest = min(measurements, key=lambda m: m["seconds"])
+                result = {
+                    "phase": phase,
+                    "size": size,
+                    **fastest,
+                    "rows_per_second": fastest["rows"] / fastest["seconds"] if fastest["seconds"] > 0 else None,
+                    "peak_rss_bytes": max(m["peak_rss_bytes"] for m in measurements),
+                }
+                report["results"].append(result)
+                if progress is not None:
+                    progress(result)
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float=DEFAULT_TOLERANCE):
+    """Compares the throughput of `report` to `baseline`, both returned by `run_benchmarks`.
+
+    returns:
+        `List` of `dict` with `phase`, `size`, `baseline` and `current` rows per second, their
+        `ratio` and `regressed`, `True` if `ratio` is below `1 - tolerance`. Only phases and
+        sizes measured in both are compared.
+    """
+    baseline_results = {(r["phase"], r["size"]): r for r in baseline["results"]}
+    comparisons = []
+    for result in report["results"]:
+        previous = baseline_results.get((result["phase"], result["size"]))
+        if previous is None or not previous["rows_per_second"] or not result["rows_per_second"]:
+            continue
+        ratio = result["rows_per_second"] / previous["rows_per_second"]
+        comparisons.append({
+            "phase": result["phase"],
+            "size": result["size"],
+            "baseline": previous["rows_per_second"],
+            "current": result["rows_per_second"],
+            "ratio": ratio,
+            "regressed": ratio < 1 - tolerance,
+        })
+    return comparisons
@@ -0,0 +1,214 @@
+"""Content-addressed cache of completed runs, used to skip rows that already succeeded."""
+
+import hashlib
+import importlib.util
+import json
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+import sys
+import time
+
+from slurm_tools import csv_util
+from slurm_tools import launch_job
+
+_CACHE_FILE_NAME="cache.sqlite"
+# Slurm args that can change the result of a run. Other args (e.g. `time`) only change scheduling.
+_KEY_SLURM_ARGS=("cpu_count",)
+CACHE_SKIP="skip"
+CACHE_LINK="link"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    job_directory TEXT NOT NULL,
+    experiment_id TEXT,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_job_directory ON results(job_directory);
+CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used);
+"""
+
+
+def default_cache_file(job_output_directory: Path):
+    """Returns the cache file kept next to the sweeps in `job_output_directory`."""
+    return Path(job_output_directory).joinpath(_CACHE_FILE_NAME)
+
+
+def module_file(module: str):
+    """Returns the file of `module` as imported from the cwd by `python -m`, `None` if not found."""
+    sys.path.insert(0, os.getcwd())
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        return None
+    finally:
+        sys.path.remove(os.getcwd())
+    if spec is None or not spec.has_location or not Path(spec.origin).is_file():
+        return None
+    return Path(spec.origin)
+
+
+def script_digest(script):
+    """Hashes the contents of `script`, a file or a module, or its name if neither is found."""
+    path = Path(script)
+    if not path.is_file():
+        path = module_file(str(script))
+        if path is None:
+            return str(script)
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class CacheKey(object):
+    """Computes the cache key of rows of a sweep.
+
+    The key combines the hash of the script file, the CLI arguments of the row with
+    sorted keys, the environment name and the slurm args in `key_slurm_args`. Resource
+    columns of a row (`launch_job.RESOURCE_ARGS`) are treated as slurm args rather than
+    CLI arguments. The parts shared by all rows are hashed once.
+    """
+
+    def __init__(self, script, env_name, slurm_args, key_slurm_args=_KEY_SLURM_ARGS):
+        self.slurm_args=slurm_args
+        self.key_slurm_args=key_slurm_args
+        self._script_digest=script_digest(script)
+        self.env_name=env_name
+        self.prefix=self._prefix(slurm_args)
+
+    def _prefix(self, slurm_args):
+        key_slurm_args = {
+            k: None if slurm_args.get(k) is None else str(slurm_args[k]) for k in self.key_slurm_args}
+        return "\0".join([
+            self._script_digest, str(self.env_name), json.dumps(key_slurm_args, sort_keys=True)])
+
+    def __call__(self, script_args: dict):
+        args = {
+            k: v for k, v in sorted(script_args.items())
+            if k != "experiment_id" and k not in launch_job.RESOURCE_ARGS
+        }
+        overrides = {k: script_args[k] for k in self.key_slurm_args if script_args.get(k) is not None}
+        prefix = self._prefix({**self.slurm_args, **overrides}) if overrides else self.prefix
+        h = hashlib.sha256(prefix.encode())
+        h.update(b"\0")
+        h.update(csv_util.dict_to_CLI_args(args).encode())
+        return h.hexdigest()
+
+
+class ResultCache(object):
+    """Maps cache keys of completed runs to their job directories."""
+
+    def __init__(self, cache_file: Path):
+        self.cache_file=Path(cache_file)
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self.connection=sqlite3.connect(str(self.cache_file))
+        self.connection.row_factory=sqlite3.Row
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def lookup(self, key: str):
+        """Returns the job directory of a completed run with `key`, or `None`.
+
+        Entries whose job directory no longer exists are dropped.
+        """
+        entry = self.connection.execute(
+            "SELECT job_directory FROM results WHERE key = ?", (key,)).fetchone()
+        if entry is None:
+            return None
+        job_directory = Path(entry["job_directory"])
+        with self.connection:
+            if not job_directory.exists():
+                self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            self.connection.execute(
+                "UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return job_directory
+
+    def add(self, key: str, job_directory: Path, experiment_id=None):
+        """Records a completed run."""
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?)",
+                (key, str(job_directory), experiment_id, now, now))
+
+    def ingest(self, registry):
+        """Adds completed entries of `registry` (a `registry.JobRegistry`) to the cache."""
+        now = time.time()
+        entries = [
+            (e["cache_key"], e["job_directory"], e["experiment_id"], now, now)
+            for e in registry.query(states=["COMPLETED"]) if e["cache_key"] is not None
+        ]
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany("INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?)", entries)
+            return self.connection.total_changes - before
+
+    def evict(self, max_age: float=None, max_bytes: int=None, delete_outputs: bool=False):
+        """Evicts entries older than `max_age` seconds, then least recently used job
+        directories until the outputs of all entries use at most `max_bytes`.
+
+        args:
+            delete_outputs: If `True`, also deletes the job directories of evicted entries.
+
+        returns:
+            evicted: number of evicted entries.
+        """
+        evicted_directories = set()
+        with self.connection:
+            before = self.connection.total_changes
+            if max_age is not None:
+                cutoff = time.time() - max_age
+                evicted_directories.update(r["job_directory"] for r in self.connection.execute(
+                    "SELECT DISTINCT job_directory FROM results WHERE created_at < ?", (cutoff,)))
+                self.connection.execute("DELETE FROM results WHERE created_at < ?", (cutoff,))
+
+            if max_bytes is not None:
+                # Rows of a job array share a job directory, so sizes are counted per directory.
+                directories = self.connection.execute(
+                    "SELECT job_directory, MAX(last_used) AS last_used FROM results "
+                    "GROUP BY job_directory ORDER BY last_used").fetchall()
+                sizes = [directory_size(Path(d["job_directory"])) for d in directories]
+                total = sum(sizes)
+                for d, size in zip(directories, sizes):
+                    if total <= max_bytes:
+                        break
+                    self.connection.execute(
+                        "DELETE FROM results WHERE job_directory = ?", (d["job_directory"],))
+                    evicted_directories.add(d["job_directory"])
+                    total -= size
+            evicted = self.connection.total_changes - before
+
+        if delete_outputs:
+            for job_directory in evicted_directories:
+                still_used = self.connection.execute(
+                    "SELECT 1 FROM results WHERE job_directory = ? LIMIT 1", (job_directory,)).fetchone()
+                if still_used is None:
+                    shutil.rmtree(job_directory, ignore_errors=True)
+        return evicted
+
+
+def directory_size(directory: Path):
+    """Returns the total size in bytes of files under `directory`."""
+    total = 0
+    stack = [directory]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+    return total
@@ -0,0 +1,494 @@
+"""Command line tools to inspect and manage launched sweeps."""
+
+import argparse
+import json
+from pathlib import Path
+import sys
+import time
+
+from slurm_tools import benchmark as launch_benchmark
+from slurm_tools import cache as result_cache
+from slurm_tools import launch_python_jobs_array
+from slurm_tools import logs as job_logs
+from slurm_tools import monitor
+from slurm_tools import partitions as job_partitions
+from slurm_tools import profiles as job_profiles
+from slurm_tools import registry as job_registry
+from slurm_tools import results as job_results
+from slurm_tools import retry as job_retry
+from slurm_tools import rightsize as job_rightsize
+from slurm_tools import submit
+from slurm_tools import timing as job_timing
+
+
+_DEFAULT_JOB_OUTPUT_DIRECTORY = Path.home().joinpath("job_logs")
+_SECONDS_PER_DAY = 24 * 60 * 60
+_BYTES_PER_GB = 1024 ** 3
+_JOB_COLUMNS = ("job_id", "array_index", "row_index", "experiment_id", "state", "job_directory")
+
+
+def _open_registry(args):
+    """Opens registry given by `--registry_file` or the default in `--job_output_directory`."""
+    registry_file = args.registry_file or job_registry.default_registry_file(args.job_output_directory)
+    return job_registry.JobRegistry(registry_file)
+
+
+def jobs(args):
+    """Prints registry entries."""
+    registry = _open_registry(args)
+    entries = registry.query(sweep_directory=args.sweep_directory, states=args.state, job_id=args.job_id)
+    print("\t".join(_JOB_COLUMNS))
+    for e in entries:
+        print("\t".join(str(e[c]) for c in _JOB_COLUMNS))
+
+
+def refresh(args):
+    """Updates registry entries with their state from `sacct`."""
+    registry = _open_registry(args)
+    count = registry.refresh(sweep_directory=args.sweep_directory)
+    print(f"Refreshed {count} jobs.")
+
+
+def resubmit(args):
+    """Resubmits failed rows, optionally following the sweep to retry rows as they fail."""
+    registry = _open_registry(args)
+    states = args.state or job_registry.FAILED_STATES
+    policy = None
+    if args.max_attempts is not None or args.backoff or args.follow:
+        policy = job_retry.RetryPolicy(args.max_attempts, args.backoff, args.backoff_factor)
+    submitter = submit.SbatchSubmitter()
+    while True:
+        if args.refresh:
+            registry.refresh(sweep_directory=args.sweep_directory)
+        count = launch_python_jobs_array.resubmit_failed(
+            registry,
+            sweep_directory=args.sweep_directory,
+            states=states,
+            max_concurrent=args.max_concurrent,
+            test=args.test,
+            submitter=submitter,
+            policy=policy,
+        )
+        print(f"{time.strftime('%H:%M:%S')} Resubmitted {count} rows.", flush=True)
+        if not args.follow or args.test:
+            return
+        waiting = launch_python_jobs_array.awaiting_retry(registry, policy, args.sweep_directory, states)
+        if not waiting and not registry.unfinished_job_ids(args.sweep_directory):
+            return
+        time.sleep(args.interval)
+
+
+def cache(args):
+    """Adds completed runs from the registry to the result cache and evicts old entries."""
+    registry = _open_registry(args)
+    if args.refresh:
+        registry.refresh()
+    results = result_cache.ResultCache(
+        args.cache_file or result_cache.default_cache_file(args.job_output_directory))
+    print(f"Added {results.ingest(registry)} completed runs.")
+    if args.max_age_days is not None or args.max_gb is not None:
+        evicted = results.evict(
+            max_age=None if args.max_age_days is None else args.max_age_days * _SECONDS_PER_DAY,
+            max_bytes=None if args.max_gb is None else args.max_gb * _BYTES_PER_GB,
+            delete_outputs=args.delete_outputs,
+        )
+        print(f"Evicted {evicted} runs.")
+
+
+def watch(args):
+    """Prints counts of pending/running/completed/failed jobs until all finished."""
+    registry = None
+    job_ids = args.job_ids
+    if job_ids is None:
+        registry = _open_registry(args)
+        entries = registry.query(sweep_directory=args.sweep_directory, states=args.state)
+        job_ids = {e["job_id"] for e in entries if e["job_id"] is not None}
+
+    runner = monitor.run_command
+    if args.squeue_output is not None or args.sacct_output is not None:
+        # Replay recorded command output.
+        runner = monitor.RecordedOutput({
+            "squeue": Path(args.squeue_output).read_text() if args.squeue_output else "",
+            "sacct": Path(args.sacct_output).read_text() if args.sacct_output else "",
+        })
+    sweep_monitor = monitor.SweepMonitor(job_ids, runner=runner)
+
+    def _report(counts):
+        print(f"{time.strftime('%H:%M:%S')} {monitor.format_counts(counts)}", flush=True)
+        if registry is not None:
+            registry.update_states(sweep_monitor.states)
+
+    if args.once:
+        sweep_monitor.poll()
+        _report(sweep_monitor.counts())
+        return
+    sweep_monitor.watch(
+        interval=args.interval, max_interval=args.max_interval, backoff=args.backoff, callback=_report)
+
+
+def logs(args):
+    """Prints the tails of, follows or searches the logs of all jobs in a sweep."""
+    streams = tuple(args.stream)
+    if args.search is not None:
+        results = job_logs.search_sweep(args.sweep_directory, args.search, streams, args.max_matches)
+        for job, matches in results.items():
+            print(f"==> {job} <==")
+            for stream, line_number, line in matches:
+                print(f"{stream}:{line_number}: {line.decode(errors='replace')}")
+        print(f"{sum(len(m) for m in results.values())} matches in {len(results)} jobs.")
+        return
+
+    if args.follow:
+        follower = job_logs.LogFollower(args.sweep_directory, streams)
+        for log, data in follower.follow(interval=args.interval):
+            for line in data.decode(errors="replace").splitlines():
+                print(f"[{log.job} {log.stream}] {line}", flush=True)
+        return
+
+    for log in job_logs.iter_log_files(args.sweep_directory, streams):
+        print(f"==> {log.job} ({log.stream}) <==")
+        if args.tail == 0:
+            # Whole logs may be large, so they are copied rather than read into memory.
+            sys.stdout.flush()
+            job_logs.copy(log.path, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+        else:
+            print(job_logs.tail(log.path, args.tail).decode(errors="replace"))
+
+
+def rightsize(args):
+    """Records resource usage of finished jobs and recommends `time` and `mem_per_cpu`."""
+    registry = _open_registry(args)
+    if args.sacct_output is not None:
+        # Saved output of `sacct --parsable2`, e.g. to work offline.
+        usage = job_rightsize.parse_sacct_usage(Path(args.sacct_output).read_text())
+        registry.record_usage(usage)
+        print(f"Recorded usage of {len(usage)} jobs.")
+    elif args.fetch:
+        print(f"Queried usage of {job_rightsize.refresh_usage(registry)} jobs.")
+    if args.script is None:
+        return
+
+    recommendation = job_rightsize.recommend(
+        registry.usage(script=args.script, job_name=args.job_name, script_args=args.script_args),
+        safety_margin=args.safety_margin,
+        quantile=args.quantile,
+    )
+    print(f"Recommendation from {recommendation['jobs']} completed jobs: "
+          f"time={recommendation['time']} mem_per_cpu={recommendation['mem_per_cpu']}")
+    if args.slurm_args is not None:
+        print(json.dumps(job_rightsize.right_size(args.slurm_args, recommendation)))
+
+
+def timing(args):
+    """Reports percentiles of the startup phases of instrumented jobs in a sweep."""
+    durations = job_timing.sweep_durations(args.sweep_directory)
+    summary = job_timing.summarize(durations, args.percentiles)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    columns = ["count", *(f"p{q:g}" for q in args.percentiles)]
+    print("\t".join(["phase", *columns]))
+    for phase, stats in summary.items():
+        print("\t".join([phase, str(stats["count"]), *(f"{stats[c]:.3f}" for c in columns[1:])]))
+
+
+def collect(args):
+    """Appends new results of the jobs in a sweep, joined with their rows, to a columnar store."""
+    collected, invalid = job_results.collect(
+        args.sweep_directory,
+        script_args=args.script_args,
+        store_directory=args.store_directory,
+        store_format=args.format,
+        workers=args.workers,
+        chunk_rows=args.chunk_rows,
+    )
+    store_directory = args.store_directory or job_results.default_store_directory(args.sweep_directory)
+    print(f"Collected {collected} new results into {store_directory}.")
+    if invalid:
+        print(f"Skipped {invalid} results that are not valid JSON.")
+
+
+def _format_estimate(seconds):
+    """Formats estimated seconds as `HH:MM:SS`, `0` if none."""
+    return job_rightsize.format_time(seconds) if seconds > 0 else "0"
+
+
+def partitions(args):
+    """Estimates when jobs would start and finish on each partition, from one snapshot of the cluster."""
+    runner = monitor.run_command
+    if args.sinfo_output is not None:
+        # Recorded output, e.g. to work offline.
+        runner = job_partitions.recorded_runner(args.sinfo_output, args.squeue_output, args.sshare_output)
+    snapshot = job_partitions.read_snapshot(runner)
+    chooser = job_partitions.PartitionChooser(snapshot, args.partitions or list(snapshot.partitions))
+    slurm_args = {"time": args.time, "cpu_count": args.cpu_count}
+    cpus, seconds = job_partitions.requested_resources({}, slurm_args)
+    eligible = chooser.eligible(cpus, seconds)
+    counts = dict.fromkeys(eligible, 0)
+    for row in chooser.assign(({} for _ in range(args.count)), slurm_args, args.chunk_size):
+        counts[row[job_partitions.PARTITION]] += 1
+    fairshare = "unknown" if snapshot.fairshare is None else f"{snapshot.fairshare:.3f}"
+    print(f"fairshare={fairshare}")
+    print("\t".join(["partition", "idle_cpus", "total_cpus", "pending_cpus", "start", "slots", "rows", "finish"]))
+    for name in eligible:
+        state = snapshot.partitions[name]
+        print("\t".join(str(c) for c in [
+            name,
+            state.idle_cpus,
+            state.total_cpus,
+            state.pending_cpus,
+            _format_estimate(chooser.estimate_start(name, cpus)),
+            chooser.slots(name, cpus),
+            counts[name],
+            _format_estimate(chooser.estimate_finish(name, counts[name], cpus, seconds)),
+        ]))
+    ineligible = [p for p in chooser.partitions if p not in eligible]
+    if ineligible:
+        print(f"Cannot run {cpus} cpus for {args.time}: {' '.join(ineligible)}")
+
+
+def profile(args):
+    """Merges the profiles of a sweep, or of some of its rows, into one ranked hotspot report."""
+    report = job_profiles.profile_sweep(
+        args.sweep_directory,
+        experiment_ids=args.experiment_ids,
+        sort=args.sort,
+        limit=args.limit,
+        percentiles=args.percentiles,
+        stats_file=args.output,
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"Merged the profiles of {report['jobs']} jobs.")
+    if report["unreadable"]:
+        print(f"Skipped {report['unreadable']} profiles that could not be read.")
+    if report["usage"]:
+        columns = ["count", *(f"p{q:g}" for q in args.percentiles)]
+        print("\t".join(["usage", *columns]))
+        for field, stats in report["usage"].items():
+            print("\t".join([field, str(stats["count"]), *(f"{stats[c]:.3f}" for c in columns[1:])]))
+    if report["functions"]:
+        print("\t".join(["calls", "tottime", "cumtime", "fraction", "function"]))
+        for f in report["functions"]:
+            calls = str(f["calls"]) if f["calls"] == f["primitive_calls"] else f"{f['calls']}/{f['primitive_calls']}"
+            print("\t".join([
+                calls, f"{f['tottime']:.3f}", f"{f['cumtime']:.3f}", f"{f['fraction']:.3f}", f["function"]]))
+    if report["samples"]:
+        print("\t".join(["self", "total", "self_fraction", "total_fraction", "function"]))
+        for f in report["samples"]:
+            print("\t".join([
+                str(f["self"]), str(f["total"]), f"{f['self_fraction']:.3f}", f"{f['total_fraction']:.3f}",
+                f["function"]]))
+
+
+def _format_bytes(n):
+    """Formats a number of bytes in MiB."""
+    return f"{n / 2 ** 20:.1f}"
+
+
+def benchmark(args):
+    """Times csv parsing, rendering, directories and submission at several sweep sizes, against a fake slurm."""
+
+    def _report(result):
+        if not args.json:
+            print("\t".join(str(c) for c in [
+                result["phase"],
+                result["size"],
+                result["rows"],
+                f"{result['seconds']:.3f}",
+                f"{result['rows_per_second']:.0f}" if result["rows_per_second"] else "-",
+                _format_bytes(result["peak_rss_bytes"]),
+                _format_bytes(result["rss_growth_bytes"]),
+            ]), flush=True)
+
+    if not args.json:
+        print("\t".join(["phase", "size", "rows", "seconds", "rows_per_second", "peak_rss_mib", "rss_growth_mib"]))
+    report = launch_benchmark.run_benchmarks(
+        sizes=args.sizes,
+        phases=args.phases,
+        directory=args.directory,
+        repeat=args.repeat,
+        latency=args.latency,
+        submit_workers=args.submit_workers,
+        max_submissions=args.max_submissions,
+        shard_levels=args.shard_levels,
+        shard_width=args.shard_width,
+        progress=_report,
+    )
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    if args.baseline is None:
+        return
+    comparisons = launch_benchmark.compare(report, json.loads(args.baseline.read_text()), args.tolerance)
+    if not args.json:
+        print("\t".join(["phase", "size", "baseline", "current", "ratio"]))
+        for c in comparisons:
+            print("\t".join([
+                c["phase"], str(c["size"]), f"{c['baseline']:.0f}", f"{c['current']:.0f}",
+                f"{c['ratio']:.2f}" + (" REGRESSED" if c["regressed"] else ""),
+            ]))
+    if any(c["regressed"] for c in comparisons):
+        raise SystemExit(1)
+
+
+def _add_registry_args(parser):
+    """Arguments shared by commands that read the registry."""
+    parser.add_argument("--job_output_directory", type=Path, default=_DEFAULT_JOB_OUTPUT_DIRECTORY)
+    parser.add_argument("--registry_file", type=str, default=None)
+    parser.add_argument("--sweep_directory", type=str, default=None)
+    parser.add_argument("--state", type=str, nargs="+", default=None)
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(required=True)
+
+    jobs_parser = subparsers.add_parser("jobs", help=jobs.__doc__)
+    _add_registry_args(jobs_parser)
+    jobs_parser.add_argument("--job_id", type=str, default=None)
+    jobs_parser.set_defaults(func=jobs)
+
+    refresh_parser = subparsers.add_parser("refresh", help=refresh.__doc__)
+    _add_registry_args(refresh_parser)
+    refresh_parser.set_defaults(func=refresh)
+
+    resubmit_parser = subparsers.add_parser("resubmit", help=resubmit.__doc__)
+    _add_registry_args(resubmit_parser)
+    resubmit_parser.add_argument("--refresh", action=argparse.BooleanOptionalAction, default=True)
+    resubmit_parser.add_argument("--max_concurrent", type=int, default=None)
+    resubmit_parser.add_argument("--test", action=argparse.BooleanOptionalAction, default=False)
+    # Retry policy: attempts per row, including the first, and seconds to wait after a failure.
+    resubmit_parser.add_argument("--max_attempts", type=int, default=None)
+    resubmit_parser.add_argument("--backoff", type=float, default=0)
+    resubmit_parser.add_argument("--backoff_factor", type=float, default=job_retry.DEFAULT_BACKOFF_FACTOR)
+    # Keep refreshing and resubmitting until all rows completed or used their attempts.
+    resubmit_parser.add_argument("--follow", action=argparse.BooleanOptionalAction, default=False)
+    resubmit_parser.add_argument("--interval", type=float, default=60)
+    resubmit_parser.set_defaults(func=resubmit)
+
+    cache_parser = subparsers.add_parser("cache", help=cache.__doc__)
+    _add_registry_args(cache_parser)
+    cache_parser.add_argument("--cache_file", type=str, default=None)
+    cache_parser.add_argument("--refresh", action=argparse.BooleanOptionalAction, default=True)
+    cache_parser.add_argument("--max_age_days", type=float, default=None)
+    cache_parser.add_argument("--max_gb", type=float, default=None)
+    cache_parser.add_argument("--delete_outputs", action=argparse.BooleanOptionalAction, default=False)
+    cache_parser.set_defaults(func=cache)
+
+    watch_parser = subparsers.add_parser("watch", help=watch.__doc__)
+    _add_registry_args(watch_parser)
+    watch_parser.add_argument("--job_ids", type=str, nargs="+", default=None)
+    watch_parser.add_argument("--interval", type=float, default=10)
+    watch_parser.add_argument("--max_interval", type=float, default=300)
+    watch_parser.add_argument("--backoff", type=float, default=1.5)
+    watch_parser.add_argument("--once", action=argparse.BooleanOptionalAction, default=False)
+    watch_parser.add_argument("--squeue_output", type=str, default=None)
+    watch_parser.add_argument("--sacct_output", type=str, default=None)
+    watch_parser.set_defaults(func=watch)
+
+    logs_parser = subparsers.add_parser("logs", help=logs.__doc__)
+    logs_parser.add_argument("sweep_directory", type=Path)
+    logs_parser.add_argument(
+        "--stream", choices=[job_logs.OUTPUT, job_logs.ERROR], nargs="+",
+        default=[job_logs.OUTPUT, job_logs.ERROR])
+    # Number of last lines of each log to print, 0 prints whole logs.
+    logs_parser.add_argument("--tail", type=int, default=10)
+    logs_parser.add_argument("--search", type=str, default=None)
+    logs_parser.add_argument("--max_matches", type=int, default=None)
+    logs_parser.add_argument("--follow", action=argparse.BooleanOptionalAction, default=False)
+    logs_parser.add_argument("--interval", type=float, default=2)
+    logs_parser.set_defaults(func=logs)
+
+    rightsize_parser = subparsers.add_parser("rightsize", help=rightsize.__doc__)
+    rightsize_parser.add_argument("--job_output_directory", type=Path, default=_DEFAULT_JOB_OUTPUT_DIRECTORY)
+    rightsize_parser.add_argument("--registry_file", type=str, default=None)
+    rightsize_parser.add_argument("--sacct_output", type=str, default=None)
+    rightsize_parser.add_argument("--fetch", action=argparse.BooleanOptionalAction, default=True)
+    # Group of past jobs to recommend resources for.
+    rightsize_parser.add_argument("--script", type=str, default=None)
+    rightsize_parser.add_argument("--job_name", type=str, default=None)
+    rightsize_parser.add_argument("--script_args", type=json.loads, default=None)
+    rightsize_parser.add_argument("--safety_margin", type=float, default=job_rightsize.DEFAULT_SAFETY_MARGIN)
+    rightsize_parser.add_argument("--quantile", type=float, default=1.0)
+    # Prints `slurm_args` with tightened requests.
+    rightsize_parser.add_argument("--slurm_args", type=json.loads, default=None)
+    rightsize_parser.set_defaults(func=rightsize)
+
+    timing_parser = subparsers.add_parser("timing", help=timing.__doc__)
+    timing_parser.add_argument("sweep_directory", type=Path)
+    timing_parser.add_argument(
+        "--percentiles", type=float, nargs="+", default=list(job_timing.DEFAULT_PERCENTILES))
+    timing_parser.add_argument("--json", action=argparse.BooleanOptionalAction, default=False)
+    timing_parser.set_defaults(func=timing)
+
+    collect_parser = subparsers.add_parser("collect", help=collect.__doc__)
+    collect_parser.add_argument("sweep_directory", type=Path)
+    # Csv or sweep spec of the sweep, joined with the results by `experiment_id`.
+    collect_parser.add_argument("--script_args", type=str, default=None)
+    collect_parser.add_argument("--store_directory", type=Path, default=None)
+    collect_parser.add_argument("--format", choices=job_results.FORMATS, default=None)
+    collect_parser.add_argument("--workers", type=int, default=None)
+    collect_parser.add_argument("--chunk_rows", type=int, default=job_results.DEFAULT_CHUNK_ROWS)
+    collect_parser.set_defaults(func=collect)
+
+    partitions_parser = subparsers.add_parser("partitions", help=partitions.__doc__)
+    # Acceptable partitions, by default all partitions of `sinfo`.
+    partitions_parser.add_argument("--partitions", type=str, nargs="+", default=None)
+    partitions_parser.add_argument("--time", type=str, required=True)
+    partitions_parser.add_argument("--cpu_count", type=int, default=1)
+    # Number of rows to spread over the partitions, `--chunk_size` at a time.
+    partitions_parser.add_argument("--count", type=int, default=1)
+    partitions_parser.add_argument("--chunk_size", type=int, default=1)
+    partitions_parser.add_argument("--sinfo_output", type=str, default=None)
+    partitions_parser.add_argument("--squeue_output", type=str, default=None)
+    partitions_parser.add_argument("--sshare_output", type=str, default=None)
+    partitions_parser.set_defaults(func=partitions)
+
+    profile_parser = subparsers.add_parser("profile", help=profile.__doc__)
+    profile_parser.add_argument("sweep_directory", type=Path)
+    # Only merge the profiles of these rows.
+    profile_parser.add_argument("--experiment_ids", type=str, nargs="+", default=None)
+    profile_parser.add_argument("--sort", choices=job_profiles.SORT_KEYS, default=job_profiles.TOTTIME)
+    profile_parser.add_argument("--limit", type=int, default=job_profiles.DEFAULT_LIMIT)
+    profile_parser.add_argument(
+        "--percentiles", type=float, nargs="+", default=list(job_timing.DEFAULT_PERCENTILES))
+    # Saves the merged `cProfile` stats, e.g. for `snakeviz`.
+    profile_parser.add_argument("--output", type=Path, default=None)
+    profile_parser.add_argument("--json", action=argparse.BooleanOptionalAction, default=False)
+    profile_parser.set_defaults(func=profile)
+
+    benchmark_parser = subparsers.add_parser("benchmark", help=benchmark.__doc__)
+    benchmark_parser.add_argument("--sizes", type=int, nargs="+", default=list(launch_benchmark.DEFAULT_SIZES))
+    benchmark_parser.add_argument(
+        "--phases", choices=launch_benchmark.PHASES, nargs="+", default=list(launch_benchmark.PHASES))
+    # Directory for the generated sweeps, kept afterwards. By default a temporary directory.
+    benchmark_parser.add_argument("--directory", type=Path, default=None)
+    benchmark_parser.add_argument("--repeat", type=int, default=1)
+    # Seconds each call of fake `sbatch` takes.
+    benchmark_parser.add_argument("--latency", type=float, default=0.0)
+    benchmark_parser.add_argument("--submit_workers", type=int, default=4)
+    benchmark_parser.add_argument("--max_submissions", type=int, default=launch_benchmark.DEFAULT_MAX_SUBMISSIONS)
+    benchmark_parser.add_argument("--shard_levels", type=int, default=0)
+    benchmark_parser.add_argument("--shard_width", type=int, default=2)
+    benchmark_parser.add_argument("--json", action=argparse.BooleanOptionalAction, default=False)
+    benchmark_parser.add_argument("--output", type=Path, default=None)
+    # Report of a previous run to compare throughput against, exits with status 1 on a regression.
+    benchmark_parser.add_argument("--baseline", type=Path, default=None)
+    benchmark_parser.add_argument("--tolerance", type=float, default=launch_benchmark.DEFAULT_TOLERANCE)
+    benchmark_parser.set_defaults(func=benchmark)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
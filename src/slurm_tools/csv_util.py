@@ -25,52 +25,72 @@ def _maybe_none(line):
 
 
 # TODO: Handle blank entries.
-def parse_csv(file, headerline=0, skiplines=None, readcolumns=None, **kwargs):
-    """Parses csv and returns a list of `dict` for each line.
+def iter_csv(file, headerline=0, skiplines=None, readcolumns=None, newline='', **kwargs):
+    """Lazily yields a `dict` for each line of csv.
 
+    Lines are read one at a time so memory use does not grow with the size of `file`.
     The keys of the dict are given by the entries in columns of `headerline`.
 
     args:
         file: Path to csv file.
         headerline: int, specifies line that contains dictionary keys.
         skiplines: Optionally, specifies rows of csv to skip.
-        columns: Optionally, specify columns to read. Should be a valid list Selection.
+        readcolumns: Optionally, specify columns to read. Should be a valid list Selection.
 
-    returns:
-        csv_args: `List` of `dict` containing parsed csv entries.
+    yields:
+        `dict` containing parsed csv entries of a single line.
     """
-    if skiplines is None:
-        skiplines = []
+    skiplines = [] if skiplines is None else list(skiplines)
+    skiplines.append(headerline)
+    if check_duplicate(skiplines):
+        raise ValueError("`skiplines` contains duplicates.")
+    skiplines = set(skiplines)
 
-    csv_lines = read_csv(file)
+    keys = None
+    # Lines that occur before `headerline` are held until the keys are known.
+    before_header = []
+    with open(file, newline=newline) as csvfile:
+        reader = csv.reader(csvfile, delimiter=',')
+        for i, line in enumerate(reader):
+            # Select columns.
+            if readcolumns is not None:
+                line = line[readcolumns]
+            if i == headerline:
+                keys = line
+                for held_line in before_header:
+                    yield dict(zip(keys, _maybe_none(held_line)))
+                before_header = None
+            elif i in skiplines:
+                continue
+            elif keys is None:
+                before_header.append(line)
+            else:
+                yield dict(zip(keys, _maybe_none(line)))
 
-    # Select columns.
-    if readcolumns is not None:
-        csv_lines = [c[readcolumns] for c in csv_lines]
+    if keys is None:
+        raise ValueError(f"`headerline` {headerline} not found in {file}.")
 
-    # Get keys.
-    keys = csv_lines[headerline]
 
-    skiplines.append(headerline)
-    if check_duplicate(skiplines):
-        raise ValueError("`skiplines` contains duplicates.")
+def parse_csv(file, headerline=0, skiplines=None, readcolumns=None, **kwargs):
+    """Parses csv and returns a list of `dict` for each line.
 
-    # Remove ignore lines.
-    [csv_lines.pop(i) for i in sorted(skiplines, reverse=True)]
+    See `iter_csv` to read lines lazily.
 
-    # Parse `None`
-    csv_lines = [_maybe_none(line) for line in csv_lines]
+    args:
+        file: Path to csv file.
+        headerline: int, specifies line that contains dictionary keys.
+        skiplines: Optionally, specifies rows of csv to skip.
+        readcolumns: Optionally, specify columns to read. Should be a valid list Selection.
 
-    csv_args = []
-    for line in csv_lines:
-        csv_args.append(dict(zip(keys, line)))
-    return csv_args
+    returns:
+        csv_args: `List` of `dict` containing parsed csv entries.
+    """
+    return list(iter_csv(file, headerline=headerline, skiplines=skiplines, readcolumns=readcolumns))
 
 
 def check_duplicate(a):
     """Returns `True` if `a` contains duplicate items."""
-    d = set([x for x in a if a.count(x) > 1])
-    return len(d) > 0
+    return len(set(a)) != len(a)
 
 
 def dict_to_CLI_args(
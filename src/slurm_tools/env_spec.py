@@ -0,0 +1,78 @@
+"""Conda environments built by `setup_tools/create_env.sh`, keyed by the hash of their package specs.
+
+`create_env.sh` builds each environment in `{ENV_CACHE}/{ENV_NAME}-{SPEC_HASH}`, writes the
+sorted package specs to `conda-meta/slurm_tools_spec` once the build is complete and links
+`{ENV_CACHE}/{ENV_NAME}` to the latest build. Archives made with `--pack` are named
+`{ENV_NAME}-{SPEC_HASH}.tar.gz`.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+from slurm_tools import sbatch_command as scommand
+
+SPEC_FILE_NAME=os.path.join("conda-meta", "slurm_tools_spec")
+# Touched when an environment is used, for the eviction of `create_env.sh`.
+LAST_USED_FILE_NAME=os.path.join("conda-meta", "slurm_tools_last_used")
+_HASH_LENGTH=16
+
+
+def spec_hash(packages):
+    """Returns the hash of package specs as `create_env.sh` computes it.
+
+    args:
+        packages: specs separated by whitespace, as passed to `--packages`, or a list.
+    """
+    if isinstance(packages, str):
+        packages = packages.split()
+    spec = "\n".join(sorted(set(packages))) + "\n"
+    return hashlib.sha256(spec.encode()).hexdigest()[:_HASH_LENGTH]
+
+
+def is_env_path(env_name):
+    """Returns `True` if `env_name` is a path (an environment prefix or archive) rather than a name."""
+    return os.sep in str(env_name)
+
+
+def read_spec(prefix: Path):
+    """Returns the package specs of the environment at `prefix`, `None` if it is not a complete build."""
+    try:
+        with open(Path(prefix).joinpath(SPEC_FILE_NAME)) as f:
+            return f.read().split()
+    except FileNotFoundError:
+        return None
+
+
+def env_spec_hash(env_name):
+    """Returns the spec hash of an environment prefix or archive, `None` if it has none."""
+    path = Path(env_name)
+    name = path.name
+    for suffix in scommand.stageCondaPack.PACK_SUFFIXES:
+        if name.endswith(suffix):
+            # The archive itself has no spec, only its name.
+            _, _, digest = name[:-len(suffix)].rpartition("-")
+            return digest if len(digest) == _HASH_LENGTH else None
+    spec = read_spec(path)
+    return None if spec is None else spec_hash(spec)
+
+
+def verify_env(env_name, expected_hash: str):
+    """Raises `ValueError` unless `env_name` is a complete build with spec hash `expected_hash`.
+
+    Marks the environment as used, so that it is not evicted from the cache of `create_env.sh`.
+    """
+    if not is_env_path(env_name):
+        raise ValueError(
+            f"Cannot verify environment `{env_name}` by name, use the path of its prefix or archive.")
+    actual_hash = env_spec_hash(env_name)
+    if actual_hash is None:
+        raise ValueError(
+            f"Environment `{env_name}` has no spec hash, it may still be building with `create_env.sh`.")
+    if actual_hash != expected_hash:
+        raise ValueError(
+            f"Environment `{env_name}` was built from spec {actual_hash}, not {expected_hash}. "
+            "Rebuild it with `create_env.sh`.")
+    last_used = Path(env_name).joinpath(LAST_USED_FILE_NAME)
+    if last_used.parent.is_dir():
+        last_used.touch()
@@ -0,0 +1,230 @@
+"""A local stand-in for `sbatch`, `squeue`, `sacct` and `scancel`, e.g. to benchmark or test launchers.
+
+`install` writes executables that run this file (it only uses the standard library) to a
+directory, to put first on `PATH` or pass as `sbatch_command`. `sbatch` records each submission
+in `submissions.tsv` of the state directory, waits `latency` seconds like a busy controller and
+prints a new job id. Jobs run for `runtime` seconds after they are submitted: `squeue` reports
+them as `RUNNING` until then and `sacct` as `COMPLETED` afterwards, unless cancelled.
+"""
+
+import fcntl
+import os
+from pathlib import Path
+import re
+import sys
+import time
+
+DIRECTORY_VARIABLE="FAKE_SLURM_DIRECTORY"
+LATENCY_VARIABLE="FAKE_SLURM_LATENCY"
+RUNTIME_VARIABLE="FAKE_SLURM_RUNTIME"
+SUBMISSIONS_FILE_NAME="submissions.tsv"
+COMMANDS=("sbatch", "squeue", "sacct", "scancel")
+_COUNTER_FILE_NAME="last_job_id"
+_CANCELLED_FILE_NAME="cancelled.txt"
+_FIRST_JOB_ID=1000
+_ARRAY_PATTERN = re.compile(r"#SBATCH\s+--array[= ](\S+)")
+_SQUEUE_FIELD_PATTERN = re.compile(r"%[.\d]*(\w)")
+_EXECUTABLE = """#!/bin/sh
+{directory}="${{{directory}:-{state_directory}}}" \\
+{latency}="${{{latency}:-{latency_value}}}" \\
+{runtime}="${{{runtime}:-{runtime_value}}}" \\
+exec "{python}" -S "{script}" {command} "$@"
+"""
+
+
+def install(bin_directory: Path, state_directory: Path=None, latency: float=0.0, runtime: float=0.0):
+    """Writes fake `sbatch`, `squeue`, `sacct` and `scancel` executables to `bin_directory`.
+
+    args:
+        state_directory: Directory of the submission log, by default `bin_directory`.
+        latency: Seconds each `sbatch` call waits before printing its job id.
+        runtime: Seconds each job runs after it is submitted.
+
+    returns:
+        `dict` of command name to the path of its executable.
+    """
+    bin_directory = Path(bin_directory).absolute()
+    state_directory = Path(state_directory or bin_directory).absolute()
+    bin_directory.mkdir(parents=True, exist_ok=True)
+    state_directory.mkdir(parents=True, exist_ok=True)
+    executables = {}
+    for command in COMMANDS:
+        executable = bin_directory.joinpath(command)
+        executable.write_text(_EXECUTABLE.format(
+            directory=DIRECTORY_VARIABLE,
+            state_directory=state_directory,
+            latency=LATENCY_VARIABLE,
+            latency_value=latency,
+            runtime=RUNTIME_VARIABLE,
+            runtime_value=runtime,
+            python=sys.executable,
+            script=Path(__file__).absolute(),
+            command=command,
+        ))
+        executable.chmod(0o755)
+        executables[command] = executable
+    return executables
+
+
+def read_submissions(state_directory: Path):
+    """Returns the submissions recorded by fake `sbatch`, in order.
+
+    returns:
+        `List` of `dict` with `job_id`, `time` (epoch seconds), `array` (e.g. `0-9%2`, or
+        `None`), `sbatch_file` and `args` (the other arguments of `sbatch`).
+    """
+    path = Path(state_directory).joinpath(SUBMISSIONS_FILE_NAME)
+    if not path.exists():
+        return []
+    submissions = []
+    with path.open() as f:
+        for line in f:
+            job_id, submit_time, array, sbatch_file, args = line.rstrip("\n").split("\t")
+            submissions.append({
+                "job_id": job_id,
+                "time": float(submit_time),
+                "array": array or None,
+                "sbatch_file": sbatch_file,
+                "args": args.split(" ") if args else [],
+            })
+    return submissions
+
+
+def _expand_array(job_id, array):
+    """Returns the slurm ids of the tasks of `array` (e.g. `0-3,7%2`), or `[job_id]`."""
+    if array is None:
+        return [job_id]
+    ids = []
+    for r in array.split("%")[0].split(","):
+        first, _, last = r.partition("-")
+        ids.extend(f"{job_id}_{i}" for i in range(int(first), int(last or first) + 1))
+    return ids
+
+
+def _next_job_id(state_directory):
+    """Increments the job id counter of `state_directory` under a lock."""
+    with open(state_directory.joinpath(_COUNTER_FILE_NAME), "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        last = f.read().strip()
+        job_id = int(last) + 1 if last else _FIRST_JOB_ID
+        f.seek(0)
+        f.truncate()
+        f.write(str(job_id))
+    return str(job_id)
+
+
+def sbatch(args, state_directory, latency):
+    """Records the submission of the sbatch file, the last of `args`, and prints its job id."""
+    if not args:
+        print("sbatch: error: no sbatch file given", file=sys.stderr)
+        return 1
+    sbatch_file = Path(args[-1])
+    if not sbatch_file.exists():
+        print(f"sbatch: error: Unable to open file {sbatch_file}", file=sys.stderr)
+        return 1
+    options = [a for a in args[:-1] if a != "--parsable"]
+    array = None
+    for line in sbatch_file.read_text().splitlines():
+        match = _ARRAY_PATTERN.match(line.strip())
+        if match is not None:
+            array = match[1]
+    for option in options:
+        if option.startswith("--array="):
+            array = option.split("=", 1)[1]
+    time.sleep(latency)
+    job_id = _next_job_id(state_directory)
+    with open(state_directory.joinpath(SUBMISSIONS_FILE_NAME), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(f"{job_id}\t{time.time()}\t{array or ''}\t{sbatch_file.absolute()}\t{' '.join(options)}\n")
+    print(job_id if "--parsable" in args else f"Submitted batch job {job_id}")
+    return 0
+
+
+def _states(state_directory, runtime):
+    """Returns `dict` of slurm id to state of all submitted jobs."""
+    cancelled_file = state_directory.joinpath(_CANCELLED_FILE_NAME)
+    cancelled = set(cancelled_file.read_text().split()) if cancelled_file.exists() else set()
+    now = time.time()
+    states = {}
+    for submission in read_submissions(state_directory):
+        for slurm_id in _expand_array(submission["job_id"], submission["array"]):
+            if slurm_id in cancelled or submission["job_id"] in cancelled:
+                states[slurm_id] = "CANCELLED"
+            elif now - submission["time"] < runtime:
+                states[slurm_id] = "RUNNING"
+            else:
+                states[slurm_id] = "COMPLETED"
+    return states
+
+
+def _option(args, flags):
+    """Returns the value of the first of `flags` in `args` (`--flag=value` or `-f value`), `None` if missing."""
+    for i, arg in enumerate(args):
+        for flag in flags:
+            if arg.startswith(f"{flag}="):
+                return arg.split("=", 1)[1]
+            if arg == flag and i + 1 < len(args):
+                return args[i + 1]
+    return None
+
+
+def squeue(args, state_directory, runtime):
+    """Prints the running jobs in the `%i` and `%T` fields of `-o`, other fields are blank."""
+    output_format = _option(args, ("-o", "--format")) or "%i %T"
+    for slurm_id, state in _states(state_directory, runtime).items():
+        if state == "RUNNING":
+            values = {"i": slurm_id, "T": state}
+            print(_SQUEUE_FIELD_PATTERN.sub(lambda m: values.get(m[1], ""), output_format))
+    return 0
+
+
+def sacct(args, state_directory, runtime):
+    """Prints the `JobID` and `State` fields of `--format` for `--jobs`, other fields are blank."""
+    fields = (_option(args, ("--format", "-o")) or "JobID,State").split(",")
+    jobs = _option(args, ("--jobs", "-j"))
+    jobs = set(jobs.split(",")) if jobs else None
+    separator = "|" if "--parsable2" in args or "-P" in args else " "
+    for slurm_id, state in _states(state_directory, runtime).items():
+        if jobs is not None and slurm_id not in jobs and slurm_id.split("_")[0] not in jobs:
+            continue
+        values = {"jobid": slurm_id, "state": state}
+        print(separator.join(values.get(field.lower(), "") for field in fields))
+    return 0
+
+
+def scancel(args, state_directory):
+    """Records the jobs of `args` as cancelled."""
+    with open(state_directory.joinpath(_CANCELLED_FILE_NAME), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        for job_id in args:
+            if not job_id.startswith("-"):
+                f.write(f"{job_id}\n")
+    return 0
+
+
+def main(argv=None):
+    """Runs `COMMAND ARGS...`, or `install BIN_DIRECTORY [LATENCY]` to write the executables."""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in (*COMMANDS, "install"):
+        print(f"usage: fake_slurm.py {{install,{','.join(COMMANDS)}}} ARGS...", file=sys.stderr)
+        return 2
+    command, args = argv[0], argv[1:]
+    if command == "install":
+        for executable in install(args[0], latency=float(args[1]) if len(args) > 1 else 0.0).values():
+            print(executable)
+        return 0
+    state_directory = Path(os.environ.get(DIRECTORY_VARIABLE, "."))
+    latency = float(os.environ.get(LATENCY_VARIABLE) or 0)
+    runtime = float(os.environ.get(RUNTIME_VARIABLE) or 0)
+    if command == "sbatch":
+        return sbatch(args, state_directory, latency)
+    if command == "squeue":
+        return squeue(args, state_directory, runtime)
+    if command == "sacct":
+        return sacct(args, state_directory, runtime)
+    return scancel(args, state_directory)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""Successive halving over the rows of a sweep, cancelling losing rows early.
+
+Jobs report intermediate metrics with `results.report(step, loss=...)`. The first time a row
+reports at or past a rung (e.g. epochs 1, 3 and 9), its metric is ranked against the rows that
+reached the rung before it: the row keeps running only if it is in the top `1 / reduction_factor`,
+and is otherwise cancelled. Rows are decided as they arrive, without waiting for a rung to fill
+(asynchronous successive halving, ASHA), so no job idles at a rung.
+
+`HalvingSweep` keeps at most `max_concurrent` rows queued or running, so the slots freed by
+cancelled rows go to rows that have not been launched yet. The scheduler is any object with the
+methods of `SlurmScheduler`, e.g. a fake one that writes synthetic metric files in tests.
+"""
+
+import math
+import time
+
+from slurm_tools import monitor
+from slurm_tools import results
+from slurm_tools import submit
+
+MIN="min"
+MAX="max"
+MODES=(MIN, MAX)
+DEFAULT_REDUCTION_FACTOR=3
+# Status of the rows of a `HalvingSweep`.
+WAITING="waiting"
+ACTIVE="active"
+STOPPED="stopped"
+FINISHED="finished"
+STATUSES=(WAITING, ACTIVE, STOPPED, FINISHED)
+_SCANCEL_COMMAND="scancel"
+
+
+def geometric_rungs(min_step, max_step, reduction_factor=DEFAULT_REDUCTION_FACTOR):
+    """Returns rungs `min_step * reduction_factor ** k` below `max_step`, e.g. `[1, 3, 9]` for `1, 27`."""
+    rungs = []
+    step = min_step
+    while step < max_step:
+        rungs.append(step)
+        step *= reduction_factor
+    return rungs
+
+
+class SuccessiveHalving(object):
+    """Decides whether a row continues at each rung, see the module docstring.
+
+    args:
+        rungs: Steps at which rows are ranked.
+        metric: Key of the reported metric to rank rows by.
+        mode: `"min"` if lower values of `metric` are better, `"max"` if higher are.
+        reduction_factor: Only the top `1 / reduction_factor` of the rows at a rung continue.
+            No row is stopped at a rung until `reduction_factor` rows reached it. Rows
+            reporting `nan` rank last.
+    """
+
+    def __init__(self, rungs, metric: str="loss", mode: str=MIN, reduction_factor: float=DEFAULT_REDUCTION_FACTOR):
+        if mode not in MODES:
+            raise ValueError(f"`mode` must be one of {MODES}.")
+        if reduction_factor <= 1:
+            raise ValueError("`reduction_factor` must be greater than 1.")
+        if not rungs:
+            raise ValueError("At least one rung is required.")
+        self.rungs=sorted(rungs)
+        self.metric=metric
+        self.mode=mode
+        self.reduction_factor=reduction_factor
+        # `dict` of rung to `dict` of row to score, lower is better.
+        self.scores={rung: {} for rung in self.rungs}
+
+    def update(self, key, reports):
+        """Records new `reports` of row `key`, in the order they were reported.
+
+        returns:
+            `False` if the row lost at a rung and should be stopped.
+        """
+        for report in reports:
+            value = report.get(self.metric)
+            step = report.get(results.STEP)
+            if value is None or step is None:
+                continue
+            for rung in self.rungs:
+                if step < rung or key in self.scores[rung]:
+                    continue
+                if not self._promote(rung, key, value):
+                    return False
+        return True
+
+    def _promote(self, rung, key, value):
+        """Records `value` of row `key` at `rung`, returns `True` if it ranks in the top fraction."""
+        score = float(value) if self.mode == MIN else -float(value)
+        if math.isnan(score):
+            score = math.inf
+        scores = self.scores[rung]
+        scores[key] = score
+        if len(scores) < self.reduction_factor:
+            return True
+        keep = int(len(scores) // self.reduction_factor)
+        return score <= sorted(scores.values())[keep - 1]
+
+
+class SlurmScheduler(object):
+    """Submits, cancels and polls the jobs of a `HalvingSweep`.
+
+    args:
+        submitter: Submits sbatch files, by default a `submit.SbatchSubmitter`.
+        runner: Runs `scancel`, `sacct` and `squeue`, see `monitor.RecordedOutput`.
+    """
+
+    def __init__(self, submitter=None, scancel_command: str=_SCANCEL_COMMAND, runner=monitor.run_command):
+        self.submitter=submitter or submit.SbatchSubmitter()
+        self.scancel_command=scancel_command
+        self.runner=runner
+
+    def submit(self, sbatch_file):
+        """Submits `sbatch_file` and returns its job id."""
+        return self.submitter.submit(sbatch_file)
+
+    def cancel(self, job_ids):
+        """Cancels `job_ids` with a single `scancel` call."""
+        if job_ids:
+            self.runner([self.scancel_command, *job_ids])
+
+    def states(self, job_ids):
+        """Returns `dict` of job id to slurm state of `job_ids`, without jobs not reported yet."""
+        if not job_ids:
+            return {}
+        states = monitor.read_sacct_states(job_ids, runner=self.runner)
+        # `squeue` is current for queued jobs, while `sacct` can lag behind.
+        states.update(monitor.read_squeue_states(runner=self.runner))
+        return {job_id: states[job_id] for job_id in job_ids if job_id in states}
+
+
+class HalvingRow(object):
+    """A row of a `HalvingSweep`, its job and the metrics it reported so far."""
+
+    def __init__(self, key, sbatch_file, metrics_file):
+        self.key=key
+        self.sbatch_file=sbatch_file
+        self.metrics_file=metrics_file
+        self.job_id=None
+        self.status=WAITING
+        # Final slurm state of finished rows.
+        self.state=None
+        self.offset=0
+
+    def __repr__(self):
+        return f"HalvingRow({self.key!r}, status={self.status!r}, job_id={self.job_id!r})"
+
+
+class HalvingSweep(object):
+    """Launches rows, stopping those that `successive_halving` ranks out, see the module docstring.
+
+    args:
+        rows: `(key, sbatch_file, metrics_file)` of each row, in launch order.
+        successive_halving: `SuccessiveHalving` ranking the rows.
+        scheduler: `SlurmScheduler`, or an object with the same methods.
+        max_concurrent: Maximum number of rows queued or running at once, `None` for all.
+        on_submit: Optionally, called with each `HalvingRow` once it is submitted.
+    """
+
+    def __init__(self, rows, successive_halving, scheduler, max_concurrent: int=None, on_submit=None):
+        self.rows=[HalvingRow(*row) for row in rows]
+        self.successive_halving=successive_halving
+        self.scheduler=scheduler
+        self.max_concurrent=max_concurrent
+        self.on_submit=on_submit
+
+    def poll(self):
+        """Records finished rows, cancels losing rows and launches waiting rows.
+
+        Metrics of a row are read before its state, so the last rung of a row that just
+        finished is still counted.
+
+        returns:
+            `True` while rows are waiting or active.
+        """
+        active = [row for row in self.rows if row.status == ACTIVE]
+        states = self.scheduler.states([row.job_id for row in active])
+        stopped = []
+        for row in active:
+            reports, row.offset = results.read_reports(row.metrics_file, row.offset)
+            promoted = self.successive_halving.update(row.key, reports)
+            state = states.get(row.job_id)
+            if state is not None and monitor.category(state) in (monitor.COMPLETED, monitor.FAILED):
+                row.status = FINISHED
+                row.state = state
+            elif not promoted:
+                row.status = STOPPED
+                stopped.append(row)
+        self.scheduler.cancel([row.job_id for row in stopped])
+
+        active_count = len(active) - len(stopped) - sum(row.status == FINISHED for row in active)
+        for row in self.rows:
+            if self.max_concurrent is not None and active_count >= self.max_concurrent:
+                break
+            if row.status != WAITING:
+                continue
+            row.job_id = self.scheduler.submit(row.sbatch_file)
+            row.status = ACTIVE
+            active_count += 1
+            if self.on_submit is not None:
+                self.on_submit(row)
+        return any(row.status in (WAITING, ACTIVE) for row in self.rows)
+
+    def run(self, interval: float=60, callback=None, sleep=time.sleep):
+        """Polls every `interval` seconds until all rows finished or were stopped.
+
+        args:
+            callback: Optionally, called with `counts()` after each poll.
+
+        returns:
+            counts: final number of rows of each status.
+        """
+        while True:
+            remaining = self.poll()
+            if callback is not None:
+                callback(self.counts())
+            if not remaining:
+                return self.counts()
+            sleep(interval)
+
+    def counts(self):
+        """Returns the number of rows of each status."""
+        counts = dict.fromkeys(STATUSES, 0)
+        for row in self.rows:
+            counts[row.status] += 1
+        return counts
@@ -1,15 +1,101 @@
 """Base script to launches Slurm Jobs."""
 
 from slurm_tools import sbatch_command as scommand
+from slurm_tools import submit
 
 from pathlib import Path
+import hashlib
+import json
 import os
 import time
 
 _TEST_RUN_COMMAND="cat"
-_RUN_COMMAND="sbatch"
 _DEFAULT_PARTITION="shared"
 _SBATCH_FILE_NAME="sbatch.txt"
+_ARRAY_LOG_PREFIX="%a_"
+_LAYOUT_FILE_NAME="layout.json"
+_DEFAULT_SHARD_WIDTH=2
+# Directories created by this process, so shared parents are only created once.
+_CREATED_DIRECTORIES=set()
+# Slurm args of `JobLauncher.set_sbatch_commands` that rows of a sweep may set for themselves.
+RESOURCE_ARGS=("time", "mem_per_cpu", "cpu_count", "partition")
+# Requeue on signal before the time limit, see `JobLauncher.set_sbatch_commands`.
+_REQUEUE_SIGNAL="USR1"
+# Seconds of `requeue_signal_time` kept to requeue after processes had time to checkpoint.
+_REQUEUE_MARGIN=30
+DEFAULT_MAX_REQUEUES=3
+
+
+def shard_path(key, shard_levels: int, shard_width: int=_DEFAULT_SHARD_WIDTH):
+    """Returns relative path `shard_levels` directories deep chosen by the hash of `key`.
+
+    e.g. `ab/cd` for `shard_levels=2`, which spreads jobs over `16 ** (2 * shard_width)` directories.
+    """
+    digest = hashlib.sha1(str(key).encode()).hexdigest()
+    return Path(*[digest[i * shard_width:(i + 1) * shard_width] for i in range(shard_levels)])
+
+
+def write_layout(sweep_directory: Path, shard_levels: int, shard_width: int=_DEFAULT_SHARD_WIDTH):
+    """Records the layout of job directories so that readers can undo the sharding."""
+    make_directory(sweep_directory)
+    with Path(sweep_directory).joinpath(_LAYOUT_FILE_NAME).open("w") as f:
+        json.dump({"shard_levels": shard_levels, "shard_width": shard_width}, f)
+
+
+def read_layout(sweep_directory: Path):
+    """Returns the layout of `sweep_directory`, flat unless recorded by `write_layout`."""
+    layout_file = Path(sweep_directory).joinpath(_LAYOUT_FILE_NAME)
+    if not layout_file.exists():
+        return {"shard_levels": 0, "shard_width": _DEFAULT_SHARD_WIDTH}
+    with layout_file.open() as f:
+        return json.load(f)
+
+
+def job_directory_path(
+    job_output_directory: Path,
+    job_name: str,
+    include_time_in_job_directory: bool=True,
+    shard_levels: int=0,
+    shard_width: int=_DEFAULT_SHARD_WIDTH,
+    shard_key: str=None,
+):
+    """Returns output directory for job, see `JobLauncher`."""
+    output_folder_name = job_name
+    if include_time_in_job_directory:
+        t = time.time()
+        output_folder_name = f"{output_folder_name}_{time.strftime('%Y_%m_%d_%H_%M_%Z', time.localtime(t))}"
+    return Path(job_output_directory).joinpath(
+        shard_path(shard_key or job_name, shard_levels, shard_width), output_folder_name)
+
+
+def split_resources(row: dict, slurm_args: dict):
+    """Removes resource columns (`RESOURCE_ARGS`) from `row`.
+
+    returns:
+        `slurm_args` updated with the non-blank resource columns of `row`.
+    """
+    row_slurm_args = dict(slurm_args)
+    for k in RESOURCE_ARGS:
+        if k in row:
+            v = row.pop(k)
+            if v is not None:
+                row_slurm_args[k] = v
+    return row_slurm_args
+
+
+def resource_signature(slurm_args: dict):
+    """Returns a hashable key that is equal for slurm args that request the same resources."""
+    return tuple(sorted((k, None if v is None else str(v)) for k, v in slurm_args.items()))
+
+
+def make_directory(directory: Path):
+    """Creates `directory` and its parents, skipping directories already created."""
+    directory = Path(directory)
+    if directory in _CREATED_DIRECTORIES:
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    _CREATED_DIRECTORIES.add(directory)
+    _CREATED_DIRECTORIES.update(directory.parents)
 
 
 class JobLauncher(object):
@@ -21,22 +107,57 @@ class JobLauncher(object):
         sbatch_file_name: str=_SBATCH_FILE_NAME,
         job_output_directory: str=None,
         include_time_in_job_directory: bool=True,
+        array_task_count: int=None,
+        array_max_concurrent: int=None,
+        shard_levels: int=0,
+        shard_width: int=_DEFAULT_SHARD_WIDTH,
+        shard_key: str=None,
+        job_directory: Path=None,
+        instrument: bool=False,
+        profiler: scommand.Profiler=None,
         verbose: bool=False,
         **kwargs,
     ):
-        """"Initializes `JobLauncher` and creates output directories."""
+        """"Initializes `JobLauncher`.
+
+        Output directories are created when the job is prepared or run. If `shard_levels`
+        is positive, the job directory is placed `shard_levels` directories below
+        `job_output_directory`, chosen by the hash of `shard_key` (default `job_name`).
+        `job_directory` overrides the job directory, e.g. with a template field.
+
+        If `instrument`, the job records when each group of commands ends, see
+        `slurm_tools.timing`. If `profiler` (a `sbatch_command.Profiler`) is given, python
+        commands of the job run under it, see `python_command`.
+        """
         self.sbatch_commands=[]
         self.pre_commands=[]
         self.job_commands=[]
         self.post_commands=[]
         self.sbatch_file_name=sbatch_file_name
-        self.job_output_directory=self._initialize_job_output_directory(job_output_directory)
+        self.job_output_directory=Path(job_output_directory)
         self.job_name = job_name
         self.sbatch_commands.append(scommand.JobNameCommand(self.job_name))
-        self.job_directory = self._initialize_output_dirs(self.job_output_directory, self.job_name, include_time_in_job_directory)
-        self.sbatch_commands.append(scommand.STDERRCommand(self.job_directory))
-        self.sbatch_commands.append(scommand.STDOUTCommand(self.job_directory))
+        if job_directory is None:
+            job_directory = job_directory_path(
+                self.job_output_directory,
+                self.job_name,
+                include_time_in_job_directory,
+                shard_levels,
+                shard_width,
+                shard_key,
+            )
+        self.job_directory = Path(job_directory)
+        self.array_task_count=array_task_count
+        # Array tasks share `job_directory`, so logs are prefixed by the task index.
+        log_prefix = "" if array_task_count is None else _ARRAY_LOG_PREFIX
+        self.sbatch_commands.append(scommand.STDERRCommand(self.job_directory, f"{log_prefix}error.txt"))
+        self.sbatch_commands.append(scommand.STDOUTCommand(self.job_directory, f"{log_prefix}output.txt"))
+        if array_task_count is not None:
+            self.sbatch_commands.append(scommand.ArrayCommand(array_task_count, array_max_concurrent))
         self.verbose=verbose
+        self.instrument=instrument
+        self.profiler=profiler
+        self.requeue_trap=None
         # TODO: move comments to another spot, ensure no commands before sbatch.
         # These lines cause the script to fail because they occur before the other `sbatch` commands.
         if verbose or self.verbose:
@@ -54,10 +175,17 @@ class JobLauncher(object):
         output_directory=None,
         mail_address=None,
         mail_type=None,
+        requeue_signal_time=None,
+        max_requeues=DEFAULT_MAX_REQUEUES,
         verbose=False,
         **kwargs,
     ):
-        """Assembles sbatch commands."""
+        """Assembles sbatch commands.
+
+        If `requeue_signal_time` is given, the job is signalled that many seconds before its
+        time limit, forwards the signal to its processes so they can checkpoint and requeues
+        itself, at most `max_requeues` times (see `sbatch_command.RequeueTrapCommand`).
+        """
         self.sbatch_commands.append(scommand.Comment("COMPUTE RESOURCES"))
         self.sbatch_commands.append(scommand.TimeCommand(time))
         if mail_address is not None:
@@ -71,6 +199,14 @@ class JobLauncher(object):
             self.sbatch_commands.append(scommand.NTaskCommand(cpu_count))
         if mem_per_cpu is not None:
             self.sbatch_commands.append(scommand.MemoryPerCpuCommand(mem_per_cpu))
+        if requeue_signal_time is not None:
+            requeue_signal_time = int(requeue_signal_time)
+            self.sbatch_commands.append(scommand.Comment("REQUEUE"))
+            self.sbatch_commands.append(scommand.SignalCommand(requeue_signal_time, _REQUEUE_SIGNAL))
+            self.sbatch_commands.append(scommand.RequeueCommand())
+            self.sbatch_commands.append(scommand.OpenModeCommand("append"))
+            self.requeue_trap = scommand.RequeueTrapCommand(
+                _REQUEUE_SIGNAL, max(requeue_signal_time - _REQUEUE_MARGIN, 0), int(max_requeues))
         if verbose or self.verbose:
             self.sbecho(self.sbatch_commands, "JOB ID ${SLURM_JOB_ID}")
 
@@ -82,6 +218,12 @@ class JobLauncher(object):
             self.sbecho(self.post_commands, "FINISHED.")
 
 
+    def python_command(self, output_prefix: str):
+        """Returns the command that runs python, under `profiler` writing files starting with `output_prefix`."""
+        if self.profiler is None:
+            return scommand.PYTHON
+        return self.profiler.python(output_prefix)
+
     def sbecho(self, command_list, echo_text):
         """Convenience fn to add specified `echo` to sbatch commands."""
         command_list.append(scommand.Echo(echo_text))
@@ -92,11 +234,24 @@ class JobLauncher(object):
     ):
         """Assembles commands to run job.""" 
 
-    def run(self, test=False):
-        """Runs job as specified, creating output folders and saving script."""
-        self.sbatch_file = self._write_sbatch(self.job_directory, self.sbatch_file_name)        
-        self._call_sbatch(self.sbatch_file, test)
+    def run(self, test=False, submitter=None, sbatch_args=()):
+        """Runs job as specified, creating output folders and saving script.
+
+        `sbatch_args` are passed to `sbatch` before the sbatch file, e.g. `--dependency`.
+
+        returns:
+            job_id: slurm job id, `None` if `test`.
+        """
+        self.prepare()
+        self.job_id = self._call_sbatch(self.sbatch_file, test, submitter, sbatch_args)
         self._has_run=True
+        return self.job_id
+
+    def prepare(self):
+        """Writes sbatch file without submitting it, e.g. to submit with `submit.SbatchSubmitter`."""
+        self.make_directories()
+        self.sbatch_file = self._write_sbatch(self.job_directory, self.sbatch_file_name)
+        return self.sbatch_file
 
     def build_sbatch(self):
         """Creates `sbatch` string."""
@@ -107,41 +262,47 @@ class JobLauncher(object):
         for c in self.sbatch_commands:
             sbatch_text.append(c.build_str(include_description=self.verbose))
 
-        for c in self.pre_commands:
-            sbatch_text.append(c.build_str(include_description=self.verbose))
-
-        for c in self.job_commands:
-            sbatch_text.append(c.build_str(include_description=self.verbose))
+        sbatch_text.append(
+            scommand.ResultFileCommand(self.job_directory).build_str(include_description=self.verbose))
+        if self.instrument:
+            sbatch_text.append(
+                scommand.TimingFileCommand(self.job_directory).build_str(include_description=self.verbose))
+        if self.requeue_trap is not None:
+            sbatch_text.append(self.requeue_trap.build_str(include_description=self.verbose))
 
-        for c in self.post_commands:
-            sbatch_text.append(c.build_str(include_description=self.verbose))
+        for group, commands in (
+            ("pre_commands", self.pre_commands),
+            ("job_commands", self.job_commands),
+            ("post_commands", self.post_commands),
+        ):
+            # Job commands run in the background so the requeue trap is not held until they end.
+            background = self.requeue_trap is not None and group == "job_commands"
+            if background:
+                sbatch_text.append(scommand.BackgroundGroupStart(_REQUEUE_SIGNAL).build_str())
+            for c in commands:
+                sbatch_text.append(c.build_str(include_description=self.verbose))
+                if self.instrument and c.phase is not None:
+                    sbatch_text.append(scommand.TimingMarkCommand(c.phase).build_str())
+            if background:
+                sbatch_text.append(scommand.BackgroundGroupWait().build_str())
+            if self.instrument:
+                sbatch_text.append(scommand.TimingMarkCommand(group).build_str())
+        if self.requeue_trap is not None:
+            sbatch_text.append(scommand.BackgroundGroupExit().build_str())
 
         return "\n".join(sbatch_text)
 
-    def _initialize_output_dirs(
-        self,
-        job_output_directory,
-        job_name,
-        include_time_in_job_directory
-    ):
-        """Initializes output directory for job."""
-        output_folder_name = job_name
-        if include_time_in_job_directory:
-            t = time.time()
-            output_folder_name = f"{output_folder_name}_{time.strftime('%Y_%m_%d_%H_%M_%Z', time.localtime(t))}"
-        output_directory = job_output_directory.joinpath(output_folder_name)
-        self._initialize_folder(output_directory)
-        return output_directory
-
-    def _initialize_job_output_directory(self, job_output_directory):
-        """Initializes job directory."""
-        job_output_directory=Path(job_output_directory)
-        self._initialize_folder(job_output_directory)
-        return job_output_directory
-
-    def _initialize_folder(self, folder):
-        """Initializes directory for sbatch, stdout/stderr."""
-        folder.mkdir(parents=True, exist_ok=True)
+    def compile_template(self):
+        """Renders the sbatch file once as a `SbatchTemplate`.
+
+        Fields are set by passing `sbatch_command.field(name)` in place of a value, e.g. as
+        `job_name` and `job_directory`.
+        """
+        return SbatchTemplate(self.build_sbatch())
+
+    def make_directories(self):
+        """Creates `job_directory` for sbatch, stdout/stderr."""
+        make_directory(self.job_directory)
 
     def _write_sbatch(self, output_directory, sbatch_file_name):
         """Creates and writes sbatch file to `job_directory`."""
@@ -156,13 +317,61 @@ class JobLauncher(object):
         pass
         
 
-    def _call_sbatch(self, sbatch_file: Path, test=False):
-        """Launches job on slurm."""
-        if test:
-            run_command=_TEST_RUN_COMMAND
-        else:
-            run_command=_RUN_COMMAND
-        bash_str = f"{run_command} {sbatch_file}"
+    def _call_sbatch(self, sbatch_file: Path, test=False, submitter=None, sbatch_args=()):
+        """Launches job on slurm and returns job id."""
+        return call_sbatch(sbatch_file, test, submitter, sbatch_args)
+
+
+def call_sbatch(sbatch_file: Path, test=False, submitter=None, sbatch_args=()):
+    """Submits `sbatch_file` and returns its job id, or prints it and returns `None` if `test`."""
+    if test:
+        if sbatch_args:
+            print(f"sbatch args: {' '.join(sbatch_args)}")
+        bash_str = f"{_TEST_RUN_COMMAND} {sbatch_file}"
         os.system(bash_str)
+        return None
+    if submitter is None:
+        submitter = submit.SbatchSubmitter(max_workers=1)
+    job_id = submitter.submit(sbatch_file, sbatch_args)
+    print(f"Submitted batch job {job_id}")
+    return job_id
+
+
+class SbatchTemplate(object):
+    """An sbatch file rendered once, with fields filled in per job.
+
+    The text is split at `sbatch_command.field` placeholders so that rendering a job
+    only joins strings.
+    """
+
+    __slots__ = ("parts", "fields")
+
+    def __init__(self, text: str):
+        parts = text.split(scommand.FIELD_TOKEN)
+        if len(parts) % 2 == 0:
+            raise ValueError("Template contains an unterminated field.")
+        self.parts = parts
+        self.fields = frozenset(parts[1::2])
+
+    def render(self, **fields):
+        """Returns the sbatch text with each field replaced by `str` of its value."""
+        missing = self.fields.difference(fields)
+        if missing:
+            raise ValueError(f"Missing template fields {sorted(missing)}.")
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = str(fields[parts[i]])
+        return "".join(parts)
+
+    def write(self, job_directory: Path, sbatch_file_name: str=_SBATCH_FILE_NAME, **fields):
+        """Creates `job_directory` and renders the template to its sbatch file.
+
+        `job_directory` also fills the `job_directory` field.
+        """
+        make_directory(job_directory)
+        sbatch_file = Path(job_directory).joinpath(sbatch_file_name)
+        with sbatch_file.open("w") as f:
+            f.write(self.render(job_directory=job_directory, **fields))
+        return sbatch_file
 
 
@@ -4,6 +4,7 @@ import argparse
 import json
 from pathlib import Path
 
+from slurm_tools import env_spec
 from slurm_tools import launch_job
 from slurm_tools import sbatch_command as scommand
 
@@ -12,8 +13,30 @@ _CONDA3 = "ANACONDA3"
 _CONDA3_MODULE = "Anaconda3"
 
 
+def is_env_pack(env_name):
+    """Returns `True` if `env_name` is the path of a conda-pack archive rather than an env name."""
+    return str(env_name).endswith(scommand.stageCondaPack.PACK_SUFFIXES)
+
+
+def resolve_env(env_name):
+    """Resolves symlinks of an environment given by path, e.g. `{ENV_CACHE}/{ENV_NAME}` or
+    `{ENV_NAME}.tar.gz` made by `create_env.sh`.
+
+    Jobs then use the current build of the environment even if the link is updated
+    while they wait in queue.
+    """
+    if env_name is None or not env_spec.is_env_path(env_name):
+        return env_name
+    return str(Path(env_name).expanduser().resolve())
+
+
 class CondaJobLauncher(launch_job.JobLauncher):
-    """Slurm job with Conda prerequisite."""
+    """Slurm job with Conda prerequisite.
+
+    `env_name` is the name of a conda environment, or the path of a conda-pack archive
+    that is unpacked to node-local storage (see `sbatch_command.stageCondaPack`) to avoid
+    loading the environment from a shared filesystem.
+    """
     
     def __init__(
         self,
@@ -37,6 +60,14 @@ class CondaJobLauncher(launch_job.JobLauncher):
         if self.verbose:
             self.sbecho(self.pre_commands, "LOADING CONDA ENV.")
 
+        if is_env_pack(self.env_name):
+            self.pre_commands.append(scommand.Comment("STAGED CONDA ENVIRONMENT."))
+            self.pre_commands.append(scommand.stageCondaPack(self.env_name))
+            self.pre_commands.append(scommand.activateCondaPack())
+            if self.verbose:
+                self.sbecho(self.pre_commands, "python: $(which python)")
+            return
+
         self.pre_commands.append(scommand.Comment("CONDA ENVIRONMENT."))
         self.pre_commands.append(scommand.loadModule(self.conda_module))
         self.pre_commands.append(scommand.activateConda())
@@ -61,30 +92,162 @@ class CondaJobLauncher(launch_job.JobLauncher):
             self.sbecho(self.pre_commands, "RUNNING SCRIPT.")
 
         self.job_commands.append(
-            scommand.RunPythonScript(job_script, job_args))
+            scommand.RunPythonScript(job_script, job_args, self.python_command(f"{self.job_directory}/")))
 
+    def set_array_job_commands(
+        self,
+        job_script: str,
+        args_file: Path,
+    ):
+        """Runs `job_script` with the line of `args_file` given by `SLURM_ARRAY_TASK_ID`."""
+        self.job_commands.append(scommand.Comment("RUN PYTHON SCRIPT ARRAY TASK"))
+        if self.verbose:
+            self.sbecho(self.pre_commands, "RUNNING ARRAY TASK ${SLURM_ARRAY_TASK_ID}.")
 
-# TODO: allow different number of experiment and slurm params.
-def launch_conda_job(
+        self.job_commands.append(
+            scommand.RunPythonScriptArray(
+                job_script, args_file, self.python_command(f"{self.job_directory}/${{SLURM_ARRAY_TASK_ID}}_")))
+
+    def set_packed_array_job_commands(
+        self,
+        job_script: str,
+        args_file: Path,
+        pack_size: int,
+        step_launcher: str="srun",
+    ):
+        """Runs `pack_size` lines of `args_file` per array task, sharing one conda activation."""
+        self.job_commands.append(scommand.Comment("RUN PACKED PYTHON SCRIPT ARRAY TASK"))
+        if self.verbose:
+            self.sbecho(self.pre_commands, "RUNNING PACKED ARRAY TASK ${SLURM_ARRAY_TASK_ID}.")
+
+        self.job_commands.append(
+            scommand.RunPackedPythonScriptArray(
+                job_script, args_file, pack_size, self.job_directory, step_launcher,
+                self.python_command(f"{self.job_directory}/row_${{ROW}}_")))
+
+    def set_sweep_job_commands(
+        self,
+        job_script: str,
+        spec_script: Path,
+        spec_file: Path,
+        pack_size: int=1,
+        step_launcher: str="srun",
+    ):
+        """Runs `job_script` with the rows of sweep spec `spec_file` for this array task.
+
+        See `slurm_tools.sweep_spec`.
+        """
+        self.job_commands.append(scommand.Comment("RUN PYTHON SCRIPT SWEEP TASK"))
+        if self.verbose:
+            self.sbecho(self.pre_commands, "RUNNING SWEEP TASK ${SLURM_ARRAY_TASK_ID}.")
+
+        if pack_size > 1:
+            self.job_commands.append(
+                scommand.RunPackedPythonScriptSweep(
+                    job_script, spec_script, spec_file, pack_size, self.job_directory, step_launcher,
+                    self.python_command(f"{self.job_directory}/row_${{ROW}}_")))
+        else:
+            self.job_commands.append(
+                scommand.RunPythonScriptSweep(
+                    job_script, spec_script, spec_file,
+                    self.python_command(f"{self.job_directory}/${{SLURM_ARRAY_TASK_ID}}_")))
+
+    def set_worker_job_commands(
+        self,
+        worker_script: Path,
+        job_script: str,
+        tasks_file: Path,
+        **worker_kwargs,
+    ):
+        """Runs a pool of warm python workers over `tasks_file`, see `slurm_tools.worker`."""
+        self.job_commands.append(scommand.Comment("RUN PYTHON WORKERS"))
+        if self.verbose:
+            self.sbecho(self.pre_commands, "STARTING WORKERS.")
+
+        self.job_commands.append(
+            scommand.RunPythonWorkers(
+                worker_script, job_script, tasks_file, self.job_directory,
+                python=self.python_command(f"{self.job_directory}/worker_%p_"), **worker_kwargs))
+
+
+def build_conda_job(
     job_name: str,
     job_output_directory: Path,
     env_name: str,
     script: Path,
     script_args: dict,
     slurm_args: dict,
-    test: bool=False,
     verbose: bool=False,
+    **launcher_kwargs,
 ):
-    """Launches a set of slurm jobs parameterized by csv files for script args and slurm parameters."""
+    """Builds a `CondaJobLauncher` running `script` with `script_args`, without running it.
+
+    `launcher_kwargs` are passed to `CondaJobLauncher`, e.g. `shard_levels`.
+    """
     jl = CondaJobLauncher(
         env_name = env_name,
         job_name=job_name,
         job_output_directory=job_output_directory,
-        verbose=verbose
+        verbose=verbose,
+        **launcher_kwargs,
     ) 
     jl.set_sbatch_commands(**slurm_args)
     jl.set_job_commands(script, script_args)
-    jl.run(test=test)
+    return jl
+
+
+def compile_conda_template(
+    job_output_directory: Path,
+    env_name: str,
+    script: Path,
+    slurm_args: dict,
+    verbose: bool=False,
+    instrument: bool=False,
+    profiler: scommand.Profiler=None,
+):
+    """Compiles the sbatch file of `build_conda_job` into a `launch_job.SbatchTemplate`.
+
+    Slurm and conda commands are rendered once; `job_name`, `job_directory` and
+    `script_args` (CLI arguments, see `csv_util.dict_to_CLI_args`) are template fields.
+    """
+    jl = build_conda_job(
+        job_name=scommand.field("job_name"),
+        job_output_directory=job_output_directory,
+        env_name=env_name,
+        script=script,
+        script_args=scommand.field("script_args"),
+        slurm_args=slurm_args,
+        verbose=verbose,
+        job_directory=scommand.field("job_directory"),
+        instrument=instrument,
+        profiler=profiler,
+    )
+    return jl.compile_template()
+
+
+# TODO: allow different number of experiment and slurm params.
+def launch_conda_job(
+    job_name: str,
+    job_output_directory: Path,
+    env_name: str,
+    script: Path,
+    script_args: dict,
+    slurm_args: dict,
+    test: bool=False,
+    verbose: bool=False,
+    submitter=None,
+):
+    """Launches a set of slurm jobs parameterized by csv files for script args and slurm parameters."""
+    jl = build_conda_job(
+        job_name=job_name,
+        job_output_directory=job_output_directory,
+        env_name=env_name,
+        script=script,
+        script_args=script_args,
+        slurm_args=slurm_args,
+        verbose=verbose,
+    )
+    return jl.run(test=test, submitter=submitter)
 
 
 # TODO: load from env variable.
@@ -110,7 +273,7 @@ def main():
     launch_conda_job(
         job_name = args.job_name,
         job_output_directory=job_output_directory,
-        env_name=args.env_name,
+        env_name=resolve_env(args.env_name),
         script=args.script,
         script_args=args.script_args,
         slurm_args=args.slurm_args,
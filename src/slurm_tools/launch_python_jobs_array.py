@@ -3,46 +3,824 @@
 import argparse
 import json
 from pathlib import Path
+import csv
+import itertools
+import shutil
 import time
 
+from slurm_tools import allocation
+from slurm_tools import cache as result_cache
+from slurm_tools import env_spec
+from slurm_tools import halving as job_halving
+from slurm_tools import launch_job
 from slurm_tools import launch_python_job
 from slurm_tools import csv_util
+from slurm_tools import monitor
+from slurm_tools import partitions as job_partitions
+from slurm_tools import profiler
+from slurm_tools import registry as job_registry
+from slurm_tools import results
+from slurm_tools import rightsize
+from slurm_tools import sbatch_command as scommand
+from slurm_tools import submit
+from slurm_tools import sweep_spec
+from slurm_tools import worker
+
+
+_ARRAY_ARGS_FILE_NAME = "array_args.txt"
+_ROW_INDEX_FILE_NAME = "row_index.csv"
+_WORKER_TASKS_FILE_NAME = "worker_tasks.jsonl"
+_WORKER_SCRIPT_NAME = "worker.py"
+_SPEC_FILE_NAME = "sweep_spec.json"
+_SPEC_SCRIPT_NAME = "sweep_spec.py"
+_PROFILER_SCRIPT_NAME = "profiler.py"
+# Default `MaxArraySize` of `slurm.conf`: array indices range from 0 to 1000.
+DEFAULT_MAX_ARRAY_SIZE = 1001
+
+
+def _sweep_output_directory(job_output_directory, job_name):
+    """Returns a timestamped folder under `job_output_directory` for all jobs in a sweep."""
+    t = time.time()
+    output_folder_name = f"{time.strftime('%Y_%m_%d_%H_%M_%Z', time.localtime(t))}_{job_name}"
+    # Absolute, so that paths recorded in the registry and cache do not depend on the cwd.
+    return Path(job_output_directory).absolute().joinpath(output_folder_name)
+
+
+def _stage_profiler(sweep_directory, profile):
+    """Copies `profiler` to `sweep_directory` and returns a `sbatch_command.Profiler` running it.
+
+    Returns `None` if `profile` (the sampler, e.g. `"cprofile"`) is `None`. The profiler runs in
+    the job environment, which need not have `slurm_tools` installed.
+    """
+    if profile is None:
+        return None
+    launch_job.make_directory(sweep_directory)
+    profiler_script = Path(sweep_directory).joinpath(_PROFILER_SCRIPT_NAME)
+    shutil.copy(profiler.__file__, profiler_script)
+    return scommand.Profiler(profiler_script, profile)
+
+
+def _check_array_size(task_count, max_array_size):
+    """Raises `ValueError` if a job array of `task_count` tasks exceeds `max_array_size`."""
+    if max_array_size is not None and task_count > max_array_size:
+        raise ValueError(
+            f"A job array of {task_count} tasks exceeds `max_array_size` {max_array_size}; split the rows "
+            "with `launch_conda_job_arrays` or run several rows per task with `pack_size`.")
+
+
+def _iter_script_args(script_args):
+    """Yields the rows of a csv file, a sweep spec file (see `sweep_spec`) or a list of `dict`."""
+    if isinstance(script_args, (str, Path)):
+        if sweep_spec.is_spec_file(script_args):
+            yield from sweep_spec.load_spec(script_args)
+        else:
+            yield from csv_util.iter_csv(script_args)
+    else:
+        yield from script_args
+
+
+def _register(registry, sweep_directory, job_name, script, env_name, slurm_args, rows):
+    """Records submitted `rows` in `registry` (a `registry.JobRegistry`), if given."""
+    if registry is None:
+        return
+    registry.record_submission(sweep_directory, job_name, script, env_name, slurm_args, rows)
+
+
+def _skip_cached(indexed_rows, cache, cache_key, sweep_directory, job_name, cache_mode, cached_rows, test=False):
+    """Yields `(row_index, row)` of rows without a completed run in `cache`.
+
+    Cached rows are appended to `cached_rows` and, if `cache_mode` is `cache.CACHE_LINK`,
+    linked into `sweep_directory` as `{job_name}_id_{experiment_id}_cached`, replacing a
+    link of an earlier launch into the same sweep directory. `test` runs do not link.
+    """
+    for row_index, row in indexed_rows:
+        key = cache_key(row)
+        job_directory = None if cache is None else cache.lookup(key)
+        if job_directory is None:
+            yield row_index, row
+            continue
+        experiment_id = row.get("experiment_id")
+        if cache_mode == result_cache.CACHE_LINK and not test:
+            launch_job.make_directory(sweep_directory)
+            link = sweep_directory.joinpath(f"{job_name}_id_{experiment_id}_cached")
+            # Sweep directories are named by the minute, so a relaunch may reuse one.
+            if link.is_symlink():
+                link.unlink()
+            link.symlink_to(job_directory)
+        script_args = {k: v for k, v in row.items() if k != "experiment_id"}
+        cached_rows.append({
+            "job_id": None,
+            "array_index": None,
+            "row_index": row_index,
+            "experiment_id": experiment_id,
+            "script_args": script_args,
+            "slurm_args": launch_job.split_resources(script_args, cache_key.slurm_args),
+            "job_directory": job_directory,
+            "cache_key": key,
+            "state": "CACHED",
+        })
 
 
 def launch_conda_jobs_csv(
-    job_name, job_output_directory, env_name, script, script_args, slurm_args, test
+    job_name,
+    job_output_directory,
+    env_name,
+    script,
+    script_args,
+    slurm_args,
+    test,
+    submitter=None,
+    registry=None,
+    cache=None,
+    cache_mode=result_cache.CACHE_SKIP,
+    shard_levels=0,
+    shard_width=2,
+    instrument=False,
+    profile=None,
 ):
-    """Launches a set of slurm jobs parameterized by csv files for script args and slurm parameters."""
-    # Load args.
-    script_args = csv_util.parse_csv(script_args)
+    """Launches a set of slurm jobs parameterized by csv files for script args and slurm parameters.
+
+    `script_args` may also be a sweep spec file, see `sweep_spec`. Resource columns of a
+    row (`launch_job.RESOURCE_ARGS`, e.g. `time`) override `slurm_args` for that row.
+
+    Jobs are submitted concurrently by `submitter` (a `submit.SbatchSubmitter`) and
+    recorded in `registry` (a `registry.JobRegistry`), if given. Rows with a completed
+    run in `cache` (a `cache.ResultCache`) are skipped, or linked if `cache_mode` is
+    `cache.CACHE_LINK`.
+
+    If `shard_levels` is positive, job directories are spread over `shard_levels` levels
+    of subdirectories chosen by the hash of `experiment_id` (see `launch_job.shard_path`).
+    If `instrument`, jobs record the duration of their startup phases (see `timing`). If
+    `profile` (`"cprofile"` or `"py-spy"`), jobs run under `profiler`, see `profiles`.
+
+    returns:
+        job_ids: `List` of slurm job ids, `None` for jobs that failed to submit.
+    """
+    # Load args lazily so the first job is launched as soon as its row is read.
+    script_args = enumerate(_iter_script_args(script_args))
 
     # If `test` run only two.
     if test:
-        script_args = script_args[:2]
+        script_args = itertools.islice(script_args, 2)
 
     # TODO: replace this with a nicer scheme that incorporates the subfolders as a fn of `JobLauncher`
     # We want to put all the output logs under a single folder.
     # To do this, set the `job_output_folder` to include the `job_name` and then 
     # have `JobLauncher` create subdirectories associated with `experiment_id`.
-    t = time.time()
-    output_folder_name = f"{time.strftime('%Y_%m_%d_%H_%M_%Z', time.localtime(t))}_{job_name}"
-    job_output_directory = job_output_directory.joinpath(output_folder_name)
+    job_output_directory = _sweep_output_directory(job_output_directory, job_name)
+    if shard_levels > 0:
+        launch_job.write_layout(job_output_directory, shard_levels, shard_width)
+    layout = {"shard_levels": shard_levels, "shard_width": shard_width}
+    job_profiler = _stage_profiler(job_output_directory, profile)
+
+    cache_key = result_cache.CacheKey(script, env_name, slurm_args)
+    cached_rows = []
+    script_args = _skip_cached(
+        script_args, cache, cache_key, job_output_directory, job_name, cache_mode, cached_rows, test)
+
+    # Rows only differ in job name, job directory and script arguments, so the rest of
+    # the sbatch file is rendered once for each set of resources.
+    templates = {}
+
+    def _template(row_slurm_args):
+        signature = launch_job.resource_signature(row_slurm_args)
+        if signature not in templates:
+            templates[signature] = launch_python_job.compile_conda_template(
+                job_output_directory, env_name, script, row_slurm_args, instrument=instrument,
+                profiler=job_profiler)
+        return templates[signature]
 
     # Iterate over jobs.
-    for script_arg_job in script_args:
-        # We want to set the `job_name` to be associated with the given experiment.
-        experiment_id = script_arg_job.pop("experiment_id")
-        job_name_ex = f"{job_name}_id_{experiment_id}"
+    if test:
+        job_ids = []
+        for _, script_arg_job in script_args:
+            row_slurm_args = launch_job.split_resources(script_arg_job, slurm_args)
+            sbatch_file, _, _ = _write_row_sbatch(
+                _template(row_slurm_args), job_name, job_output_directory, script_arg_job, layout)
+            job_ids.append(launch_job.call_sbatch(sbatch_file, test=test))
+        return job_ids
 
-        launch_python_job.launch_conda_job(
-            job_name=job_name_ex,
-            job_output_directory=job_output_directory,
+    if submitter is None:
+        submitter = submit.SbatchSubmitter()
+    rows = []
+
+    def _prepare(script_args):
+        for row_index, script_arg_job in script_args:
+            key = cache_key(script_arg_job)
+            row_slurm_args = launch_job.split_resources(script_arg_job, slurm_args)
+            sbatch_file, experiment_id, job_directory = _write_row_sbatch(
+                _template(row_slurm_args), job_name, job_output_directory, script_arg_job, layout)
+            row = {
+                "array_index": None,
+                "row_index": row_index,
+                "experiment_id": experiment_id,
+                "script_args": script_arg_job,
+                "job_directory": job_directory,
+                "cache_key": key,
+            }
+            if row_slurm_args != slurm_args:
+                row["slurm_args"] = row_slurm_args
+            rows.append(row)
+            yield sbatch_file
+
+    job_ids = submitter.submit_all(_prepare(script_args))
+    for sbatch_file, error in submitter.errors:
+        print(f"Failed to submit {sbatch_file}: {error}")
+    print(f"Submitted {len(job_ids) - len(submitter.errors)} of {len(job_ids)} jobs.")
+    if cached_rows:
+        print(f"Skipped {len(cached_rows)} rows with completed runs in cache.")
+
+    for row, job_id in zip(rows, job_ids):
+        row["job_id"] = job_id
+    _register(registry, job_output_directory, job_name, script, env_name, slurm_args, rows + cached_rows)
+    return job_ids
+
+
+def _write_row_sbatch(template, job_name, job_output_directory, script_arg_job, layout):
+    """Renders `template` for a single csv row, sharded by `experiment_id`.
+
+    returns:
+        `(sbatch_file, experiment_id, job_directory)`.
+    """
+    # We want to set the `job_name` to be associated with the given experiment.
+    experiment_id = script_arg_job.pop("experiment_id")
+    job_name_ex = f"{job_name}_id_{experiment_id}"
+    job_directory = launch_job.job_directory_path(
+        job_output_directory, job_name_ex, shard_key=experiment_id, **layout)
+    sbatch_file = template.write(
+        job_directory,
+        job_name=job_name_ex,
+        script_args=csv_util.dict_to_CLI_args(script_arg_job),
+    )
+    return sbatch_file, experiment_id, job_directory
+
+
+def launch_conda_halving_sweep(
+    job_name,
+    job_output_directory,
+    env_name,
+    script,
+    script_args,
+    slurm_args,
+    successive_halving,
+    max_concurrent=None,
+    test=False,
+    scheduler=None,
+    registry=None,
+    interval=60,
+    instrument=False,
+    profile=None,
+):
+    """Runs one job per row of `script_args`, cancelling rows that lose at a rung.
+
+    Jobs report metrics with `results.report` and are ranked by `successive_halving` (a
+    `halving.SuccessiveHalving`), see `halving`. At most `max_concurrent` rows are queued or
+    running at once. Blocks until every row finished or was cancelled.
+
+    args:
+        scheduler: By default a `halving.SlurmScheduler`.
+        interval: Seconds between polls of metrics and job states.
+        profile: Optionally, `"cprofile"` or `"py-spy"` to run jobs under `profiler`.
+
+    returns:
+        `halving.HalvingSweep`, `None` if `test`.
+    """
+    script_args = enumerate(_iter_script_args(script_args))
+    if test:
+        script_args = itertools.islice(script_args, 2)
+    sweep_directory = _sweep_output_directory(job_output_directory, job_name)
+    layout = {"shard_levels": 0, "shard_width": 2}
+    job_profiler = _stage_profiler(sweep_directory, profile)
+    cache_key = result_cache.CacheKey(script, env_name, slurm_args)
+    templates = {}
+    rows = {}
+    for row_index, script_arg_job in script_args:
+        key = cache_key(script_arg_job)
+        row_slurm_args = launch_job.split_resources(script_arg_job, slurm_args)
+        signature = launch_job.resource_signature(row_slurm_args)
+        if signature not in templates:
+            templates[signature] = launch_python_job.compile_conda_template(
+                sweep_directory, env_name, script, row_slurm_args, instrument=instrument,
+                profiler=job_profiler)
+        sbatch_file, experiment_id, job_directory = _write_row_sbatch(
+            templates[signature], job_name, sweep_directory, script_arg_job, layout)
+        rows[experiment_id] = {
+            "array_index": None,
+            "row_index": row_index,
+            "experiment_id": experiment_id,
+            "script_args": script_arg_job,
+            "job_directory": job_directory,
+            "cache_key": key,
+            "sbatch_file": sbatch_file,
+        }
+        if row_slurm_args != slurm_args:
+            rows[experiment_id]["slurm_args"] = row_slurm_args
+    if test:
+        for row in rows.values():
+            launch_job.call_sbatch(row["sbatch_file"], test=test)
+        return None
+
+    def _on_submit(halving_row):
+        row = dict(rows[halving_row.key], job_id=halving_row.job_id)
+        del row["sbatch_file"]
+        _register(registry, sweep_directory, job_name, script, env_name, slurm_args, [row])
+
+    sweep = job_halving.HalvingSweep(
+        [
+            (experiment_id, row["sbatch_file"], row["job_directory"].joinpath(results.METRICS_FILE_NAME))
+            for experiment_id, row in rows.items()
+        ],
+        successive_halving,
+        scheduler or job_halving.SlurmScheduler(),
+        max_concurrent=max_concurrent,
+        on_submit=_on_submit,
+    )
+    counts = sweep.run(interval, callback=lambda c: print(monitor.format_counts(c), flush=True))
+    print(f"Ran {len(rows)} rows: {counts[job_halving.FINISHED]} finished, {counts[job_halving.STOPPED]} cancelled.")
+    return sweep
+
+
+def build_conda_job_array(
+    job_name,
+    sweep_directory,
+    env_name,
+    script,
+    script_args,
+    slurm_args,
+    max_concurrent=None,
+    pack_size=1,
+    pack_launcher="srun",
+    instrument=False,
+    profile=None,
+    max_array_size=DEFAULT_MAX_ARRAY_SIZE,
+):
+    """Builds a `CondaJobLauncher` running the rows of `script_args` as a job array, without running it.
+
+    The job directory `job_name` in `sweep_directory` is created with `array_args.txt` and
+    `row_index.csv`, e.g. to submit the array as a stage of a `pipeline.Pipeline`. See
+    `launch_conda_job_array` for the arguments.
+
+    returns:
+        `(CondaJobLauncher, experiment_ids)`, the `experiment_id` of each row in order.
+    """
+    script_args = list(_iter_script_args(script_args))
+    if not script_args:
+        raise ValueError("`script_args` contains no rows to launch.")
+    _check_array_size(-(-len(script_args) // pack_size), max_array_size)
+    jl = launch_python_job.CondaJobLauncher(
+        env_name=env_name,
+        job_name=job_name,
+        job_output_directory=sweep_directory,
+        include_time_in_job_directory=False,
+        array_task_count=-(-len(script_args) // pack_size),
+        array_max_concurrent=max_concurrent,
+        instrument=instrument,
+        profiler=_stage_profiler(sweep_directory, profile),
+    )
+    jl.make_directories()
+    args_file, experiment_ids = _write_array_args(jl.job_directory, script_args)
+    jl.set_sbatch_commands(**slurm_args)
+    if pack_size > 1:
+        jl.set_packed_array_job_commands(script, args_file, pack_size, pack_launcher)
+    else:
+        jl.set_array_job_commands(script, args_file)
+    return jl, experiment_ids
+
+
+def launch_conda_job_array(
+    job_name,
+    job_output_directory,
+    env_name,
+    script,
+    script_args,
+    slurm_args,
+    max_concurrent=None,
+    pack_size=1,
+    pack_launcher="srun",
+    test=False,
+    submitter=None,
+    registry=None,
+    cache=None,
+    cache_mode=result_cache.CACHE_SKIP,
+    sweep_directory=None,
+    instrument=False,
+    profile=None,
+    attempt=1,
+    max_array_size=DEFAULT_MAX_ARRAY_SIZE,
+):
+    """Launches all rows of `script_args` csv as a single slurm job array.
+
+    All rows use `slurm_args`, see `launch_conda_job_arrays` for rows with resource columns.
+
+    The CLI arguments for each row are written to one line of `array_args.txt` in the
+    job directory and each array task reads its line using `SLURM_ARRAY_TASK_ID`.
+    `row_index.csv` maps each row (line of `array_args.txt`) to its `experiment_id`.
+
+    If `pack_size` is greater than 1, each array task runs `pack_size` rows, dispatched
+    across the `--ntasks` of the allocation after activating the conda env once.
+
+    args:
+        script_args: Path to csv or sweep spec, or `List` of `dict` with an `experiment_id`
+            key. See `launch_conda_sweep_array` to launch a sweep spec without writing its rows.
+        max_concurrent: Optionally, maximum number of array tasks to run at once.
+        pack_size: Number of rows to run in each array task.
+        pack_launcher: `"srun"` to run each packed row as a job step, `"local"` for a
+            background process.
+        cache: Optionally, `cache.ResultCache` of completed runs to skip.
+        sweep_directory: Optionally, existing sweep directory to place the job directory in,
+            e.g. shared by several job arrays.
+        instrument: If `True`, array tasks record the duration of their startup phases.
+        profile: Optionally, `"cprofile"` or `"py-spy"` to run rows under `profiler`.
+        attempt: Attempt of the rows recorded in `registry`, e.g. when retried.
+        max_array_size: Maximum number of tasks of a job array (`MaxArraySize` of the
+            cluster), see `launch_conda_job_arrays` to split larger sweeps.
+    """
+    script_args = list(_iter_script_args(script_args))
+    if not script_args:
+        raise ValueError("`script_args` contains no rows to launch.")
+
+    if sweep_directory is None:
+        sweep_directory = _sweep_output_directory(job_output_directory, job_name)
+    cache_key = result_cache.CacheKey(script, env_name, slurm_args)
+    cached_rows = []
+    script_args = [row for _, row in _skip_cached(
+        enumerate(script_args), cache, cache_key, sweep_directory, job_name, cache_mode, cached_rows, test)]
+    if cached_rows:
+        print(f"Skipped {len(cached_rows)} rows with completed runs in cache.")
+    if not script_args:
+        _register(registry, sweep_directory, job_name, script, env_name, slurm_args, cached_rows)
+        return None
+    jl, experiment_ids = build_conda_job_array(
+        job_name, sweep_directory, env_name, script, script_args, slurm_args,
+        max_concurrent, pack_size, pack_launcher, instrument, profile, max_array_size)
+    job_id = jl.run(test=test, submitter=submitter)
+    if not test:
+        rows = (
+            {
+                "job_id": job_id,
+                "array_index": row_index // pack_size,
+                "row_index": row_index,
+                "experiment_id": experiment_id,
+                "script_args": script_arg_job,
+                "job_directory": jl.job_directory,
+                "cache_key": cache_key(script_arg_job),
+                "attempt": attempt,
+            }
+            for row_index, (experiment_id, script_arg_job) in enumerate(zip(experiment_ids, script_args))
+        )
+        _register(
+            registry, sweep_directory, job_name, script, env_name, slurm_args,
+            itertools.chain(rows, cached_rows))
+    return jl
+
+
+def group_by_resources(script_args, slurm_args):
+    """Groups rows by the slurm args given by `slurm_args` and their resource columns.
+
+    Resource columns (`launch_job.RESOURCE_ARGS`) are removed from the rows.
+
+    returns:
+        `List` of `(slurm_args, rows)`, in order of the first row of each group.
+    """
+    groups = {}
+    for row in script_args:
+        row_slurm_args = launch_job.split_resources(row, slurm_args)
+        signature = launch_job.resource_signature(row_slurm_args)
+        if signature not in groups:
+            groups[signature] = (row_slurm_args, [])
+        groups[signature][1].append(row)
+    return list(groups.values())
+
+
+def right_size_rows(script_args, slurm_args, usage, group_columns, safety_margin=rightsize.DEFAULT_SAFETY_MARGIN):
+    """Yields rows with `time` and `mem_per_cpu` tightened to the usage of past rows of their group.
+
+    Rows are grouped by their values of `group_columns`, e.g. `model`. The requests of a row
+    (its resource columns, defaulting to `slurm_args`) are only ever lowered, see
+    `rightsize.right_size`.
+
+    args:
+        usage: Called with `dict` of group column to value, returns the usage of past rows of
+            the group, e.g. `functools.partial(registry.usage, script=script)`.
+    """
+    recommendations = {}
+    for row in script_args:
+        group = {column: row.get(column) for column in group_columns}
+        key = tuple(group.values())
+        if key not in recommendations:
+            recommendations[key] = rightsize.recommend(usage(script_args=group), safety_margin=safety_margin)
+            print(f"Right-sizing rows with {group} from {recommendations[key]['jobs']} completed jobs.")
+        requests = {k: slurm_args.get(k) if row.get(k) is None else row[k] for k in ("time", "mem_per_cpu")}
+        right_sized = rightsize.right_size(requests, recommendations[key])
+        yield {**row, **{k: v for k, v in right_sized.items() if v is not None}}
+
+
+def launch_conda_job_arrays(
+    job_name,
+    job_output_directory,
+    env_name,
+    script,
+    script_args,
+    slurm_args,
+    max_array_size=DEFAULT_MAX_ARRAY_SIZE,
+    **array_kwargs,
+):
+    """Launches rows of `script_args` as one job array for each set of requested resources.
+
+    Rows may set their own `time`, `mem_per_cpu`, `cpu_count` and `partition` in columns of
+    the same name, blank entries default to `slurm_args`. Rows requesting the same
+    resources are launched together by `launch_conda_job_array`, so that light rows are not
+    held back waiting for the resources of heavy rows. Groups with more tasks than
+    `max_array_size` (the `MaxArraySize` of the cluster) are split into several arrays. If
+    there are several groups, their job directories `{job_name}_{GROUP}` share one sweep
+    directory.
+
+    args:
+        array_kwargs: Passed to `launch_conda_job_array`, e.g. `max_concurrent`.
+
+    returns:
+        `List` of `CondaJobLauncher` for each group, `None` for groups whose rows are
+        all cached.
+    """
+    groups = group_by_resources(_iter_script_args(script_args), slurm_args)
+    if not groups:
+        raise ValueError("`script_args` contains no rows to launch.")
+    if max_array_size is not None:
+        group_rows = max_array_size * array_kwargs.get("pack_size", 1)
+        groups = [
+            (group_slurm_args, rows[i:i + group_rows])
+            for group_slurm_args, rows in groups
+            for i in range(0, len(rows), group_rows)
+        ]
+    array_kwargs["max_array_size"] = max_array_size
+    if len(groups) == 1:
+        group_slurm_args, rows = groups[0]
+        return [launch_conda_job_array(
+            job_name, job_output_directory, env_name, script, rows, group_slurm_args, **array_kwargs)]
+
+    sweep_directory = _sweep_output_directory(job_output_directory, job_name)
+    launchers = []
+    for group, (group_slurm_args, rows) in enumerate(groups):
+        print(f"Group {group}: {len(rows)} rows with {group_slurm_args}.")
+        launchers.append(launch_conda_job_array(
+            f"{job_name}_{group}",
+            job_output_directory,
+            env_name,
+            script,
+            rows,
+            group_slurm_args,
+            sweep_directory=sweep_directory,
+            **array_kwargs,
+        ))
+    return launchers
+
+
+def launch_conda_sweep_array(
+    job_name,
+    job_output_directory,
+    env_name,
+    script,
+    spec_file,
+    slurm_args,
+    max_concurrent=None,
+    pack_size=1,
+    pack_launcher="srun",
+    test=False,
+    submitter=None,
+    registry=None,
+    instrument=False,
+    profile=None,
+    max_array_size=DEFAULT_MAX_ARRAY_SIZE,
+):
+    """Launches all rows of sweep spec `spec_file` (see `sweep_spec`) as a single job array.
+
+    Unlike `launch_conda_job_array`, rows are not written out: the spec is copied to the
+    job directory and each array task computes its own rows from `SLURM_ARRAY_TASK_ID`,
+    so launching uses the same memory and files regardless of the size of the sweep. The
+    `experiment_id` of a row is its index.
+
+    args:
+        pack_size: Number of rows to run in each array task.
+        pack_launcher: `"srun"` to run each packed row as a job step, `"local"` for a
+            background process.
+        instrument: If `True`, array tasks record the duration of their startup phases.
+        profile: Optionally, `"cprofile"` or `"py-spy"` to run rows under `profiler`.
+        max_array_size: Maximum number of tasks of a job array (`MaxArraySize` of the
+            cluster). Rows are indexed by array task, so larger specs need a larger `pack_size`.
+    """
+    spec = sweep_spec.load_spec(spec_file)
+    if not len(spec):
+        raise ValueError(f"{spec_file} contains no rows to launch.")
+    _check_array_size(-(-len(spec) // pack_size), max_array_size)
+
+    sweep_directory = _sweep_output_directory(job_output_directory, job_name)
+    jl = launch_python_job.CondaJobLauncher(
+        env_name=env_name,
+        job_name=job_name,
+        job_output_directory=sweep_directory,
+        include_time_in_job_directory=False,
+        array_task_count=-(-len(spec) // pack_size),
+        array_max_concurrent=max_concurrent,
+        instrument=instrument,
+        profiler=_stage_profiler(sweep_directory, profile),
+    )
+    jl.make_directories()
+    # Saved as JSON and run with a copy of `sweep_spec`, since the job environment need not
+    # have `slurm_tools` or `PyYAML` installed.
+    spec_copy = jl.job_directory.joinpath(_SPEC_FILE_NAME)
+    with spec_copy.open("w") as f:
+        json.dump(sweep_spec.read_spec(spec_file), f)
+    spec_script = jl.job_directory.joinpath(_SPEC_SCRIPT_NAME)
+    shutil.copy(sweep_spec.__file__, spec_script)
+    jl.set_sbatch_commands(**slurm_args)
+    jl.set_sweep_job_commands(script, spec_script, spec_copy, pack_size, pack_launcher)
+    job_id = jl.run(test=test, submitter=submitter)
+    if not test:
+        # Entries are generated while they are written, one row at a time.
+        rows = (
+            {
+                "job_id": job_id,
+                "array_index": row_index // pack_size,
+                "row_index": row_index,
+                "experiment_id": row.pop("experiment_id"),
+                "script_args": row,
+                "job_directory": jl.job_directory,
+            }
+            for row_index, row in enumerate(spec)
+        )
+        _register(registry, sweep_directory, job_name, script, env_name, slurm_args, rows)
+    return jl
+
+
+def _write_array_args(job_directory, script_args):
+    """Writes CLI arguments (one line per row) and the index of `experiment_id`s."""
+    args_file = job_directory.joinpath(_ARRAY_ARGS_FILE_NAME)
+    index_file = job_directory.joinpath(_ROW_INDEX_FILE_NAME)
+    experiment_ids = []
+    with args_file.open("w") as af, index_file.open("w", newline="") as inf:
+        index_writer = csv.writer(inf)
+        index_writer.writerow(["row_index", "experiment_id"])
+        for row_index, script_arg_job in enumerate(script_args):
+            experiment_id = script_arg_job.pop("experiment_id")
+            af.write(csv_util.dict_to_CLI_args(script_arg_job) + "\n")
+            index_writer.writerow([row_index, experiment_id])
+            experiment_ids.append(experiment_id)
+    return args_file, experiment_ids
+
+
+def launch_conda_worker_pool(
+    job_name,
+    job_output_directory,
+    env_name,
+    script,
+    script_args,
+    slurm_args,
+    function="main",
+    call="kwargs",
+    pool_count=1,
+    chunk_size=1,
+    step_launcher="srun",
+    test=False,
+    submitter=None,
+    registry=None,
+    instrument=False,
+    profile=None,
+):
+    """Runs all rows of `script_args` csv on pools of warm python workers.
+
+    Each pool is a job (or array task if `pool_count` > 1) that starts one worker per
+    `--ntasks`. Workers import `script` once and call `function` for every row they
+    claim from `worker_tasks.jsonl`, so interpreter startup and imports are paid once
+    per worker rather than once per row.
+
+    args:
+        function: Name of the entry function of `script`.
+        call: `"kwargs"` to call `function(**row)` or `"argv"` to call `function()`
+            with `sys.argv` set to the CLI arguments of the row.
+        pool_count: Number of jobs sharing the tasks.
+        chunk_size: Number of consecutive rows claimed by a worker at once.
+        step_launcher: `"srun"` to start workers as job steps or `"local"` for processes.
+        instrument: If `True`, jobs record the duration of their startup phases, including
+            the imports of each worker.
+        profile: Optionally, `"cprofile"` or `"py-spy"` to run each worker under `profiler`.
+    """
+    script_args = list(_iter_script_args(script_args))
+    sweep_directory = _sweep_output_directory(job_output_directory, job_name)
+    jl = launch_python_job.CondaJobLauncher(
+        env_name=env_name,
+        job_name=job_name,
+        job_output_directory=sweep_directory,
+        include_time_in_job_directory=False,
+        array_task_count=pool_count if pool_count > 1 else None,
+        instrument=instrument,
+        profiler=_stage_profiler(sweep_directory, profile),
+    )
+    jl.make_directories()
+    tasks_file, experiment_ids = _write_worker_tasks(jl.job_directory, script_args)
+    # The worker runs in the job environment, which need not have `slurm_tools` installed.
+    worker_script = jl.job_directory.joinpath(_WORKER_SCRIPT_NAME)
+    shutil.copy(worker.__file__, worker_script)
+    jl.set_sbatch_commands(**slurm_args)
+    jl.set_worker_job_commands(
+        worker_script,
+        script,
+        tasks_file,
+        function=function,
+        call=call,
+        chunk_size=chunk_size,
+        step_launcher=step_launcher,
+    )
+    job_id = jl.run(test=test, submitter=submitter)
+    if not test:
+        # Rows are not tied to an array task since workers claim them dynamically, so they
+        # take the state of the whole pool (see `registry.array_state`).
+        rows = (
+            {
+                "job_id": job_id,
+                "array_index": None,
+                "row_index": row_index,
+                "experiment_id": experiment_id,
+                "script_args": script_arg_job,
+                "job_directory": jl.job_directory,
+            }
+            for row_index, (experiment_id, script_arg_job) in enumerate(zip(experiment_ids, script_args))
+        )
+        _register(registry, sweep_directory, job_name, script, env_name, slurm_args, rows)
+    return jl
+
+
+def _write_worker_tasks(job_directory, script_args):
+    """Writes one json task per row and the index of `experiment_id`s."""
+    tasks_file = job_directory.joinpath(_WORKER_TASKS_FILE_NAME)
+    index_file = job_directory.joinpath(_ROW_INDEX_FILE_NAME)
+    experiment_ids = []
+    with tasks_file.open("w") as tf, index_file.open("w", newline="") as inf:
+        index_writer = csv.writer(inf)
+        index_writer.writerow(["row_index", "experiment_id"])
+        for row_index, script_arg_job in enumerate(script_args):
+            experiment_id = script_arg_job.pop("experiment_id")
+            task = {"args": script_arg_job, "argv": csv_util.dict_to_CLI_args(script_arg_job)}
+            tf.write(json.dumps(task) + "\n")
+            index_writer.writerow([row_index, experiment_id])
+            experiment_ids.append(experiment_id)
+    return tasks_file, experiment_ids
+
+
+def resubmit_failed(
+    registry,
+    sweep_directory=None,
+    states=job_registry.FAILED_STATES,
+    max_concurrent=None,
+    test=False,
+    submitter=None,
+    policy=None,
+    now=None,
+):
+    """Resubmits failed rows recorded in `registry` as job arrays.
+
+    Rows are grouped by job name, script, environment, slurm args and attempt and each
+    group is launched as one job array next to the original sweep.
+
+    args:
+        policy: Optionally, a `retry.RetryPolicy`. Rows that used all of their attempts, or
+            whose backoff has not passed at `now`, are not resubmitted.
+
+    returns:
+        count: number of resubmitted rows.
+    """
+    groups = {}
+    for entry in registry.failed(sweep_directory, states):
+        if policy is not None and not policy.due(entry, now):
+            continue
+        key = (entry["job_name"], entry["script"], entry["env_name"], entry["slurm_args"],
+               entry["sweep_directory"], entry["attempt"])
+        groups.setdefault(key, []).append(entry)
+
+    for (job_name, script, env_name, slurm_args, original_sweep, attempt), entries in groups.items():
+        script_args = [
+            {"experiment_id": e["experiment_id"], **json.loads(e["script_args"])} for e in entries
+        ]
+        launch_conda_job_arrays(
+            job_name=f"{job_name}_resubmit",
+            job_output_directory=Path(original_sweep).parent,
             env_name=env_name,
             script=script,
-            script_args=script_arg_job,
-            slurm_args=slurm_args,
+            script_args=script_args,
+            slurm_args=json.loads(slurm_args),
+            max_concurrent=max_concurrent,
             test=test,
+            submitter=submitter,
+            registry=None if test else registry,
+            attempt=attempt + 1,
         )
+        if not test:
+            registry.mark_resubmitted(entries)
+    return sum(len(entries) for entries in groups.values())
+
+
+def awaiting_retry(registry, policy, sweep_directory=None, states=job_registry.FAILED_STATES):
+    """Returns failed entries of `registry` that `policy` will retry once their backoff passes."""
+    return [e for e in registry.failed(sweep_directory, states) if not policy.exhausted(e)]
 
 
 def parse_args():
@@ -52,14 +830,75 @@ def parse_args():
     parser.add_argument(
         "--job_output_directory", default=Path.home().joinpath("job_logs")
     )
+    # Name of a conda environment, or path of a conda-pack archive to stage on each node.
     parser.add_argument("--env_name")
+    # Check that `--env_name` (a path) was built by `create_env.sh` from these package specs, or this spec hash.
+    env_spec_group = parser.add_mutually_exclusive_group()
+    env_spec_group.add_argument("--env_packages", type=str, default=None)
+    env_spec_group.add_argument("--env_hash", type=str, default=None)
     parser.add_argument("--script", type=str)
+    # A csv with one row per job, or a sweep spec (`.json`/`.yaml`, see `sweep_spec`).
     parser.add_argument("--script_args", type=str)
     # Create set of option for `slurm_args`.
     slurm_args_group = parser.add_mutually_exclusive_group()
     slurm_args_group.add_argument("--slurm_args", type=json.loads)
     slurm_args_group.add_argument("--slurm_args_file", type=str)
     parser.add_argument("--test", action=argparse.BooleanOptionalAction, default=False)
+    # Submit all rows as one slurm job array instead of one job per row.
+    parser.add_argument("--array", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--max_concurrent", type=int, default=None)
+    # Run several rows in each array task.
+    parser.add_argument("--pack_size", type=int, default=1)
+    parser.add_argument("--pack_launcher", choices=["srun", "local"], default="srun")
+    # `MaxArraySize` of the cluster (`scontrol show config`), larger sweeps are split into several arrays.
+    parser.add_argument("--max_array_size", type=int, default=DEFAULT_MAX_ARRAY_SIZE)
+    # Spread one-job-per-row sweeps over subdirectories, e.g. `ab/cd/JOB` for 2 levels.
+    parser.add_argument("--shard_levels", type=int, default=0)
+    parser.add_argument("--shard_width", type=int, default=2)
+    # Run rows on pools of warm python workers.
+    parser.add_argument("--workers", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--worker_function", type=str, default="main")
+    parser.add_argument("--worker_call", choices=["kwargs", "argv"], default="kwargs")
+    parser.add_argument("--worker_pools", type=int, default=1)
+    parser.add_argument("--worker_chunk_size", type=int, default=1)
+    # Submission rate limits.
+    parser.add_argument("--submit_workers", type=int, default=4)
+    parser.add_argument("--submit_rate", type=float, default=None, help="Maximum submissions per second.")
+    # Run jobs on the cpus of the current allocation (e.g. of `salloc`) instead of submitting them.
+    parser.add_argument("--run_in_allocation", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--allocation_launcher", choices=list(allocation.LAUNCHERS), default=allocation.SRUN)
+    parser.add_argument("--allocation_cpus", type=int, default=None)
+    # Choose among these partitions by the predicted start of jobs, spreading rows over them.
+    parser.add_argument("--partitions", type=str, nargs="+", default=None)
+    parser.add_argument("--partition_chunk_size", type=int, default=1)
+    # Recorded output of `sinfo`, `squeue` and `sshare` to choose partitions from, required with `--test`.
+    parser.add_argument("--sinfo_output", type=str, default=None)
+    parser.add_argument("--squeue_output", type=str, default=None)
+    parser.add_argument("--sshare_output", type=str, default=None)
+    # Successive halving: rank rows by `--halving_metric` at these steps and cancel losing rows.
+    parser.add_argument("--halving_rungs", type=float, nargs="+", default=None)
+    parser.add_argument("--halving_metric", type=str, default="loss")
+    parser.add_argument("--halving_mode", choices=list(job_halving.MODES), default=job_halving.MIN)
+    parser.add_argument("--reduction_factor", type=float, default=job_halving.DEFAULT_REDUCTION_FACTOR)
+    parser.add_argument("--halving_interval", type=float, default=60)
+    # Record submissions in a registry, by default `registry.sqlite` in `job_output_directory`.
+    parser.add_argument("--registry", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--registry_file", type=str, default=None)
+    # Skip rows with a completed run, by default from `cache.sqlite` in `job_output_directory`.
+    parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--cache_file", type=str, default=None)
+    parser.add_argument(
+        "--cache_mode", choices=[result_cache.CACHE_SKIP, result_cache.CACHE_LINK], default=result_cache.CACHE_SKIP)
+    # Record startup phase timings in each job directory, see `slurm-tools timing`.
+    parser.add_argument("--instrument", action=argparse.BooleanOptionalAction, default=False)
+    # Profile jobs and record their resource usage in each job directory, see `slurm-tools profile`.
+    parser.add_argument("--profile", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--profile_sampler", choices=list(profiler.SAMPLERS), default=profiler.CPROFILE)
+    # Tighten `time` and `mem_per_cpu` to the recorded usage of earlier runs of `script`.
+    parser.add_argument("--right_size", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--right_size_margin", type=float, default=rightsize.DEFAULT_SAFETY_MARGIN)
+    # Right-size each group of rows with the same values of these columns on its own, e.g. `model`.
+    parser.add_argument("--right_size_by", type=str, nargs="+", default=None)
     return parser.parse_args()
 
 
@@ -77,7 +916,7 @@ def main():
     # Parse slurm args.
     if args.slurm_args_file is not None:
         # The output of the csv parser is a list of dictionaries. we take the first entry as the
-        # args for all experiments in this job.
+        # args for all experiments in this job. Rows of `script_args` may override resources.
         slurm_args = csv_util.parse_csv(args.slurm_args_file)[0]
     else:
         slurm_args = args.slurm_args
@@ -86,15 +925,192 @@ def main():
         print(f"slurm args: {slurm_args}")
 
     job_output_directory = Path(args.job_output_directory)
-    launch_conda_jobs_csv(
-        job_name=job_name,
-        job_output_directory=job_output_directory,
-        env_name=args.env_name,
-        script=script,
-        script_args=script_args,
-        slurm_args=slurm_args,
-        test=args.test,
-    )
+    args.env_name = launch_python_job.resolve_env(args.env_name)
+    if args.env_packages is not None:
+        args.env_hash = env_spec.spec_hash(args.env_packages)
+    if args.env_hash is not None:
+        env_spec.verify_env(args.env_name, args.env_hash)
+    submitter = submit.SbatchSubmitter(max_workers=args.submit_workers, rate=args.submit_rate)
+    if args.run_in_allocation and not args.test:
+        if not allocation.in_allocation():
+            raise ValueError("`--run_in_allocation` requires a slurm allocation, e.g. from `salloc`.")
+        submitter = allocation.AllocationExecutor(args.allocation_cpus, args.allocation_launcher)
+        # Jobs of the allocation are not known to `sacct`, so they are not recorded.
+        args.registry = False
+    registry = None
+    if args.registry and not args.test:
+        registry = job_registry.JobRegistry(
+            args.registry_file or job_registry.default_registry_file(job_output_directory))
+    cache = None
+    cache_file = Path(args.cache_file or result_cache.default_cache_file(job_output_directory))
+    # Read, but do not create, the cache in `--test` runs.
+    if args.cache and (not args.test or cache_file.exists()):
+        cache = result_cache.ResultCache(cache_file)
+        if registry is not None:
+            # Add runs that completed since the last launch.
+            registry.refresh()
+            cache.ingest(registry)
+    profile = args.profile_sampler if args.profile else None
+    launch_script_args = script_args
+    if args.right_size:
+        usage_registry = registry
+        if registry is not None:
+            registry.refresh()
+            rightsize.refresh_usage(registry)
+        else:
+            # Read, but do not create or record, the registry in `--test` runs.
+            registry_file = Path(
+                args.registry_file or job_registry.default_registry_file(job_output_directory))
+            if registry_file.exists():
+                usage_registry = job_registry.JobRegistry(registry_file)
+
+        def usage(script_args=None):
+            # Earlier runs of the same script and job name.
+            if usage_registry is None:
+                return []
+            return usage_registry.usage(script=script, job_name=job_name, script_args=script_args)
+
+        if args.right_size_by is None:
+            recommendation = rightsize.recommend(usage(), safety_margin=args.right_size_margin)
+            slurm_args = rightsize.right_size(slurm_args, recommendation)
+            print(f"Right-sized from {recommendation['jobs']} completed jobs: {slurm_args}")
+        elif args.workers or ((args.array or args.pack_size > 1) and sweep_spec.is_spec_file(script_args)):
+            raise ValueError(
+                "`--right_size_by` sets requests per row, which worker pools and job arrays of sweep "
+                "specs do not support.")
+        else:
+            launch_script_args = right_size_rows(
+                _iter_script_args(script_args), slurm_args, usage, args.right_size_by, args.right_size_margin)
+    if args.partitions is not None and args.test and args.sinfo_output is None:
+        # `--test` runs do not query the cluster.
+        print("Not choosing partitions in a `--test` run without `--sinfo_output`.")
+    elif args.partitions is not None:
+        runner = monitor.run_command
+        if args.sinfo_output is not None:
+            runner = job_partitions.recorded_runner(args.sinfo_output, args.squeue_output, args.sshare_output)
+        chooser = job_partitions.PartitionChooser(job_partitions.read_snapshot(runner), args.partitions)
+        if args.workers or ((args.array or args.pack_size > 1) and sweep_spec.is_spec_file(script_args)):
+            # Rows are not read here, so all jobs go to the partition where they start first.
+            slurm_args = dict(
+                slurm_args,
+                partition=chooser.choose(*job_partitions.requested_resources({}, slurm_args)),
+            )
+            print(f"Chose partition {slurm_args['partition']}.")
+        else:
+            launch_script_args = chooser.assign(
+                _iter_script_args(launch_script_args), slurm_args, args.partition_chunk_size)
+    if args.halving_rungs is not None:
+        if args.array or args.pack_size > 1 or args.workers or args.run_in_allocation or args.cache:
+            raise ValueError(
+                "`--halving_rungs` runs one job per row, without `--array`, `--pack_size`, `--workers`, "
+                "`--run_in_allocation` or `--cache`.")
+        launch_conda_halving_sweep(
+            job_name=job_name,
+            job_output_directory=job_output_directory,
+            env_name=args.env_name,
+            script=script,
+            script_args=launch_script_args,
+            slurm_args=slurm_args,
+            successive_halving=job_halving.SuccessiveHalving(
+                args.halving_rungs,
+                metric=args.halving_metric,
+                mode=args.halving_mode,
+                reduction_factor=args.reduction_factor,
+            ),
+            max_concurrent=args.max_concurrent,
+            test=args.test,
+            scheduler=job_halving.SlurmScheduler(submitter),
+            registry=registry,
+            interval=args.halving_interval,
+            instrument=args.instrument,
+            profile=profile,
+        )
+    elif args.workers:
+        if args.cache:
+            raise ValueError("`--cache` is not supported for worker pools.")
+        launch_conda_worker_pool(
+            job_name=job_name,
+            job_output_directory=job_output_directory,
+            env_name=args.env_name,
+            script=script,
+            script_args=script_args,
+            slurm_args=slurm_args,
+            function=args.worker_function,
+            call=args.worker_call,
+            pool_count=args.worker_pools,
+            chunk_size=args.worker_chunk_size,
+            step_launcher=args.pack_launcher,
+            test=args.test,
+            submitter=submitter,
+            registry=registry,
+            instrument=args.instrument,
+            profile=profile,
+        )
+    elif (args.array or args.pack_size > 1) and sweep_spec.is_spec_file(script_args):
+        if args.cache:
+            raise ValueError("`--cache` is not supported for job arrays of sweep specs.")
+        launch_conda_sweep_array(
+            job_name=job_name,
+            job_output_directory=job_output_directory,
+            env_name=args.env_name,
+            script=script,
+            spec_file=script_args,
+            slurm_args=slurm_args,
+            max_concurrent=args.max_concurrent,
+            pack_size=args.pack_size,
+            pack_launcher=args.pack_launcher,
+            max_array_size=args.max_array_size,
+            test=args.test,
+            submitter=submitter,
+            registry=registry,
+            instrument=args.instrument,
+            profile=profile,
+        )
+    elif args.array or args.pack_size > 1:
+        launch_conda_job_arrays(
+            job_name=job_name,
+            job_output_directory=job_output_directory,
+            env_name=args.env_name,
+            script=script,
+            script_args=launch_script_args,
+            slurm_args=slurm_args,
+            max_concurrent=args.max_concurrent,
+            pack_size=args.pack_size,
+            pack_launcher=args.pack_launcher,
+            max_array_size=args.max_array_size,
+            test=args.test,
+            submitter=submitter,
+            registry=registry,
+            cache=cache,
+            cache_mode=args.cache_mode,
+            instrument=args.instrument,
+            profile=profile,
+        )
+    else:
+        launch_conda_jobs_csv(
+            job_name=job_name,
+            job_output_directory=job_output_directory,
+            env_name=args.env_name,
+            script=script,
+            script_args=launch_script_args,
+            slurm_args=slurm_args,
+            test=args.test,
+            submitter=submitter,
+            registry=registry,
+            cache=cache,
+            cache_mode=args.cache_mode,
+            shard_levels=args.shard_levels,
+            shard_width=args.shard_width,
+            instrument=args.instrument,
+            profile=profile,
+        )
+
+    if isinstance(submitter, allocation.AllocationExecutor):
+        states = submitter.wait()
+        counts = {}
+        for state in states.values():
+            counts[state] = counts.get(state, 0) + 1
+        print(f"Ran {len(states)} jobs in the allocation: {counts}")
 
 
 if __name__ == "__main__":
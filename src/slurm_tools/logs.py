@@ -0,0 +1,173 @@
+"""Reads, follows and searches the logs of the jobs in a sweep without loading whole files."""
+
+import mmap
+import os
+from pathlib import Path
+import re
+import shutil
+import time
+
+from slurm_tools import launch_job
+
+OUTPUT="output"
+ERROR="error"
+# Logs are `output.txt`, `{ARRAY_INDEX}_output.txt` or `row_{ROW}_output.txt` (and `error`).
+_LOG_FILE_PATTERN = re.compile(r"(?:(?P<prefix>.+)_)?(?P<stream>output|error)\.txt")
+_BLOCK_SIZE = 1 << 16
+
+
+class LogFile(object):
+    """A log file of a job in a sweep."""
+
+    def __init__(self, job: str, stream: str, path: str):
+        self.job=job
+        self.stream=stream
+        self.path=path
+
+    def __repr__(self):
+        return f"LogFile({self.job!r}, {self.stream!r}, {self.path!r})"
+
+
+def iter_log_files(sweep_directory: Path, streams=(OUTPUT, ERROR)):
+    """Yields a `LogFile` for each log in `sweep_directory` and its subdirectories.
+
+    The job of a log is the directory relative to `sweep_directory`, without the shard
+    directories of a sharded layout, followed by `[{PREFIX}]` for logs of array tasks or
+    packed rows.
+    """
+    sweep_directory = Path(sweep_directory)
+    shard_levels = launch_job.read_layout(sweep_directory)["shard_levels"]
+    stack = [sweep_directory]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(Path(entry.path))
+                continue
+            match = _LOG_FILE_PATTERN.fullmatch(entry.name)
+            if match is None or match["stream"] not in streams:
+                continue
+            job = str(Path(*directory.relative_to(sweep_directory).parts[shard_levels:]))
+            if match["prefix"] is not None:
+                job = f"{job}[{match['prefix']}]"
+            yield LogFile(job, match["stream"], entry.path)
+        # Visit subdirectories in sorted order.
+        stack.extend(reversed(subdirectories))
+
+
+def tail(path, lines: int=10, block_size: int=_BLOCK_SIZE):
+    """Returns the last `lines` lines of `path` as `bytes`, reading backwards from the end."""
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        data = b""
+        # One more newline than `lines` is needed unless the start of the file is reached.
+        while position > 0 and data.count(b"\n") <= lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    if data.endswith(b"\n"):
+        data = data[:-1]
+    return b"\n".join(data.split(b"\n")[-lines:]) if lines > 0 else b""
+
+
+def copy(path, output, block_size: int=_BLOCK_SIZE):
+    """Writes the whole of `path` to the binary file `output` in blocks, ending with a newline."""
+    with open(path, "rb") as f:
+        shutil.copyfileobj(f, output, block_size)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return
+    output.write(b"\n")
+
+
+def search(path, pattern, max_matches: int=None):
+    """Returns `(line_number, line)` for lines of `path` that match `pattern`.
+
+    The file is memory-mapped, so only the pages that are scanned are read.
+
+    args:
+        pattern: compiled `bytes` regex.
+    """
+    matches = []
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return matches
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            line_number, counted_to = 1, 0
+            last_line_start = -1
+            for match in pattern.finditer(mm):
+                line_start = mm.rfind(b"\n", 0, match.start()) + 1
+                if line_start == last_line_start:
+                    # Report each line once.
+                    continue
+                last_line_start = line_start
+                line_end = mm.find(b"\n", match.end())
+                line_end = len(mm) if line_end == -1 else line_end
+                line_number += mm[counted_to:line_start].count(b"\n")
+                counted_to = line_start
+                matches.append((line_number, mm[line_start:line_end]))
+                if max_matches is not None and len(matches) >= max_matches:
+                    break
+    return matches
+
+
+def search_sweep(sweep_directory: Path, pattern: str, streams=(OUTPUT, ERROR), max_matches: int=None):
+    """Searches all logs of a sweep for `pattern`.
+
+    returns:
+        `dict` of job to list of `(stream, line_number, line)`.
+    """
+    compiled = re.compile(pattern.encode())
+    results = {}
+    for log in iter_log_files(sweep_directory, streams):
+        for line_number, line in search(log.path, compiled, max_matches):
+            results.setdefault(log.job, []).append((log.stream, line_number, line))
+    return results
+
+
+class LogFollower(object):
+    """Follows the logs of a sweep, reading only bytes appended since the last poll.
+
+    Offsets are kept per file, and new logs are picked up as jobs start.
+    """
+
+    def __init__(self, sweep_directory: Path, streams=(OUTPUT, ERROR), from_start: bool=False):
+        self.sweep_directory=Path(sweep_directory)
+        self.streams=streams
+        self.offsets={}
+        if not from_start:
+            for log in iter_log_files(self.sweep_directory, self.streams):
+                self.offsets[log.path] = os.stat(log.path).st_size
+
+    def poll(self):
+        """Yields `(LogFile, bytes)` for each log that grew since the last poll."""
+        for log in iter_log_files(self.sweep_directory, self.streams):
+            offset = self.offsets.get(log.path, 0)
+            try:
+                size = os.stat(log.path).st_size
+            except FileNotFoundError:
+                continue
+            if size < offset:
+                # Truncated, e.g. by a requeued job.
+                offset = 0
+            if size == offset:
+                continue
+            with open(log.path, "rb") as f:
+                f.seek(offset)
+                data = f.read(size - offset)
+            self.offsets[log.path] = size
+            yield log, data
+
+    def follow(self, interval: float=2, sleep=time.sleep):
+        """Yields `(LogFile, bytes)` as logs grow, forever."""
+        while True:
+            yield from self.poll()
+            sleep(interval)
@@ -0,0 +1,193 @@
+"""Monitors the state of many jobs with one `squeue` and one `sacct` call per poll."""
+
+import re
+import subprocess
+import time
+
+_SQUEUE_COMMAND="squeue"
+_SACCT_COMMAND="sacct"
+PENDING="pending"
+RUNNING="running"
+COMPLETED="completed"
+FAILED="failed"
+_CATEGORIES = {
+    "PENDING": PENDING,
+    "CONFIGURING": PENDING,
+    "REQUEUED": PENDING,
+    "REQUEUE_HOLD": PENDING,
+    "REQUEUE_FED": PENDING,
+    "RESV_DEL_HOLD": PENDING,
+    "SUSPENDED": PENDING,
+    "RUNNING": RUNNING,
+    "COMPLETING": RUNNING,
+    "STAGE_OUT": RUNNING,
+    "SIGNALING": RUNNING,
+    "RESIZING": RUNNING,
+    "COMPLETED": COMPLETED,
+}
+
+
+def run_command(command):
+    """Runs `command` and returns its stdout."""
+    return subprocess.run(command, capture_output=True, text=True, check=True).stdout
+
+
+class RecordedOutput(object):
+    """Replays recorded output of `squeue`/`sacct`, e.g. to test offline.
+
+    args:
+        outputs: `dict` of command name (e.g. `"squeue"`) to its recorded stdout.
+    """
+
+    def __init__(self, outputs: dict):
+        self.outputs=outputs
+
+    def __call__(self, command):
+        return self.outputs.get(command[0], "")
+
+
+def category(state: str):
+    """Returns one of `pending`, `running`, `completed` or `failed` for a slurm state."""
+    return _CATEGORIES.get(state, FAILED)
+
+
+def parse_squeue(squeue_output: str):
+    """Parses `JobID|State` lines of `squeue -h -o %i|%T`, expanding pending array ranges."""
+    return parse_sacct_states(squeue_output)
+
+
+def parse_sacct_states(sacct_output: str):
+    """Parses `JobID|State` lines of `sacct --parsable2`, expanding pending array ranges."""
+    states = {}
+    for line in sacct_output.splitlines():
+        if not line.strip():
+            continue
+        job, state = line.split("|")[:2]
+        # e.g. "CANCELLED by 1234".
+        state = state.split(" ")[0]
+        for key in expand_array_ids(job):
+            states[key] = state
+    return states
+
+
+def expand_array_ids(job: str):
+    """Expands `123_[0-2,5%4]` to `123_0, 123_1, 123_2, 123_5`."""
+    match = re.fullmatch(r"(\d+)_\[([^\]]*)\]", job)
+    if match is None:
+        return [job]
+    base, ranges = match.groups()
+    ranges = ranges.split("%")[0]
+    ids = []
+    for r in ranges.split(","):
+        first, _, last = r.partition("-")
+        ids.extend(f"{base}_{i}" for i in range(int(first), int(last or first) + 1))
+    return ids
+
+
+def read_sacct_states(job_ids, sacct_command=_SACCT_COMMAND, runner=run_command):
+    """Returns a `dict` of slurm id to state for `job_ids` with a single `sacct` call."""
+    return parse_sacct_states(runner(
+        [sacct_command, "--parsable2", "--noheader", "--allocations",
+         "--format=JobID,State", f"--jobs={','.join(job_ids)}"]))
+
+
+def read_squeue_states(squeue_command=_SQUEUE_COMMAND, runner=run_command):
+    """Returns a `dict` of slurm id to state for all of the user's queued jobs."""
+    return parse_squeue(runner([squeue_command, "--me", "-h", "-o", "%i|%T"]))
+
+
+class SweepMonitor(object):
+    """Tracks the state of the jobs in `job_ids`.
+
+    Each poll issues one `squeue` call for all queued jobs of the user and one `sacct`
+    call for the tracked jobs. `runner` runs a command and returns its stdout, see
+    `RecordedOutput` to replay recorded output.
+    """
+
+    def __init__(
+        self,
+        job_ids,
+        squeue_command: str=_SQUEUE_COMMAND,
+        sacct_command: str=_SACCT_COMMAND,
+        runner=run_command,
+    ):
+        self.job_ids=sorted(set(str(j) for j in job_ids))
+        self._job_id_set=set(self.job_ids)
+        self.squeue_command=squeue_command
+        self.sacct_command=sacct_command
+        self.runner=runner
+        self.states={}
+
+    def _tracked(self, key):
+        return _base_job_id(key) in self._job_id_set
+
+    def poll(self):
+        """Updates and returns `dict` of slurm id (`job` or `job_task`) to state."""
+        states = {}
+        if self.job_ids:
+            states.update(read_sacct_states(self.job_ids, self.sacct_command, self.runner))
+        # `squeue` is current for queued jobs, while `sacct` can lag behind.
+        states.update(read_squeue_states(self.squeue_command, self.runner))
+        for key, state in states.items():
+            if self._tracked(key) and "." not in key:
+                self.states[key] = state
+        # An array job's own entry is superseded once its tasks are listed.
+        arrays = {k.split("_")[0] for k in self.states if "_" in k}
+        for key in arrays.intersection(self.states):
+            del self.states[key]
+        return self.states
+
+    def counts(self):
+        """Returns the number of tracked jobs (or array tasks) in each category.
+
+        Jobs that neither `squeue` nor `sacct` reported yet are counted as pending.
+        """
+        counts = {PENDING: 0, RUNNING: 0, COMPLETED: 0, FAILED: 0}
+        for state in self.states.values():
+            counts[category(state)] += 1
+        counts[PENDING] += len(self._job_id_set - {_base_job_id(k) for k in self.states})
+        return counts
+
+    def finished(self):
+        """Returns `True` if all tracked jobs are completed or failed."""
+        counts = self.counts()
+        return counts[PENDING] == 0 and counts[RUNNING] == 0
+
+    def watch(
+        self,
+        interval: float=10,
+        max_interval: float=300,
+        backoff: float=1.5,
+        callback=None,
+        sleep=time.sleep,
+    ):
+        """Polls until all jobs finished, calling `callback(counts)` after each poll.
+
+        The interval grows by `backoff` (up to `max_interval`) while counts are unchanged
+        and resets to `interval` when they change.
+
+        returns:
+            counts: final counts of jobs in each category.
+        """
+        wait = interval
+        previous = None
+        while True:
+            self.poll()
+            counts = self.counts()
+            if callback is not None:
+                callback(counts)
+            if self.finished():
+                return counts
+            wait = interval if counts != previous else min(wait * backoff, max_interval)
+            previous = counts
+            sleep(wait)
+
+
+def _base_job_id(key: str):
+    """Returns job id of an array task (`job_task`) or job step (`job.step`)."""
+    return key.split("_")[0].split(".")[0]
+
+
+def format_counts(counts: dict):
+    """Formats counts as a single line."""
+    return " ".join(f"{k}={v}" for k, v in counts.items())
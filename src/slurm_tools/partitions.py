@@ -0,0 +1,261 @@
+"""Chooses partitions by the predicted start of jobs, from one snapshot of `sinfo`, `squeue` and `sshare`.
+
+The start of a job on a partition is estimated from the partition's idle cpus and the backlog
+of pending jobs ahead of it: `1 - fairshare` of the pending jobs are taken to be ahead of ours.
+If the idle cpus are not enough for them and our job, it starts once the partition, at the rate
+of all of its cpus, has run the time left of its running jobs and the work ahead.
+`PartitionChooser.assign` spreads the rows of a sweep, a chunk at a time, over the partitions
+whose estimated finish is earliest, so that the last row finishes as early as possible.
+"""
+
+import math
+from pathlib import Path
+import subprocess
+
+from slurm_tools import monitor
+from slurm_tools import rightsize
+
+_SINFO_COMMAND="sinfo"
+_SQUEUE_COMMAND="squeue"
+_SSHARE_COMMAND="sshare"
+_PARTITION_UP="up"
+PARTITION="partition"
+
+
+class PartitionState(object):
+    """Cpus, running jobs and pending backlog of a partition in a `Snapshot`.
+
+    `total_cpus` are the cpus that are allocated or idle, without drained or down nodes.
+    """
+
+    def __init__(self, name: str, total_cpus: int=0, idle_cpus: int=0, max_time: float=None, up: bool=True):
+        self.name=name
+        self.total_cpus=total_cpus
+        self.idle_cpus=idle_cpus
+        # Seconds, `None` if unlimited.
+        self.max_time=max_time
+        self.up=up
+        self.pending_cpus=0
+        self.pending_cpu_seconds=0.0
+        # Cpu seconds left of running jobs.
+        self.running_cpu_seconds=0.0
+
+    def __repr__(self):
+        return (
+            f"PartitionState({self.name!r}, total_cpus={self.total_cpus}, idle_cpus={self.idle_cpus}, "
+            f"pending_cpus={self.pending_cpus}, pending_cpu_seconds={self.pending_cpu_seconds})")
+
+
+class Snapshot(object):
+    """State of the partitions of a cluster and the fairshare of the user at one time."""
+
+    def __init__(self, partitions: dict, fairshare: float=None):
+        # `dict` of name to `PartitionState`.
+        self.partitions=partitions
+        # Between 0 and 1, `None` if unknown.
+        self.fairshare=fairshare
+
+
+def parse_sinfo(sinfo_output: str):
+    """Parses `Partition|CPUs (A/I/O/T)|TimeLimit|Avail` lines of `sinfo -h -o %R|%C|%l|%a`.
+
+    returns:
+        `dict` of partition name to `PartitionState`, summing lines of the same partition.
+    """
+    partitions = {}
+    for line in sinfo_output.splitlines():
+        if not line.strip():
+            continue
+        name, cpus, time_limit, avail = line.split("|")[:4]
+        allocated, idle, _, _ = (int(c) for c in cpus.split("/"))
+        if name not in partitions:
+            partitions[name] = PartitionState(
+                name, max_time=rightsize.parse_duration(time_limit), up=avail.strip() == _PARTITION_UP)
+        partitions[name].total_cpus += allocated + idle
+        partitions[name].idle_cpus += idle
+    return partitions
+
+
+def add_jobs(partitions: dict, squeue_output: str):
+    """Adds the jobs of `squeue -h -t PENDING,RUNNING -o %i|%P|%C|%l|%T|%L` to `partitions`.
+
+    Pending array tasks are counted one by one, jobs pending on several partitions count
+    towards each and jobs without a time limit are counted with the partition's limit.
+    Running jobs count with the time they have left.
+    """
+    for line in squeue_output.splitlines():
+        if not line.strip():
+            continue
+        job, names, cpus, time_limit, state, time_left = line.split("|")[:6]
+        for name in names.split(","):
+            partition = partitions.get(name)
+            if partition is None:
+                continue
+            if state == "RUNNING":
+                seconds = rightsize.parse_duration(time_left)
+                partition.running_cpu_seconds += int(cpus) * (seconds or partition.max_time or 0)
+                continue
+            count = len(monitor.expand_array_ids(job)) * int(cpus)
+            seconds = rightsize.parse_duration(time_limit)
+            partition.pending_cpus += count
+            partition.pending_cpu_seconds += count * (seconds or partition.max_time or 0)
+
+
+def parse_fairshare(sshare_output: str):
+    """Returns the first `FairShare` of `sshare -h -P -U -o FairShare`, `None` if there is none."""
+    for line in sshare_output.splitlines():
+        try:
+            return float(line.strip())
+        except ValueError:
+            continue
+    return None
+
+
+def recorded_runner(sinfo_output: Path, squeue_output: Path=None, sshare_output: Path=None):
+    """Returns a runner replaying recorded output files of `sinfo`, `squeue` and `sshare` for `read_snapshot`.
+
+    Missing `squeue`/`sshare` output counts as empty.
+    """
+    return monitor.RecordedOutput({
+        command: Path(output).read_text()
+        for command, output in (("sinfo", sinfo_output), ("squeue", squeue_output), ("sshare", sshare_output))
+        if output is not None
+    })
+
+
+def read_snapshot(runner=monitor.run_command):
+    """Reads partitions, jobs and fairshare with one `sinfo`, `squeue` and `sshare` call.
+
+    `runner` runs a command and returns its stdout, see `monitor.RecordedOutput` to use
+    recorded output. Clusters without fairshare accounting leave it unknown.
+    """
+    partitions = parse_sinfo(runner([_SINFO_COMMAND, "-h", "-o", "%R|%C|%l|%a"]))
+    add_jobs(partitions, runner([_SQUEUE_COMMAND, "-h", "-t", "PENDING,RUNNING", "-o", "%i|%P|%C|%l|%T|%L"]))
+    try:
+        fairshare = parse_fairshare(runner([_SSHARE_COMMAND, "-h", "-P", "-U", "-o", "FairShare"]))
+    except (OSError, subprocess.CalledProcessError):
+        fairshare = None
+    return Snapshot(partitions, fairshare)
+
+
+class PartitionChooser(object):
+    """Estimates when jobs start on acceptable partitions, see the module docstring.
+
+    args:
+        snapshot: `Snapshot` of the cluster.
+        partitions: Names of acceptable partitions, in order of preference for ties.
+    """
+
+    def __init__(self, snapshot: Snapshot, partitions):
+        self.snapshot=snapshot
+        self.partitions=list(partitions)
+        missing = [p for p in self.partitions if p not in snapshot.partitions]
+        if missing:
+            raise ValueError(f"Partitions {missing} are not reported by `sinfo`.")
+        # Unknown fairshare counts all pending jobs as ahead.
+        self.fairshare=snapshot.fairshare or 0.0
+
+    def eligible(self, cpus: int, seconds: float):
+        """Returns the acceptable partitions that are up and can run a job of `cpus` for `seconds`."""
+        return [
+            p for p in self.partitions
+            if self.snapshot.partitions[p].up
+            and self.snapshot.partitions[p].total_cpus >= cpus
+            and (self.snapshot.partitions[p].max_time is None or self.snapshot.partitions[p].max_time >= seconds)
+        ]
+
+    def _ahead(self, partition: PartitionState):
+        """Returns `(cpus, cpu_seconds)` of the pending jobs expected to start before ours."""
+        share = 1 - self.fairshare
+        return partition.pending_cpus * share, partition.pending_cpu_seconds * share
+
+    def estimate_start(self, partition: str, cpus: int=1):
+        """Returns the estimated seconds until a job of `cpus` starts on `partition`."""
+        state = self.snapshot.partitions[partition]
+        ahead_cpus, ahead_cpu_seconds = self._ahead(state)
+        if state.idle_cpus - ahead_cpus >= cpus:
+            return 0.0
+        return (state.running_cpu_seconds + ahead_cpu_seconds) / max(state.total_cpus, 1)
+
+    def slots(self, partition: str, cpus: int=1):
+        """Returns the number of jobs of `cpus` expected to run at once on `partition`.
+
+        Jobs use the cpus left idle by the jobs ahead, or on a busy partition the user's
+        fairshare of its cpus, and at least one job runs at a time.
+        """
+        state = self.snapshot.partitions[partition]
+        ahead_cpus, _ = self._ahead(state)
+        available = max(state.idle_cpus - ahead_cpus, self.fairshare * state.total_cpus)
+        return max(1, int(available // cpus))
+
+    def estimate_finish(self, partition: str, count: int, cpus: int, seconds: float):
+        """Returns the estimated seconds until `count` jobs of `cpus` for `seconds` finish on `partition`."""
+        if count == 0:
+            return 0.0
+        rounds = math.ceil(count / self.slots(partition, cpus))
+        return self.estimate_start(partition, cpus) + rounds * seconds
+
+    def choose(self, cpus: int=1, seconds: float=0):
+        """Returns the eligible partition on which a job of `cpus` for `seconds` starts first."""
+        eligible = self.eligible(cpus, seconds)
+        if not eligible:
+            raise ValueError(f"None of partitions {self.partitions} can run {cpus} cpus for {seconds} seconds.")
+        return min(eligible, key=lambda p: self.estimate_start(p, cpus))
+
+    def assign(self, rows, slurm_args: dict, chunk_size: int=1):
+        """Sets the `partition` column of `rows`, `chunk_size` consecutive rows at a time.
+
+        Each chunk goes to the eligible partition on which it would finish first, given the
+        rows already assigned to it, so the rows finish together rather than queueing on
+        one partition. Rows with a `partition` already keep it. The `time` and `cpu_count`
+        of a row default to `slurm_args`.
+
+        yields:
+            Rows, in order, with `partition` set.
+        """
+        # `dict` of `(partition, cpus, seconds)` to number of rows.
+        assigned = {}
+        chunk = []
+
+        def _assign(chunk):
+            cpus, seconds = requested_resources(chunk[0], slurm_args)
+            eligible = self.eligible(cpus, seconds)
+            if not eligible:
+                raise ValueError(
+                    f"None of partitions {self.partitions} can run {cpus} cpus for {seconds} seconds.")
+
+            def _finish(partition):
+                count = assigned.get((partition, cpus, seconds), 0) + len(chunk)
+                return self.estimate_finish(partition, count, cpus, seconds)
+
+            partition = min(eligible, key=_finish)
+            assigned[(partition, cpus, seconds)] = assigned.get((partition, cpus, seconds), 0) + len(chunk)
+            for row in chunk:
+                row[PARTITION] = partition
+            return chunk
+
+        for row in rows:
+            if row.get(PARTITION) is not None:
+                key = (row[PARTITION], *requested_resources(row, slurm_args))
+                assigned[key] = assigned.get(key, 0) + 1
+                yield row
+                continue
+            if chunk and requested_resources(row, slurm_args) != requested_resources(chunk[0], slurm_args):
+                yield from _assign(chunk)
+                chunk = []
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield from _assign(chunk)
+                chunk = []
+        if chunk:
+            yield from _assign(chunk)
+
+
+def requested_resources(row: dict, slurm_args: dict):
+    """Returns `(cpus, seconds)` requested by the resource columns of `row`, defaulting to `slurm_args`."""
+    cpus = row.get("cpu_count") or slurm_args.get("cpu_count") or 1
+    time = row.get("time") or slurm_args.get("time")
+    seconds = None if time is None else rightsize.parse_time_request(str(time))
+    if seconds is None:
+        raise ValueError("A limited `time` is required to choose partitions.")
+    return int(cpus), seconds
@@ -0,0 +1,141 @@
+"""Multi-stage pipelines submitted at once, each stage held by slurm until its dependencies finish.
+
+e.g. preprocess, then a sweep, then an aggregate of the sweep:
+
+    p = pipeline.Pipeline()
+    p.add("preprocess", preprocess_launcher)
+    p.add("sweep", sweep_launcher, after="preprocess")
+    p.add("aggregate", aggregate_launcher, after={"sweep": pipeline.AFTERANY})
+    job_ids = p.submit()
+
+Stages are `launch_job.JobLauncher`s (e.g. `CondaJobLauncher`s, or job arrays built with
+`launch_python_jobs_array.build_conda_job_array`) and are submitted in the order they are
+added with `--dependency` on the job ids of earlier stages.
+"""
+
+from slurm_tools import launch_job
+
+# Start after the dependency completed successfully.
+AFTEROK="afterok"
+# Start after the dependency ended, whatever its state.
+AFTERANY="afterany"
+# Start after the dependency failed.
+AFTERNOTOK="afternotok"
+# Start each array task after the task with the same index of a dependency array succeeded.
+AFTERCORR="aftercorr"
+DEPENDENCY_TYPES=(AFTEROK, AFTERANY, AFTERNOTOK, AFTERCORR)
+# Cancel jobs whose dependencies can no longer be satisfied instead of leaving them pending.
+_KILL_ON_INVALID_DEPENDENCY_ARG="--kill-on-invalid-dep=yes"
+
+
+def dependency_arg(dependencies):
+    """Formats `(dependency_type, job_id)` pairs as the value of `--dependency`.
+
+    All dependencies must be satisfied, e.g. `afterok:101:102,aftercorr:103`.
+    """
+    job_ids = {}
+    for dependency_type, job_id in dependencies:
+        job_ids.setdefault(dependency_type, []).append(str(job_id))
+    return ",".join(f"{t}:{':'.join(ids)}" for t, ids in job_ids.items())
+
+
+class Stage(object):
+    """A job of a `Pipeline` and the earlier stages it depends on."""
+
+    def __init__(self, name: str, launcher: launch_job.JobLauncher, dependencies):
+        self.name=name
+        self.launcher=launcher
+        # `List` of `(dependency_type, stage_name)`.
+        self.dependencies=dependencies
+        self.job_id=None
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, dependencies={self.dependencies!r}, job_id={self.job_id!r})"
+
+
+class Pipeline(object):
+    """Stages of jobs that are all submitted upfront, see the module docstring.
+
+    args:
+        kill_on_invalid_dependency: If `True`, slurm cancels stages whose dependencies can no
+            longer be satisfied (e.g. `afterok` on a failed job), instead of keeping them
+            pending with reason `DependencyNeverSatisfied`.
+    """
+
+    def __init__(self, kill_on_invalid_dependency: bool=True):
+        self.kill_on_invalid_dependency=kill_on_invalid_dependency
+        self.stages={}
+
+    def add(self, name: str, launcher: launch_job.JobLauncher, after=(), dependency: str=AFTEROK):
+        """Adds a stage that starts after the stages in `after`.
+
+        Stages can only depend on stages added before them, so the pipeline has no cycles.
+
+        args:
+            after: Name of an earlier stage, a list of names or a `dict` of name to
+                dependency type. Names in a list depend with type `dependency`.
+            dependency: One of `DEPENDENCY_TYPES`. `AFTERCORR` requires both stages to be
+                job arrays with the same number of tasks.
+
+        returns:
+            `Stage`.
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage `{name}` already exists.")
+        if isinstance(after, str):
+            after = [after]
+        if not isinstance(after, dict):
+            after = {stage_name: dependency for stage_name in after}
+        dependencies = []
+        for stage_name, dependency_type in after.items():
+            if dependency_type not in DEPENDENCY_TYPES:
+                raise ValueError(f"Unknown dependency type `{dependency_type}`, use one of {DEPENDENCY_TYPES}.")
+            if stage_name not in self.stages:
+                raise ValueError(f"Stage `{name}` depends on `{stage_name}`, which has not been added.")
+            if dependency_type == AFTERCORR:
+                _check_corresponding_arrays(self.stages[stage_name].launcher, launcher, stage_name, name)
+            dependencies.append((dependency_type, stage_name))
+        stage = Stage(name, launcher, dependencies)
+        self.stages[name] = stage
+        return stage
+
+    def sbatch_args(self, stage: Stage, test: bool=False):
+        """Returns the `sbatch` arguments of `stage`, with the job ids of submitted stages.
+
+        If `test`, stages are referred to by name, e.g. `--dependency=afterok:<preprocess>`.
+        """
+        if not stage.dependencies:
+            return []
+        dependencies = [
+            (dependency_type, f"<{stage_name}>" if test else self.stages[stage_name].job_id)
+            for dependency_type, stage_name in stage.dependencies
+        ]
+        args = [f"--dependency={dependency_arg(dependencies)}"]
+        if self.kill_on_invalid_dependency:
+            args.append(_KILL_ON_INVALID_DEPENDENCY_ARG)
+        return args
+
+    def submit(self, test: bool=False, submitter=None):
+        """Submits every stage in order, each with `--dependency` on the stages it follows.
+
+        If a submission fails, the error is raised and submitted stages keep their `job_id`.
+
+        returns:
+            `dict` of stage name to job id. Job ids are `None` if `test`.
+        """
+        for stage in self.stages.values():
+            stage.job_id = stage.launcher.run(
+                test=test, submitter=submitter, sbatch_args=self.sbatch_args(stage, test))
+        return {name: stage.job_id for name, stage in self.stages.items()}
+
+
+def _check_corresponding_arrays(upstream, downstream, upstream_name, downstream_name):
+    """Raises `ValueError` unless both launchers are job arrays of the same size."""
+    counts = (upstream.array_task_count, downstream.array_task_count)
+    if None in counts:
+        raise ValueError(
+            f"`{AFTERCORR}` of `{downstream_name}` on `{upstream_name}` requires both stages to be job arrays.")
+    if counts[0] != counts[1]:
+        raise ValueError(
+            f"`{AFTERCORR}` of `{downstream_name}` on `{upstream_name}` requires arrays of the same size, "
+            f"got {counts[1]} and {counts[0]} tasks.")
@@ -0,0 +1,168 @@
+"""Runs a python module or script under a profiler and records its resource usage.
+
+Jobs launched with `--profile` run their python commands through this file instead of `python`
+(see `sbatch_command.Profiler`):
+
+    python profiler.py --output_prefix DIR/ [--sampler py-spy] -m MODULE ARGS...
+    python profiler.py --output_prefix DIR/ SCRIPT ARGS...
+
+The module runs in this process under `cProfile`, writing `DIR/profile.pstats`, or with
+`--sampler py-spy` and `py-spy` installed, under the sampling profiler in a child process,
+writing collapsed stacks to `DIR/profile.txt`. Either way `DIR/usage.json` records the wall
+and cpu time, peak resident set size, page faults, context switches and I/O counters, like
+`/usr/bin/time -v`. `%p` in the prefix is replaced by the process id, e.g. for workers.
+
+This module only depends on the standard library since it is copied into the sweep directory
+and run with the python of the job's environment.
+"""
+
+import cProfile
+import json
+import os
+from pathlib import Path
+import resource
+import runpy
+import shutil
+import subprocess
+import sys
+import time
+
+CPROFILE="cprofile"
+PY_SPY="py-spy"
+SAMPLERS=(CPROFILE, PY_SPY)
+PROFILE_FILE_NAME="profile.pstats"
+SAMPLE_FILE_NAME="profile.txt"
+USAGE_FILE_NAME="usage.json"
+_DEFAULT_RATE=100
+# Fields of `/proc/self/io`, bytes and calls read and written by the process.
+_IO_FIELDS=("rchar", "wchar", "syscr", "syscw", "read_bytes", "write_bytes")
+_USAGE = """usage: profiler.py --output_prefix PREFIX [--sampler {cprofile,py-spy}] [--rate HZ]
+                   (-m MODULE | SCRIPT) [ARGS...]"""
+
+
+def parse_args(argv):
+    """Parses the options of the profiler, up to `-m MODULE` or `SCRIPT`.
+
+    All arguments after the module or script are passed to it, as with `python`.
+    """
+    options = {"output_prefix": "", "sampler": CPROFILE, "rate": _DEFAULT_RATE, "module": None, "script": None}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        name, _, value = arg.partition("=")
+        if name in ("--output_prefix", "--sampler", "--rate"):
+            if not value:
+                i += 1
+                if i == len(argv):
+                    raise SystemExit(_USAGE)
+                value = argv[i]
+            options[name[2:]] = value
+        elif arg == "-m" and i + 1 < len(argv):
+            options["module"] = argv[i + 1]
+            return options, argv[i + 2:]
+        elif not arg.startswith("-"):
+            options["script"] = arg
+            return options, argv[i + 1:]
+        else:
+            raise SystemExit(_USAGE)
+        i += 1
+    raise SystemExit(_USAGE)
+
+
+def run_profiled(module, script, args, profile_file):
+    """Runs `module` (or `script`) with `args` in this process under `cProfile`.
+
+    The profile is written even if the module raises or exits.
+    """
+    sys.argv = [module or script, *args]
+    # As `python -m` (or `python SCRIPT`), imports start from the cwd (or the script's directory).
+    sys.path[0] = os.getcwd() if module else str(Path(script).absolute().parent)
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+        if module:
+            runpy.run_module(module, run_name="__main__", alter_sys=True)
+        else:
+            runpy.run_path(script, run_name="__main__")
+    finally:
+        profile.disable()
+        profile.dump_stats(profile_file)
+
+
+def run_sampled(module, script, args, sample_file, rate=_DEFAULT_RATE):
+    """Runs `module` (or `script`) with `args` under `py-spy`, returning its exit status."""
+    target = ["-m", module] if module else [script]
+    return subprocess.run([
+        PY_SPY, "record", "--format", "raw", "--rate", str(rate), "--subprocesses",
+        "--output", str(sample_file), "--", sys.executable, *target, *args,
+    ]).returncode
+
+
+def _kilobytes(max_rss):
+    """Converts `ru_maxrss` to kilobytes, it is in bytes on macOS."""
+    return max_rss // 1024 if sys.platform == "darwin" else max_rss
+
+
+def read_io():
+    """Returns `dict` of the I/O counters of this process, empty if `/proc/self/io` is missing."""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+    return {k: int(counters[k]) for k in _IO_FIELDS if k in counters}
+
+
+def read_usage(elapsed_seconds: float, sampled: bool):
+    """Returns the resource usage of this process and its children, see the module docstring.
+
+    Sampled modules run in a child process, so their I/O counters are not available.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage = {
+        "elapsed_seconds": elapsed_seconds,
+        "user_seconds": own.ru_utime + children.ru_utime,
+        "system_seconds": own.ru_stime + children.ru_stime,
+        "max_rss_kb": _kilobytes(max(own.ru_maxrss, children.ru_maxrss)),
+        "major_page_faults": own.ru_majflt + children.ru_majflt,
+        "minor_page_faults": own.ru_minflt + children.ru_minflt,
+        "voluntary_context_switches": own.ru_nvcsw + children.ru_nvcsw,
+        "involuntary_context_switches": own.ru_nivcsw + children.ru_nivcsw,
+        "file_system_inputs": own.ru_inblock + children.ru_inblock,
+        "file_system_outputs": own.ru_oublock + children.ru_oublock,
+    }
+    if not sampled:
+        usage.update(read_io())
+    return usage
+
+
+def write_usage(usage_file: Path, usage: dict):
+    """Writes `usage` to `usage_file` at once."""
+    partial_file = Path(f"{usage_file}.tmp")
+    with open(partial_file, "w") as f:
+        json.dump(usage, f)
+    os.replace(partial_file, usage_file)
+
+
+def main(argv=None):
+    options, args = parse_args(sys.argv[1:] if argv is None else argv)
+    prefix = options["output_prefix"].replace("%p", str(os.getpid()))
+    sampled = options["sampler"] == PY_SPY and shutil.which(PY_SPY) is not None
+    if options["sampler"] == PY_SPY and not sampled:
+        print(f"`{PY_SPY}` is not installed, profiling with `cProfile`.", file=sys.stderr)
+    start = time.time()
+    status = 0
+    try:
+        if sampled:
+            status = run_sampled(
+                options["module"], options["script"], args, f"{prefix}{SAMPLE_FILE_NAME}", int(options["rate"]))
+        else:
+            run_profiled(options["module"], options["script"], args, f"{prefix}{PROFILE_FILE_NAME}")
+    finally:
+        write_usage(f"{prefix}{USAGE_FILE_NAME}", read_usage(time.time() - start, sampled))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
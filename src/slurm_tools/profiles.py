@@ -0,0 +1,216 @@
+"""Merges the profiles and resource usage of profiled jobs (see `profiler`) across a sweep.
+
+Jobs launched with `--profile` write, per job, array task or packed row, a `profile.pstats`
+of `cProfile` or a `profile.txt` of `py-spy` samples, and a `usage.json` of their resource
+usage, prefixed like results (see `results.iter_result_directories`). Workers write one set
+per worker process. `cProfile` profiles are merged into one `pstats.Stats` and samples into
+one count per stack, and both are ranked into hotspots. Usage is summarized by percentiles
+across jobs, with `cpu_fraction` (cpu time over wall time) showing how much of the time jobs
+computed rather than waited, e.g. on I/O.
+"""
+
+import collections
+import json
+from pathlib import Path
+import pstats
+
+from slurm_tools import profiler
+from slurm_tools import results
+from slurm_tools import timing
+
+PROFILE_FILE_NAME=profiler.PROFILE_FILE_NAME
+SAMPLE_FILE_NAME=profiler.SAMPLE_FILE_NAME
+USAGE_FILE_NAME=profiler.USAGE_FILE_NAME
+TOTTIME="tottime"
+CUMTIME="cumtime"
+CALLS="calls"
+SORT_KEYS=(TOTTIME, CUMTIME, CALLS)
+CPU_FRACTION="cpu_fraction"
+DEFAULT_LIMIT=30
+
+
+def iter_job_profiles(sweep_directory: Path, experiment_ids=None):
+    """Yields `(job, experiment_id, files)` for each profiled job, array task, row or worker.
+
+    `files` is a `dict` of file name (e.g. `profile.pstats`) to path. If `experiment_ids` is
+    given, only rows with one of them are yielded; workers run many rows, so they are not.
+    """
+    experiment_ids = None if experiment_ids is None else {str(e) for e in experiment_ids}
+    for directory, job, found in results.iter_result_directories(
+            sweep_directory, file_names=(PROFILE_FILE_NAME, SAMPLE_FILE_NAME, USAGE_FILE_NAME)):
+        ids = results.experiment_ids(directory, [prefix for prefix, _, _ in found])
+        by_prefix = {}
+        for prefix, path, _ in found:
+            name = Path(path).name if prefix is None else Path(path).name[len(prefix) + 1:]
+            by_prefix.setdefault(prefix, {})[name] = Path(path)
+        for prefix, files in by_prefix.items():
+            if experiment_ids is not None and ids[prefix] not in experiment_ids:
+                continue
+            yield (job if prefix is None else f"{job}[{prefix}]"), ids[prefix], files
+
+
+def merge_stats(paths):
+    """Merges `cProfile` profiles, skipping files that cannot be read (e.g. of running jobs).
+
+    returns:
+        `(stats, unreadable)`: `pstats.Stats` of all readable `paths`, `None` if there are
+        none, and the number of files skipped.
+    """
+    stats = None
+    unreadable = 0
+    for path in paths:
+        try:
+            if stats is None:
+                stats = pstats.Stats(str(path))
+            else:
+                stats.add(str(path))
+        except (OSError, EOFError, ValueError, TypeError):
+            unreadable += 1
+    return stats, unreadable
+
+
+def _function_name(file_name, line, name):
+    """Formats a `pstats` function key like `pstats.func_std_string`."""
+    if file_name == "~":
+        return name
+    return f"{name} ({file_name}:{line})"
+
+
+def hotspots(stats, sort: str=TOTTIME, limit: int=DEFAULT_LIMIT):
+    """Ranks the functions of merged `stats` by `sort`, one of `SORT_KEYS`.
+
+    returns:
+        `List` of `dict` with `function`, `calls`, `primitive_calls`, `tottime`, `cumtime`
+        (seconds summed over jobs) and `fraction`, `tottime` over the total time.
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"`sort` must be one of {SORT_KEYS}.")
+    total = stats.total_tt or 1
+    functions = [
+        {
+            "function": _function_name(*key),
+            "calls": calls,
+            "primitive_calls": primitive_calls,
+            TOTTIME: tottime,
+            CUMTIME: cumtime,
+            "fraction": tottime / total,
+        }
+        for key, (primitive_calls, calls, tottime, cumtime, _) in stats.stats.items()
+    ]
+    functions.sort(key=lambda f: f[sort], reverse=True)
+    return functions[:limit]
+
+
+def read_samples(sample_file: Path, samples=None):
+    """Adds the stacks of a `py-spy --format raw` file to `samples`, a `Counter` of stack to samples.
+
+    Each line is `frame;frame;...;frame COUNT`, outermost frame first.
+    """
+    samples = collections.Counter() if samples is None else samples
+    with open(sample_file) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack and count.isdigit():
+                samples[stack] += int(count)
+    return samples
+
+
+def sampled_hotspots(samples, limit: int=DEFAULT_LIMIT):
+    """Ranks the frames of `samples` by the samples they were running in (`self`).
+
+    returns:
+        `List` of `dict` with `function`, `self` and `total` samples (in the frame or a
+        frame it called) and their fractions of all samples.
+    """
+    own = collections.Counter()
+    total = collections.Counter()
+    for stack, count in samples.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    count = sum(samples.values()) or 1
+    return [
+        {
+            "function": frame,
+            "self": own[frame],
+            "total": total[frame],
+            "self_fraction": own[frame] / count,
+            "total_fraction": total[frame] / count,
+        }
+        for frame, _ in sorted(total.items(), key=lambda f: (own[f[0]], f[1]), reverse=True)[:limit]
+    ]
+
+
+def read_usage(usage_file: Path):
+    """Returns the usage of `usage_file` with its `cpu_fraction`, `None` if it cannot be read."""
+    try:
+        with open(usage_file) as f:
+            usage = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if usage.get("elapsed_seconds"):
+        usage[CPU_FRACTION] = (usage["user_seconds"] + usage["system_seconds"]) / usage["elapsed_seconds"]
+    return usage
+
+
+def summarize_usage(usages, percentiles=timing.DEFAULT_PERCENTILES):
+    """Aggregates usages into `dict` of field to count and percentiles, as `timing.summarize`."""
+    by_field = {}
+    for usage in usages:
+        for field, value in usage.items():
+            by_field.setdefault(field, []).append(value)
+    return {
+        field: {"count": len(values), **{f"p{q:g}": timing.percentile(values, q) for q in percentiles}}
+        for field, values in by_field.items()
+    }
+
+
+def profile_sweep(
+    sweep_directory: Path,
+    experiment_ids=None,
+    sort: str=TOTTIME,
+    limit: int=DEFAULT_LIMIT,
+    percentiles=timing.DEFAULT_PERCENTILES,
+    stats_file: Path=None,
+):
+    """Merges the profiles of a sweep, or of the rows with `experiment_ids`, into one report.
+
+    args:
+        sort: Ranks `cProfile` functions by one of `SORT_KEYS`.
+        limit: Number of functions and sampled frames in the report.
+        stats_file: Optionally, file to save the merged `pstats.Stats` to, e.g. for `snakeviz`.
+
+    returns:
+        report: `dict` with the number of `jobs`, of `unreadable` profiles, the `usage` summary
+            (see `summarize_usage`), `functions` (see `hotspots`) and `samples` (see
+            `sampled_hotspots`).
+    """
+    jobs = 0
+    profile_files = []
+    samples = collections.Counter()
+    usages = []
+    unreadable = 0
+    for _, _, files in iter_job_profiles(sweep_directory, experiment_ids):
+        jobs += 1
+        if PROFILE_FILE_NAME in files:
+            profile_files.append(files[PROFILE_FILE_NAME])
+        if SAMPLE_FILE_NAME in files:
+            try:
+                read_samples(files[SAMPLE_FILE_NAME], samples)
+            except OSError:
+                unreadable += 1
+        if USAGE_FILE_NAME in files:
+            usage = read_usage(files[USAGE_FILE_NAME])
+            if usage is not None:
+                usages.append(usage)
+    stats, unreadable_stats = merge_stats(profile_files)
+    if stats is not None and stats_file is not None:
+        stats.dump_stats(str(stats_file))
+    return {
+        "jobs": jobs,
+        "unreadable": unreadable + unreadable_stats,
+        "usage": summarize_usage(usages, percentiles),
+        "functions": [] if stats is None else hotspots(stats, sort, limit),
+        "samples": sampled_hotspots(samples, limit) if samples else [],
+    }
@@ -1,4 +1,5 @@
 #!/bin/bash
+# Prints logs of an experiment folder, see `slurm-tools logs --help` for search and follow.
 
 EXPERIMENT_NAME=${1}
 shift
@@ -11,7 +12,6 @@ READ_SBATCH=false
 while [[ $# -gt 0 ]]
 do
 key="$1"
-echo key
 case $key in
 	-o|--output)
 		READ_OUTPUT=true
@@ -29,13 +29,13 @@ done
 JOB_FOLDER=${JOB_LOGS}/${EXPERIMENT_NAME}
 
 if [ "$READ_OUTPUT" = true ]; then
-	cat ${JOB_FOLDER}/*output.txt
+	slurm-tools logs ${JOB_FOLDER} --stream output --tail 0
 fi
 
 if [ "$READ_ERROR" = true ]; then
-	cat ${JOB_FOLDER}/*error.txt
+	slurm-tools logs ${JOB_FOLDER} --stream error --tail 0
 fi
 
 if [ "$READ_SBATCH" = true ]; then
-	cat ${JOB_FOLDER}/sbatch_file.txt 
+	find ${JOB_FOLDER} -name sbatch.txt -exec cat {} +
 fi
@@ -0,0 +1,320 @@
+"""SQLite registry of submitted jobs."""
+
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+import time
+
+from slurm_tools import monitor
+
+_REGISTRY_FILE_NAME="registry.sqlite"
+_SUBMITTED="SUBMITTED"
+# States after which a job will not change again.
+FINAL_STATES=(
+    "COMPLETED",
+    "FAILED",
+    "TIMEOUT",
+    "NODE_FAIL",
+    "OUT_OF_MEMORY",
+    "PREEMPTED",
+    "CANCELLED",
+    "BOOT_FAIL",
+    "DEADLINE",
+)
+# States of jobs that should be resubmitted by default.
+FAILED_STATES=("FAILED", "TIMEOUT", "NODE_FAIL", "OUT_OF_MEMORY", "PREEMPTED")
+_SACCT_CHUNK_SIZE=500
+# Columns added to `jobs` after its first version, added to older registries when opened.
+_ADDED_COLUMNS=(
+    ("attempt", "INTEGER NOT NULL DEFAULT 1"),
+    ("finished_at", "REAL"),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    sweep_directory TEXT NOT NULL,
+    job_name TEXT,
+    job_id TEXT,
+    array_index INTEGER,
+    row_index INTEGER,
+    experiment_id TEXT,
+    param_hash TEXT NOT NULL,
+    cache_key TEXT,
+    script TEXT,
+    env_name TEXT,
+    script_args TEXT,
+    slurm_args TEXT,
+    job_directory TEXT,
+    state TEXT NOT NULL,
+    resubmitted INTEGER NOT NULL DEFAULT 0,
+    submitted_at REAL,
+    attempt INTEGER NOT NULL DEFAULT 1,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_sweep_state ON jobs(sweep_directory, state);
+CREATE INDEX IF NOT EXISTS jobs_job_id ON jobs(job_id, array_index);
+CREATE INDEX IF NOT EXISTS jobs_param_hash ON jobs(param_hash);
+CREATE INDEX IF NOT EXISTS jobs_cache_key ON jobs(cache_key);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state);
+CREATE TABLE IF NOT EXISTS usage (
+    slurm_id TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    array_index INTEGER,
+    state TEXT,
+    elapsed REAL,
+    total_cpu REAL,
+    max_rss INTEGER,
+    alloc_cpus INTEGER
+);
+CREATE INDEX IF NOT EXISTS usage_job_id ON usage(job_id, array_index);
+"""
+
+
+def default_registry_file(job_output_directory: Path):
+    """Returns the registry file kept next to the sweeps in `job_output_directory`."""
+    return Path(job_output_directory).joinpath(_REGISTRY_FILE_NAME)
+
+
+def _canonical_json(d):
+    """Serializes `d` with sorted keys so equal dicts have equal strings."""
+    return json.dumps(d, sort_keys=True, default=str)
+
+
+def param_hash(script, script_args: dict, slurm_args: dict, env_name: str):
+    """Hashes everything that determines the result of a job."""
+    h = hashlib.sha256()
+    for part in (str(script), _canonical_json(script_args), _canonical_json(slurm_args), str(env_name)):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def array_state(task_states):
+    """Returns the state of a job array from the states of its tasks.
+
+    The array is unfinished while any task is (`RUNNING` if one runs), `COMPLETED` if all
+    tasks completed and otherwise takes the first state of a task that did not complete.
+    """
+    unfinished = [s for s in task_states if s not in FINAL_STATES]
+    if unfinished:
+        return "RUNNING" if "RUNNING" in unfinished else unfinished[0]
+    return next((s for s in task_states if s != "COMPLETED"), "COMPLETED")
+
+
+def slurm_id(job_id, array_index=None):
+    """Returns the id used by slurm for a job or array task."""
+    if array_index is None:
+        return str(job_id)
+    return f"{job_id}_{array_index}"
+
+
+class JobRegistry(object):
+    """Records every submission in a SQLite database.
+
+    Each row of a sweep is an entry with its slurm job id, array index, parameter hash,
+    job directory and state.
+    """
+
+    def __init__(self, registry_file: Path):
+        self.registry_file=Path(registry_file)
+        self.registry_file.parent.mkdir(parents=True, exist_ok=True)
+        self.connection=sqlite3.connect(str(self.registry_file))
+        self.connection.row_factory=sqlite3.Row
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+            columns = {r["name"] for r in self.connection.execute("PRAGMA table_info(jobs)")}
+            for name, definition in _ADDED_COLUMNS:
+                if name not in columns:
+                    self.connection.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+
+    def close(self):
+        self.connection.close()
+
+    def record_submission(
+        self,
+        sweep_directory: Path,
+        job_name: str,
+        script,
+        env_name: str,
+        slurm_args: dict,
+        rows,
+    ):
+        """Records the rows of a submission.
+
+        args:
+            rows: iterable of `dict` with keys `job_id`, `array_index`, `row_index`,
+                `experiment_id`, `script_args` and `job_directory`. Optionally, `cache_key`
+                (see `cache.CacheKey`), `state`, `attempt` (default 1) and `slurm_args` if
+                they differ from `slurm_args` of the submission.
+        """
+        submitted_at = time.time()
+        slurm_args_json = _canonical_json(slurm_args)
+        entries = (
+            (
+                str(sweep_directory),
+                job_name,
+                row["job_id"],
+                row["array_index"],
+                row["row_index"],
+                row["experiment_id"],
+                param_hash(script, row["script_args"], row.get("slurm_args", slurm_args), env_name),
+                row.get("cache_key"),
+                str(script),
+                env_name,
+                # Keep column order so resubmitted rows have the same CLI arguments.
+                json.dumps(row["script_args"], default=str),
+                _canonical_json(row["slurm_args"]) if "slurm_args" in row else slurm_args_json,
+                str(row["job_directory"]),
+                row.get("state") or (_SUBMITTED if row["job_id"] is not None else "NOT_SUBMITTED"),
+                submitted_at,
+                row.get("attempt", 1),
+            )
+            for row in rows
+        )
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO jobs (sweep_directory, job_name, job_id, array_index, row_index, "
+                "experiment_id, param_hash, cache_key, script, env_name, script_args, slurm_args, "
+                "job_directory, state, submitted_at, attempt) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                entries,
+            )
+
+    def query(self, sweep_directory=None, states=None, job_id=None, param_hash=None):
+        """Returns entries matching all of the given filters."""
+        clauses, values = [], []
+        if sweep_directory is not None:
+            clauses.append("sweep_directory = ?")
+            values.append(str(sweep_directory))
+        if states is not None:
+            clauses.append(f"state IN ({', '.join('?' * len(states))})")
+            values.extend(states)
+        if job_id is not None:
+            clauses.append("job_id = ?")
+            values.append(str(job_id))
+        if param_hash is not None:
+            clauses.append("param_hash = ?")
+            values.append(param_hash)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self.connection.execute(f"SELECT * FROM jobs{where} ORDER BY id", values).fetchall()
+
+    def failed(self, sweep_directory=None, states=FAILED_STATES):
+        """Returns failed entries that have not been resubmitted."""
+        return [e for e in self.query(sweep_directory, states) if not e["resubmitted"]]
+
+    def mark_resubmitted(self, entries):
+        """Flags `entries` so they are not resubmitted again."""
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE jobs SET resubmitted = 1 WHERE id = ?", [(e["id"],) for e in entries])
+
+    def update_states(self, states: dict):
+        """Sets the state of entries from a `dict` of slurm id (`slurm_id`) to state.
+
+        Entries reaching a final state also record when, in `finished_at`. Entries of a job
+        array without an array index, e.g. rows shared by the tasks of a worker pool, take
+        the state of the whole array (see `array_state`).
+        """
+        now = time.time()
+        task_states = {}
+        for key, state in states.items():
+            job_id, _, array_index = key.partition("_")
+            if array_index:
+                task_states.setdefault(job_id, []).append(state)
+        states = {**states, **{job_id: array_state(s) for job_id, s in task_states.items()}}
+        with self.connection:
+            for key, state in states.items():
+                job_id, _, array_index = key.partition("_")
+                finished_at = now if state in FINAL_STATES else None
+                if array_index:
+                    self.connection.execute(
+                        "UPDATE jobs SET state = ?, finished_at = COALESCE(finished_at, ?) "
+                        "WHERE job_id = ? AND array_index = ?",
+                        (state, finished_at, job_id, int(array_index)))
+                else:
+                    self.connection.execute(
+                        "UPDATE jobs SET state = ?, finished_at = COALESCE(finished_at, ?) "
+                        "WHERE job_id = ? AND array_index IS NULL",
+                        (state, finished_at, job_id))
+
+    def unfinished_job_ids(self, sweep_directory=None):
+        """Returns slurm job ids of entries that have not reached a final state."""
+        clauses = [f"state NOT IN ({', '.join('?' * len(FINAL_STATES))})", "job_id IS NOT NULL"]
+        values = list(FINAL_STATES)
+        if sweep_directory is not None:
+            clauses.append("sweep_directory = ?")
+            values.append(str(sweep_directory))
+        rows = self.connection.execute(
+            f"SELECT DISTINCT job_id FROM jobs WHERE {' AND '.join(clauses)}", values)
+        return [r["job_id"] for r in rows]
+
+    def record_usage(self, usage: dict):
+        """Records resource usage from a `dict` of slurm id to usage, see `rightsize.parse_sacct_usage`."""
+        entries = []
+        for key, u in usage.items():
+            job_id, _, array_index = key.partition("_")
+            if not array_index.isdigit():
+                # Pending array ranges, e.g. `123_[4-9]`, have no usage yet.
+                if array_index:
+                    continue
+                array_index = None
+            entries.append((
+                key, job_id, None if array_index is None else int(array_index), u["state"],
+                u["elapsed"], u["total_cpu"], u["max_rss"], u["alloc_cpus"]))
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entries)
+
+    def job_ids_without_usage(self):
+        """Returns slurm job ids of finished entries without recorded usage."""
+        rows = self.connection.execute(
+            "SELECT DISTINCT jobs.job_id FROM jobs LEFT JOIN usage "
+            "ON usage.job_id = jobs.job_id AND usage.array_index IS jobs.array_index "
+            "WHERE jobs.job_id IS NOT NULL AND usage.slurm_id IS NULL "
+            f"AND jobs.state IN ({', '.join('?' * len(FINAL_STATES))})",
+            FINAL_STATES)
+        return [r["job_id"] for r in rows]
+
+    def usage(self, script=None, job_name=None, script_args: dict=None):
+        """Returns recorded usage of jobs (or array tasks) matching all of the given filters.
+
+        args:
+            job_name: Optionally, only jobs of this name or of its groups of job arrays
+                (`{job_name}_{GROUP}`, see `launch_conda_job_arrays`).
+            script_args: Optionally, only jobs with rows whose script args include these.
+
+        returns:
+            `List` of `dict` with the usage of each job, see `rightsize.parse_sacct_usage`.
+        """
+        clauses, values = [], []
+        if script is not None:
+            clauses.append("jobs.script = ?")
+            values.append(str(script))
+        if job_name is not None:
+            clauses.append("(jobs.job_name = ? OR jobs.job_name GLOB ?)")
+            values.extend([job_name, f"{job_name}_[0-9]*"])
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.connection.execute(
+            "SELECT usage.*, jobs.script_args FROM usage JOIN jobs "
+            f"ON usage.job_id = jobs.job_id AND usage.array_index IS jobs.array_index{where}",
+            values)
+        usage = {}
+        for r in rows:
+            if script_args is not None:
+                row_args = json.loads(r["script_args"])
+                if any(str(row_args.get(k)) != str(v) for k, v in script_args.items()):
+                    continue
+            # Packed array tasks run several rows but are counted once.
+            usage[r["slurm_id"]] = {
+                k: r[k] for k in ("state", "elapsed", "total_cpu", "max_rss", "alloc_cpus")}
+        return list(usage.values())
+
+    def refresh(self, sweep_directory=None, sacct_command="sacct"):
+        """Updates unfinished entries with their state from `sacct`."""
+        job_ids = self.unfinished_job_ids(sweep_directory)
+        for i in range(0, len(job_ids), _SACCT_CHUNK_SIZE):
+            self.update_states(
+                monitor.read_sacct_states(job_ids[i:i + _SACCT_CHUNK_SIZE], sacct_command))
+        return len(job_ids)
@@ -0,0 +1,462 @@
+"""Structured results of the jobs in a sweep, collected into a single columnar store.
+
+Jobs write a `dict` of results as JSON to the file in `$SLURM_TOOLS_RESULT_FILE`
+(`result.json`, `{ARRAY_INDEX}_result.json` or `row_{ROW}_result.json` in the job directory),
+e.g. with `write_result`, or by returning it from the function run by `--workers`.
+
+`collect` joins each result with its row of `--script_args` and appends the results that are
+new since the last collection to a store directory as chunks of Arrow IPC (with `pyarrow`),
+`.npz` (with `numpy`) or JSONL. `manifest.json` in the store lists its chunks and the result
+files already ingested, so collecting while a sweep runs only reads new or rewritten results.
+"""
+
+from concurrent import futures
+import csv
+import json
+import math
+import os
+from pathlib import Path
+import re
+
+from slurm_tools import csv_util
+from slurm_tools import launch_job
+from slurm_tools import sbatch_command as scommand
+from slurm_tools import sweep_spec
+
+RESULT_FILE_NAME=scommand.RESULT_FILE_NAME
+# Environment variable holding the result file of a running job.
+RESULT_FILE_VARIABLE=scommand.RESULT_FILE_VARIABLE
+ARROW="arrow"
+NPZ="npz"
+JSONL="jsonl"
+FORMATS=(ARROW, NPZ, JSONL)
+_SUFFIXES={ARROW: ".arrow", NPZ: ".npz", JSONL: ".jsonl"}
+_RESULT_FILE_PATTERN = re.compile(r"(?:(?P<prefix>.+)_)?" + re.escape(RESULT_FILE_NAME))
+# Jobs of one job per row are named `{JOB_NAME}_id_{EXPERIMENT_ID}` in their sbatch file.
+_EXPERIMENT_ID_SEPARATOR="_id_"
+_SBATCH_FILE_NAME="sbatch.txt"
+_JOB_NAME_PATTERN = re.compile(r"^#SBATCH --job-name=(.*)$", re.MULTILINE)
+_ROW_PREFIX="row_"
+_ROW_INDEX_FILE_NAME="row_index.csv"
+# Intermediate metrics of a job, see `report`.
+METRICS_FILE_NAME="metrics.jsonl"
+STEP="step"
+_STORE_DIRECTORY_NAME="results"
+_MANIFEST_FILE_NAME="manifest.json"
+# Columns identifying a result, results with the same name are stored as `result_{NAME}`.
+JOB="job"
+EXPERIMENT_ID="experiment_id"
+DEFAULT_CHUNK_ROWS=100000
+
+
+def write_result(result: dict):
+    """Writes `result` to the result file of the running job.
+
+    The file is replaced at once, so `collect` never reads part of it. Outside of a job
+    (`$SLURM_TOOLS_RESULT_FILE` unset), nothing is written.
+
+    returns:
+        Path of the result file, `None` outside of a job.
+    """
+    result_file = os.environ.get(RESULT_FILE_VARIABLE)
+    if not result_file:
+        return None
+    partial_file = Path(f"{result_file}.{os.getpid()}.tmp")
+    with partial_file.open("w") as f:
+        json.dump(result, f)
+    os.replace(partial_file, result_file)
+    return Path(result_file)
+
+
+def metrics_file(result_file: Path):
+    """Returns the metrics file next to `result_file`, with the same prefix."""
+    result_file = Path(result_file)
+    return result_file.with_name(result_file.name[:-len(RESULT_FILE_NAME)] + METRICS_FILE_NAME)
+
+
+def report(step, **metrics):
+    """Appends intermediate `metrics` at `step` (e.g. the epoch) to the metrics file of the running job.
+
+    e.g. `report(epoch, loss=validation_loss)`. The metrics file (see `metrics_file`) is read by
+    `halving.HalvingSweep` to cancel losing rows early. Outside of a job, nothing is written.
+
+    returns:
+        Path of the metrics file, `None` outside of a job.
+    """
+    result_file = os.environ.get(RESULT_FILE_VARIABLE)
+    if not result_file:
+        return None
+    path = metrics_file(result_file)
+    # A single short write, so lines of concurrent readers are complete or absent.
+    with path.open("a") as f:
+        f.write(json.dumps({STEP: step, **metrics}) + "\n")
+    return path
+
+
+def read_reports(path: Path, offset: int=0):
+    """Reads the metrics reported since `offset` of the metrics file at `path`.
+
+    returns:
+        `(reports, offset)`, the `dict`s of the complete lines after `offset` and the offset
+        to read from next.
+    """
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    end = data.rfind(b"\n") + 1
+    reports = []
+    for line in data[:end].splitlines():
+        try:
+            reports.append(json.loads(line))
+        except ValueError:
+            continue
+    return reports, offset + end
+
+
+def flatten(result: dict, prefix: str=""):
+    """Flattens nested `dict`s of `result`, e.g. `{"loss": {"val": 1}}` to `{"loss.val": 1}`."""
+    flat = {}
+    for k, v in result.items():
+        if isinstance(v, dict):
+            flat.update(flatten(v, f"{prefix}{k}."))
+        else:
+            flat[f"{prefix}{k}"] = v
+    return flat
+
+
+def default_format():
+    """Returns the most compact format that can be written: Arrow IPC, `.npz` or JSONL."""
+    try:
+        import pyarrow  # noqa: F401
+        return ARROW
+    except ImportError:
+        pass
+    try:
+        import numpy  # noqa: F401
+        return NPZ
+    except ImportError:
+        return JSONL
+
+
+def default_store_directory(sweep_directory: Path):
+    """Returns the store kept in `sweep_directory`."""
+    return Path(sweep_directory).joinpath(_STORE_DIRECTORY_NAME)
+
+
+def iter_result_directories(sweep_directory: Path, skip=(), file_names=(RESULT_FILE_NAME,)):
+    """Yields `(directory, job, result_files)` for directories of `sweep_directory` with results.
+
+    `job` is the directory relative to `sweep_directory` without the shard directories of a
+    sharded layout, as in `logs.iter_log_files`, and `result_files` is a list of
+    `(prefix, path, (mtime_ns, size))`, with prefix `None` for `result.json`.
+    Directories in `skip` (e.g. the store) are not visited. Other files written per row,
+    e.g. profiles, are found by passing their `file_names` instead.
+    """
+    sweep_directory = Path(sweep_directory)
+    pattern = _RESULT_FILE_PATTERN
+    if file_names != (RESULT_FILE_NAME,):
+        pattern = re.compile(r"(?:(?P<prefix>.+)_)?(?:" + "|".join(re.escape(n) for n in file_names) + ")")
+    shard_levels = launch_job.read_layout(sweep_directory)["shard_levels"]
+    skip = {Path(d).absolute() for d in skip}
+    stack = [sweep_directory]
+    while stack:
+        directory = stack.pop()
+        if directory.absolute() in skip:
+            continue
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        subdirectories = []
+        result_files = []
+        for entry in entries:
+            # Links to cached runs are not results of this sweep.
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(Path(entry.path))
+                continue
+            match = pattern.fullmatch(entry.name)
+            if match is None or not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            result_files.append((match["prefix"], entry.path, (stat.st_mtime_ns, stat.st_size)))
+        if result_files:
+            job = str(Path(*directory.relative_to(sweep_directory).parts[shard_levels:]))
+            yield directory, job, result_files
+        # Visit subdirectories in sorted order.
+        stack.extend(reversed(subdirectories))
+
+
+def experiment_ids(directory: Path, prefixes):
+    """Returns `dict` of prefix to `experiment_id` of the files with `prefixes` in `directory`.
+
+    See `iter_result_directories`, `experiment_id` is `None` if it is not known.
+    """
+    row_index = None
+    if any(prefix is not None for prefix in prefixes):
+        row_index = _read_row_index(directory)
+    return {prefix: _experiment_id(directory, prefix, row_index) for prefix in set(prefixes)}
+
+
+def _read_row_index(directory: Path):
+    """Returns `dict` of row index to `experiment_id` of a job array, `None` if not recorded."""
+    try:
+        with Path(directory).joinpath(_ROW_INDEX_FILE_NAME).open(newline="") as f:
+            return {row["row_index"]: row["experiment_id"] for row in csv.DictReader(f)}
+    except FileNotFoundError:
+        return None
+
+
+def _experiment_id(directory: Path, prefix: str, row_index):
+    """Returns the `experiment_id` of the result with `prefix` in `directory`.
+
+    Rows of job arrays are found from the array index (or `row_{ROW}`) in `row_index.csv`;
+    rows of sweep specs have their row index as `experiment_id`.
+    """
+    if prefix is None:
+        try:
+            match = _JOB_NAME_PATTERN.search(Path(directory).joinpath(_SBATCH_FILE_NAME).read_text())
+        except FileNotFoundError:
+            return None
+        if match is None or _EXPERIMENT_ID_SEPARATOR not in match[1]:
+            return None
+        return match[1].rpartition(_EXPERIMENT_ID_SEPARATOR)[2]
+    row = prefix[len(_ROW_PREFIX):] if prefix.startswith(_ROW_PREFIX) else prefix
+    if row_index is None:
+        return row
+    return row_index.get(row)
+
+
+def read_directory(directory_results):
+    """Reads the results of one directory, see `iter_result_directories`.
+
+    Runs in the processes of `collect`, so only takes and returns picklable values.
+
+    returns:
+        `List` of `(path, job, experiment_id, result)`, with `result` `None` if the file
+        is not valid JSON.
+    """
+    directory, job, result_files = directory_results
+    ids = experiment_ids(directory, [prefix for prefix, _, _ in result_files])
+    read = []
+    for prefix, path, _ in result_files:
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (FileNotFoundError, ValueError):
+            result = None
+        if result is not None and not isinstance(result, dict):
+            result = {"result": result}
+        job_name = job if prefix is None else f"{job}[{prefix}]"
+        read.append((path, job_name, ids[prefix], result))
+    return read
+
+
+def _iter_script_args(script_args):
+    """Yields the rows of a csv file or a sweep spec file (see `sweep_spec`)."""
+    if sweep_spec.is_spec_file(script_args):
+        yield from sweep_spec.load_spec(script_args)
+    else:
+        yield from csv_util.iter_csv(script_args)
+
+
+def _record(job, experiment_id, params, result):
+    """Joins `result` with the parameters of its row, see `collect`."""
+    record = {JOB: job, EXPERIMENT_ID: experiment_id}
+    record.update((k, v) for k, v in params.items() if k != EXPERIMENT_ID)
+    for k, v in flatten(result).items():
+        record[f"result_{k}" if k in record else k] = v
+    return record
+
+
+def _column(values):
+    """Converts values to one type so they can be stored as a column.
+
+    Numbers stay `bool` or `int` if all are, and are otherwise `float` with `nan` for
+    missing values. Other columns are strings, `""` if missing, with lists as JSON.
+    """
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, (bool, int, float)) for v in present):
+        if len(present) == len(values):
+            for kind in (bool, int):
+                if all(type(v) is kind for v in values):
+                    return values
+        return [math.nan if v is None else float(v) for v in values]
+    return ["" if v is None else v if isinstance(v, str) else json.dumps(v) for v in values]
+
+
+def _columns(records):
+    """Returns `dict` of column to values of `records`, in order of first appearance."""
+    names = {}
+    for record in records:
+        names.update(dict.fromkeys(record))
+    return {name: _column([r.get(name) for r in records]) for name in names}
+
+
+def _write_chunk(path: Path, records, store_format: str):
+    """Writes `records` to the chunk at `path`, replacing it at once."""
+    partial_file = path.with_name(f"{path.name}.tmp")
+    if store_format == JSONL:
+        with partial_file.open("w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+    elif store_format == NPZ:
+        import numpy
+        with partial_file.open("wb") as f:
+            numpy.savez_compressed(f, **{k: numpy.asarray(v) for k, v in _columns(records).items()})
+    else:
+        import pyarrow
+        table = pyarrow.table(_columns(records))
+        with pyarrow.OSFile(str(partial_file), "wb") as sink:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    os.replace(partial_file, path)
+
+
+def _read_chunk(path: Path, store_format: str):
+    """Returns the records of the chunk at `path`."""
+    if store_format == JSONL:
+        with path.open() as f:
+            return [json.loads(line) for line in f if line.strip()]
+    if store_format == NPZ:
+        import numpy
+        with numpy.load(path) as data:
+            columns = {k: data[k].tolist() for k in data.files}
+    else:
+        import pyarrow
+        with pyarrow.memory_map(str(path)) as source:
+            columns = pyarrow.ipc.open_file(source).read_all().to_pydict()
+    count = len(next(iter(columns.values()), []))
+    return [{k: v[i] for k, v in columns.items()} for i in range(count)]
+
+
+def read_manifest(store_directory: Path):
+    """Returns the manifest of a store, `None` if nothing has been collected into it."""
+    try:
+        with Path(store_directory).joinpath(_MANIFEST_FILE_NAME).open() as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(store_directory: Path, manifest):
+    """Replaces the manifest of a store at once, after the chunks it lists are written."""
+    manifest_file = Path(store_directory).joinpath(_MANIFEST_FILE_NAME)
+    partial_file = manifest_file.with_name(f"{manifest_file.name}.tmp")
+    with partial_file.open("w") as f:
+        json.dump(manifest, f)
+    os.replace(partial_file, manifest_file)
+
+
+def collect(
+    sweep_directory: Path,
+    script_args=None,
+    store_directory: Path=None,
+    store_format: str=None,
+    workers: int=None,
+    chunk_rows: int=DEFAULT_CHUNK_ROWS,
+):
+    """Appends the results of a sweep that are new since the last collection to a store.
+
+    Each result becomes a row with columns `job` (see `iter_result_directories`),
+    `experiment_id`, the parameters of its row of `script_args` and the keys of the result,
+    with nested `dict`s flattened (see `flatten`). Result keys that are also parameters are
+    stored as `result_{KEY}`. Results are read by a pool of `workers` processes, one
+    directory at a time, and written in chunks of at most `chunk_rows` rows, each recorded in
+    the manifest as soon as it is written. Results that are not valid JSON (e.g. written
+    without `write_result`) are left for the next collection.
+
+    args:
+        script_args: Csv file or sweep spec of the sweep, optional.
+        store_directory: Store to append to, by default `results` in `sweep_directory`.
+        store_format: One of `FORMATS`, by default `default_format()`. A store keeps the
+            format it was created with.
+        workers: Number of processes reading results, `1` to read them in this process.
+
+    returns:
+        `(collected, invalid)`: numbers of results added and of results that could not be read.
+    """
+    store_directory = Path(store_directory or default_store_directory(sweep_directory))
+    manifest = read_manifest(store_directory)
+    if manifest is None:
+        manifest = {"format": store_format or default_format(), "chunks": [], "files": {}}
+    elif store_format is not None and store_format != manifest["format"]:
+        raise ValueError(
+            f"Store {store_directory} is in format `{manifest['format']}`, not `{store_format}`.")
+    store_format = manifest["format"]
+    if store_format not in FORMATS:
+        raise ValueError(f"Unknown format `{store_format}`, use one of {FORMATS}.")
+
+    # Result files are recorded relative to the sweep, with their modification time and size.
+    pending = []
+    stamps = {}
+    for directory, job, result_files in iter_result_directories(sweep_directory, skip=[store_directory]):
+        new_files = []
+        for prefix, path, stamp in result_files:
+            key = os.path.relpath(path, sweep_directory)
+            if manifest["files"].get(key) != list(stamp):
+                new_files.append((prefix, path, stamp))
+                stamps[path] = (key, list(stamp))
+        if new_files:
+            pending.append((str(directory), job, new_files))
+    if not pending:
+        return 0, 0
+
+    params = {}
+    if script_args is not None:
+        params = {str(row[EXPERIMENT_ID]): row for row in _iter_script_args(script_args)}
+
+    store_directory.mkdir(parents=True, exist_ok=True)
+    collected, invalid = 0, 0
+    records, paths = [], []
+
+    def _flush():
+        path = store_directory.joinpath(f"chunk_{len(manifest['chunks']):06d}{_SUFFIXES[store_format]}")
+        _write_chunk(path, records, store_format)
+        manifest["chunks"].append(path.name)
+        manifest["files"].update(stamps[p] for p in paths)
+        _write_manifest(store_directory, manifest)
+        records.clear()
+        paths.clear()
+
+    executor = None if workers == 1 else futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        read = map(read_directory, pending) if executor is None else executor.map(read_directory, pending)
+        for directory_read in read:
+            for path, job, experiment_id, result in directory_read:
+                if result is None:
+                    invalid += 1
+                    continue
+                records.append(_record(job, experiment_id, params.get(experiment_id, {}), result))
+                paths.append(path)
+                collected += 1
+                if len(records) >= chunk_rows:
+                    _flush()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if records:
+        _flush()
+    return collected, invalid
+
+
+def load_results(store_directory: Path):
+    """Returns `dict` of column to values of all results in a store.
+
+    Results of a job collected more than once (e.g. rewritten after a requeue) appear once,
+    with their latest values. Values missing from a chunk are `None`.
+    """
+    manifest = read_manifest(store_directory)
+    if manifest is None:
+        return {}
+    latest = {}
+    for chunk in manifest["chunks"]:
+        for record in _read_chunk(Path(store_directory).joinpath(chunk), manifest["format"]):
+            latest.pop(record[JOB], None)
+            latest[record[JOB]] = record
+    names = {}
+    for record in latest.values():
+        names.update(dict.fromkeys(record))
+    return {name: [r.get(name) for r in latest.values()] for name in names}
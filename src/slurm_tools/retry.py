@@ -0,0 +1,44 @@
+"""Client-side retry policy for failed rows recorded in a `registry.JobRegistry`.
+
+Jobs that requeue themselves (`requeue_signal_time` in slurm args) recover from time limits
+within slurm; rows that still fail (e.g. `NODE_FAIL`, or after `max_requeues`) are retried by
+`launch_python_jobs_array.resubmit_failed` according to a `RetryPolicy`.
+"""
+
+import time
+
+DEFAULT_BACKOFF_FACTOR=2
+
+
+class RetryPolicy(object):
+    """Retries a row at most `max_attempts` times in total, waiting between attempts.
+
+    The wait after attempt `n` fails is `backoff * backoff_factor ** (n - 1)` seconds from
+    when the failure was recorded, so rows failing on a bad node or during an outage are
+    not resubmitted straight away.
+
+    args:
+        max_attempts: Maximum number of attempts of a row, including the first. `None` for
+            no limit.
+        backoff: Seconds to wait after the first failed attempt.
+        backoff_factor: Factor by which the wait grows after each attempt.
+    """
+
+    def __init__(self, max_attempts: int=None, backoff: float=0, backoff_factor: float=DEFAULT_BACKOFF_FACTOR):
+        self.max_attempts=max_attempts
+        self.backoff=backoff
+        self.backoff_factor=backoff_factor
+
+    def exhausted(self, entry):
+        """Returns `True` if the row of registry `entry` has used all of its attempts."""
+        return self.max_attempts is not None and entry["attempt"] >= self.max_attempts
+
+    def retry_at(self, entry):
+        """Returns the time at which the row of failed registry `entry` may be retried."""
+        failed_at = entry["finished_at"] or entry["submitted_at"] or 0
+        return failed_at + self.backoff * self.backoff_factor ** (entry["attempt"] - 1)
+
+    def due(self, entry, now: float=None):
+        """Returns `True` if the row of failed registry `entry` should be retried at `now`."""
+        now = time.time() if now is None else now
+        return not self.exhausted(entry) and self.retry_at(entry) <= now
@@ -0,0 +1,184 @@
+"""Recommends `time` and `mem_per_cpu` requests from the usage of past jobs in `sacct`."""
+
+import math
+
+from slurm_tools import monitor
+
+_SACCT_COMMAND="sacct"
+# Fields of `sacct --parsable2` read by `parse_sacct_usage`, in this order if there is no header.
+SACCT_USAGE_FIELDS=("JobID", "State", "Elapsed", "TotalCPU", "MaxRSS", "AllocCPUS")
+_SACCT_CHUNK_SIZE=500
+_MEMORY_UNITS={"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+_SECONDS_PER_DAY=24 * 60 * 60
+DEFAULT_SAFETY_MARGIN=0.2
+
+
+def parse_duration(text: str):
+    """Parses `[D-][HH:]MM:SS[.mmm]` of `sacct` to seconds, `None` if blank or unlimited."""
+    text = text.strip()
+    if not text or not text[0].isdigit():
+        return None
+    days, _, clock = text.rpartition("-")
+    seconds = 0.0
+    for part in clock.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds + (int(days) * _SECONDS_PER_DAY if days else 0)
+
+
+def parse_time_request(text: str):
+    """Parses a slurm `--time` (e.g. `90`, `1:30:00`, `2-12`) to seconds, `None` if unlimited."""
+    text = text.strip()
+    if not text or not text[0].isdigit():
+        return None
+    days, has_days, clock = text.partition("-")
+    if not has_days:
+        days, clock = "0", days
+    parts = [float(p) for p in clock.split(":")]
+    if has_days:
+        # days-hours[:minutes[:seconds]]
+        hours, minutes, seconds = (parts + [0, 0])[:3]
+    elif len(parts) == 3:
+        hours, minutes, seconds = parts
+    else:
+        # minutes[:seconds]
+        hours, (minutes, seconds) = 0, (parts + [0])[:2]
+    return int(days) * _SECONDS_PER_DAY + hours * 3600 + minutes * 60 + seconds
+
+
+def parse_memory(text: str, default_unit: int=1):
+    """Parses memory of `sacct` (e.g. `1234K`, `2G`, `4Gc`) to bytes, `None` if blank.
+
+    Numbers without a unit are multiplied by `default_unit`, e.g. megabytes for requests.
+    """
+    text = text.strip().rstrip("cn")
+    if not text:
+        return None
+    unit = _MEMORY_UNITS.get(text[-1].upper())
+    if unit is None:
+        return int(float(text) * default_unit)
+    return int(float(text[:-1]) * unit)
+
+
+def format_time(seconds: float):
+    """Formats seconds as `D-HH:MM:SS` (or `HH:MM:SS`), rounded up to whole minutes."""
+    minutes = max(1, math.ceil(seconds / 60))
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    clock = f"{hours:02d}:{minutes:02d}:00"
+    return f"{days}-{clock}" if days else clock
+
+
+def format_memory(size: float):
+    """Formats bytes as megabytes for `--mem-per-cpu`, rounded up."""
+    return f"{max(1, math.ceil(size / _MEMORY_UNITS['M']))}M"
+
+
+def parse_sacct_usage(sacct_output: str):
+    """Parses `sacct --parsable2` output with (at least) `SACCT_USAGE_FIELDS`.
+
+    The header line gives the fields, if present. Steps (e.g. `123_4.batch`) are merged
+    into their job or array task, keeping the largest `MaxRSS`.
+
+    returns:
+        `dict` of slurm id to `dict` with `state`, `elapsed` and `total_cpu` (seconds),
+        `max_rss` (bytes) and `alloc_cpus`.
+    """
+    fields = SACCT_USAGE_FIELDS
+    usage = {}
+    for line in sacct_output.splitlines():
+        if not line.strip():
+            continue
+        values = line.split("|")
+        if values[0] == "JobID":
+            fields = values
+            continue
+        entry = dict(zip(fields, values))
+        key, _, step = entry["JobID"].partition(".")
+        job = usage.setdefault(
+            key, {"state": None, "elapsed": None, "total_cpu": None, "max_rss": None, "alloc_cpus": None})
+        max_rss = parse_memory(entry.get("MaxRSS", ""))
+        if max_rss is not None:
+            job["max_rss"] = max(max_rss, job["max_rss"] or 0)
+        if step:
+            continue
+        # e.g. "CANCELLED by 1234".
+        job["state"] = entry["State"].split(" ")[0]
+        job["elapsed"] = parse_duration(entry.get("Elapsed", ""))
+        job["total_cpu"] = parse_duration(entry.get("TotalCPU", ""))
+        alloc_cpus = entry.get("AllocCPUS", "").strip()
+        job["alloc_cpus"] = int(alloc_cpus) if alloc_cpus else None
+    return usage
+
+
+def read_sacct_usage(job_ids, sacct_command=_SACCT_COMMAND, runner=monitor.run_command):
+    """Returns usage (see `parse_sacct_usage`) of `job_ids` with a single `sacct` call."""
+    return parse_sacct_usage(runner(
+        [sacct_command, "--parsable2", f"--format={','.join(SACCT_USAGE_FIELDS)}",
+         f"--jobs={','.join(job_ids)}"]))
+
+
+def refresh_usage(registry, sacct_command=_SACCT_COMMAND, runner=monitor.run_command):
+    """Records usage of finished jobs in `registry` that have none yet.
+
+    returns:
+        count: number of jobs queried.
+    """
+    job_ids = registry.job_ids_without_usage()
+    for i in range(0, len(job_ids), _SACCT_CHUNK_SIZE):
+        registry.record_usage(read_sacct_usage(job_ids[i:i + _SACCT_CHUNK_SIZE], sacct_command, runner))
+    return len(job_ids)
+
+
+def _quantile(values, quantile: float):
+    """Returns the `quantile` of `values` (the maximum for `1`), without interpolation."""
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(quantile * len(values)) - 1)] if values else None
+
+
+def recommend(usage, safety_margin: float=DEFAULT_SAFETY_MARGIN, quantile: float=1.0):
+    """Recommends `time` and `mem_per_cpu` from the usage of past jobs.
+
+    Requests are the `quantile` of elapsed time and of `MaxRSS` per allocated cpu over
+    completed jobs, increased by `safety_margin`. A resource is not recommended if any job
+    ran out of it (`TIMEOUT` or `OUT_OF_MEMORY`).
+
+    args:
+        usage: iterable of `dict` as returned by `parse_sacct_usage`.
+
+    returns:
+        `dict` with `time` and `mem_per_cpu` (`None` if not recommended) and `jobs`, the
+        number of completed jobs used.
+    """
+    usage = list(usage)
+    completed = [u for u in usage if u["state"] == "COMPLETED"]
+    states = {u["state"] for u in usage}
+    elapsed = [u["elapsed"] for u in completed if u["elapsed"] is not None]
+    mem_per_cpu = [
+        u["max_rss"] / (u["alloc_cpus"] or 1) for u in completed if u["max_rss"] is not None]
+
+    recommendation = {"time": None, "mem_per_cpu": None, "jobs": len(completed)}
+    if elapsed and "TIMEOUT" not in states:
+        recommendation["time"] = format_time(_quantile(elapsed, quantile) * (1 + safety_margin))
+    if mem_per_cpu and "OUT_OF_MEMORY" not in states:
+        recommendation["mem_per_cpu"] = format_memory(_quantile(mem_per_cpu, quantile) * (1 + safety_margin))
+    return recommendation
+
+
+def right_size(slurm_args: dict, recommendation: dict):
+    """Returns `slurm_args` with `time` and `mem_per_cpu` tightened to `recommendation`.
+
+    Requests are only lowered, never raised above what `slurm_args` already requests.
+    """
+    def _parse_memory_request(text):
+        return parse_memory(text, default_unit=_MEMORY_UNITS["M"])
+
+    slurm_args = dict(slurm_args)
+    for key, parse in (("time", parse_time_request), ("mem_per_cpu", _parse_memory_request)):
+        recommended = recommendation.get(key)
+        if recommended is None:
+            continue
+        requested = slurm_args.get(key)
+        requested_value = None if requested is None else parse(str(requested))
+        if requested_value is None or parse(recommended) < requested_value:
+            slurm_args[key] = recommended
+    return slurm_args
@@ -2,18 +2,48 @@
 
 from slurm_tools import csv_util
 
+# Marks a field of a compiled sbatch template, see `field` and `launch_job.SbatchTemplate`.
+FIELD_TOKEN="\x00"
+# Timing events of instrumented jobs, see `slurm_tools.timing`.
+TIMING_FILE_NAME="timing.tsv"
+TIMING_FILE_VARIABLE="SLURM_TOOLS_TIMING_FILE"
+# Structured results written by jobs, see `slurm_tools.results`.
+RESULT_FILE_NAME="result.json"
+RESULT_FILE_VARIABLE="SLURM_TOOLS_RESULT_FILE"
+# Python of the job, replaced by `Profiler.python` in profiled jobs.
+PYTHON="python"
+
+
+def field(name: str):
+    """Returns a placeholder for field `name` of a compiled sbatch template."""
+    return f"{FIELD_TOKEN}{name}{FIELD_TOKEN}"
+
+
 class Command(object):
-    """Base class for sbatch file commands."""
+    """Base class for sbatch file commands.
+
+    Commands are not changed after they are created, so `build_str` is cached.
+    """
+
+    __slots__ = ("_built",)
 
     description=""
+    # Event recorded after the command in instrumented jobs, see `slurm_tools.timing`.
+    phase=None
 
     def build_str(self, include_description=True):
         """Returns string representation of command."""
-        command=[]
-        if include_description:
-            command.append(self.description_str())
-        command.append(self.command_str())
-        return "\n".join(command)
+        try:
+            built = self._built
+        except AttributeError:
+            built = self._built = {}
+        if include_description not in built:
+            command=[]
+            if include_description:
+                command.append(self.description_str())
+            command.append(self.command_str())
+            built[include_description] = "\n".join(command)
+        return built[include_description]
 
     def command_str(self):
         """`command_str` returns a list of command strings."""
@@ -25,6 +55,8 @@ class Command(object):
 class Comment(Command):
     """Add comment"""
 
+    __slots__ = ("text",)
+
     def __init__(self, text):
         self.text=text
 
@@ -38,6 +70,8 @@ class Comment(Command):
 class BashCommand(Command):
     """A base class for bash commands."""
 
+    __slots__ = ("command_arg",)
+
     def command_str(self):
         return f"{self.command_call} {self.command_arg}"
 
@@ -45,6 +79,8 @@ class BashCommand(Command):
 class Echo(BashCommand):
     """Prints text."""
 
+    __slots__ = ()
+
     command_call="echo"
 
     def build_str(self, **kwargs):
@@ -57,7 +93,10 @@ class Echo(BashCommand):
 
 class loadModule(Command):
 
+    __slots__ = ("module", "description")
+
     _MODULE_LOAD = "module load"
+    phase="module_load"
 
     def __init__(self, module: str):
         self.module=module
@@ -69,23 +108,251 @@ class loadModule(Command):
 
 class activateConda(BashCommand):
 
+    __slots__ = ("command_call",)
+
+    phase="conda_hook"
+
     def __init__(self):
         self.command_call = "eval"
         self.command_arg = "\"$(conda shell.bash hook)\""
 
 
 class deactivateConda(BashCommand):
+
+    __slots__ = ()
+
     command_call = "conda"
     command_arg = "deactivate"
 
 
 class loadCondaEnv(BashCommand):
 
+    __slots__ = ("command_call",)
+
+    phase="conda_activate"
+
     def __init__(self, conda_env):
         self.command_call = "source activate"
         self.command_arg = conda_env
 
 
+class TimingFileCommand(BashCommand):
+    """Sets the file that timing events of the job are appended to, see `slurm_tools.timing`.
+
+    Array tasks share `output_directory`, so their files are prefixed by the task index.
+    The `start` event is recorded once the file is set.
+    """
+
+    __slots__ = ("output_directory",)
+
+    command_call="export"
+    description="Set file for timing events."
+    start_event="start"
+
+    def __init__(self, output_directory):
+        self.output_directory=output_directory
+        self.command_arg=(
+            f"{TIMING_FILE_VARIABLE}="
+            f"\"{self.output_directory}/${{SLURM_ARRAY_TASK_ID:+${{SLURM_ARRAY_TASK_ID}}_}}"
+            f"{TIMING_FILE_NAME}\""
+        )
+
+    def command_str(self):
+        return "\n".join([super().command_str(), TimingMarkCommand(self.start_event).command_str()])
+
+
+class ResultFileCommand(BashCommand):
+    """Sets the file that the result of the job is written to, see `slurm_tools.results`.
+
+    Array tasks share `output_directory`, so their files are prefixed by the task index.
+    """
+
+    __slots__ = ("output_directory",)
+
+    command_call="export"
+    description="Set file for the result of the job."
+
+    def __init__(self, output_directory):
+        self.output_directory=output_directory
+        self.command_arg=(
+            f"{RESULT_FILE_VARIABLE}="
+            f"\"{self.output_directory}/${{SLURM_ARRAY_TASK_ID:+${{SLURM_ARRAY_TASK_ID}}_}}"
+            f"{RESULT_FILE_NAME}\""
+        )
+
+
+class TimingMarkCommand(Command):
+    """Appends `event` and the current time to the timing file of the job."""
+
+    __slots__ = ("event",)
+
+    def __init__(self, event):
+        self.event=event
+
+    def build_str(self, **kwargs):
+        """Override `build_str` since we never want a description."""
+        return super().build_str(include_description=False)
+
+    def command_str(self):
+        return (
+            f"printf '%s\\t%s\\n' {self.event} \"$(date +%s.%N)\" "
+            f">> \"${{{TIMING_FILE_VARIABLE}}}\""
+        )
+
+
+class stageCondaPack(BashCommand):
+    """Unpacks the conda-pack archive `pack_file` to node-local storage, once per node.
+
+    The environment is unpacked to `$SLURM_TOOLS_ENV_STAGE` (default `$TMPDIR` or `/tmp`)
+    in a directory named after the archive, so jobs on a node reuse it until the archive
+    changes. Jobs starting together wait on a lock for the first one to unpack it.
+    """
+
+    __slots__ = ("pack_file", "prefix")
+
+    description="Unpack conda environment to node-local storage."
+    phase="env_stage"
+    PACK_SUFFIXES=(".tar.gz", ".tgz", ".tar")
+
+    def __init__(self, pack_file):
+        self.pack_file=pack_file
+        name = str(pack_file).rsplit("/", 1)[-1]
+        for suffix in self.PACK_SUFFIXES:
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+                break
+        self.prefix=f"${{SLURM_TOOLS_ENV_STAGE:-${{TMPDIR:-/tmp}}}}/slurm_tools_envs/{name}"
+
+    def command_str(self):
+        return "\n".join([
+            f"SLURM_TOOLS_ENV_PREFIX=\"{self.prefix}\"",
+            "mkdir -p \"$(dirname \"${SLURM_TOOLS_ENV_PREFIX}\")\"",
+            "(",
+            "    flock 9",
+            "    if [ ! -f \"${SLURM_TOOLS_ENV_PREFIX}/.unpacked\" ]; then",
+            "        rm -rf \"${SLURM_TOOLS_ENV_PREFIX}\" && mkdir -p \"${SLURM_TOOLS_ENV_PREFIX}\" \\",
+            f"            && tar -xf \"{self.pack_file}\" -C \"${{SLURM_TOOLS_ENV_PREFIX}}\" \\",
+            "            && \"${SLURM_TOOLS_ENV_PREFIX}/bin/conda-unpack\" \\",
+            "            && touch \"${SLURM_TOOLS_ENV_PREFIX}/.unpacked\"",
+            "    fi",
+            ") 9>\"${SLURM_TOOLS_ENV_PREFIX}.lock\"",
+        ])
+
+
+class activateCondaPack(BashCommand):
+    """Activates the environment unpacked by `stageCondaPack`."""
+
+    __slots__ = ()
+
+    phase="conda_activate"
+    command_call="source"
+    command_arg="\"${SLURM_TOOLS_ENV_PREFIX}/bin/activate\""
+
+
+class RequeueTrapCommand(Command):
+    """Requeues the job when it receives `signal`, sent `signal_time` seconds before its time
+    limit by `SignalCommand`.
+
+    The signal is forwarded to every process of the job, so scripts can checkpoint from a
+    handler, and the job is requeued once they exit or after `grace_time` seconds. Jobs are
+    not requeued more than `max_requeues` times. Job commands must run in the background
+    (see `BackgroundGroupStart`) for the trap to run before they finish.
+    """
+
+    __slots__ = ("signal", "grace_time", "max_requeues")
+
+    description="Requeue job on signal before the time limit."
+
+    def __init__(self, signal="USR1", grace_time=0, max_requeues=3):
+        self.signal=signal
+        self.grace_time=grace_time
+        self.max_requeues=max_requeues
+
+    def command_str(self):
+        return "\n".join([
+            "descendant_pids() {",
+            "    local child",
+            "    for child in $(pgrep -P \"$1\"); do",
+            "        echo \"${child}\"",
+            "        descendant_pids \"${child}\"",
+            "    done",
+            "}",
+            "requeue_job() {",
+            f"    echo \"Caught SIG{self.signal}, restart ${{SLURM_RESTART_COUNT:-0}} of {self.max_requeues}.\"",
+            f"    kill -{self.signal} $(descendant_pids $$) 2>/dev/null",
+            "    local waited=0",
+            f"    while [ -n \"$(jobs -rp)\" ] && [ ${{waited}} -lt {self.grace_time} ]; do",
+            "        sleep 1",
+            "        waited=$((waited + 1))",
+            "    done",
+            f"    if [ \"${{SLURM_RESTART_COUNT:-0}}\" -lt {self.max_requeues} ]; then",
+            "        scontrol requeue \"${SLURM_JOB_ID}\"",
+            "    fi",
+            "}",
+            f"trap requeue_job {self.signal}",
+        ])
+
+
+class BackgroundGroupStart(Command):
+    """Starts a group of commands that runs in the background, ended by `BackgroundGroupWait`.
+
+    The group ignores `signal`, which is left to the trap of `RequeueTrapCommand`; processes
+    that it starts can still install their own handler.
+    """
+
+    __slots__ = ("signal",)
+
+    def __init__(self, signal="USR1"):
+        self.signal=signal
+
+    def build_str(self, **kwargs):
+        """Override `build_str` since we never want a description."""
+        return super().build_str(include_description=False)
+
+    def command_str(self):
+        return "\n".join(["{", f"trap '' {self.signal}"])
+
+
+class BackgroundGroupWait(Command):
+    """Ends the group of `BackgroundGroupStart` and waits for it, also after trapped signals."""
+
+    __slots__ = ()
+
+    def build_str(self, **kwargs):
+        """Override `build_str` since we never want a description."""
+        return super().build_str(include_description=False)
+
+    def command_str(self):
+        return "\n".join([
+            "} &",
+            "JOB_COMMANDS_PID=$!",
+            "# `wait` returns early when a trapped signal arrives.",
+            "wait ${JOB_COMMANDS_PID}",
+            "JOB_COMMANDS_STATUS=$?",
+            "while kill -0 ${JOB_COMMANDS_PID} 2>/dev/null; do",
+            "    wait ${JOB_COMMANDS_PID}",
+            "    JOB_COMMANDS_STATUS=$?",
+            "done",
+        ])
+
+
+class BackgroundGroupExit(Command):
+    """Exits with the status of the group waited for by `BackgroundGroupWait`.
+
+    Placed after the commands that follow the group, so that the job still fails when the
+    group does.
+    """
+
+    __slots__ = ()
+
+    def build_str(self, **kwargs):
+        """Override `build_str` since we never want a description."""
+        return super().build_str(include_description=False)
+
+    def command_str(self):
+        return "exit ${JOB_COMMANDS_STATUS}"
+
+
 class SbatchCommand(Command):
     """A base class for building sbatch commands.
 
@@ -96,6 +363,8 @@ class SbatchCommand(Command):
     Optionally, any help description.
     """
 
+    __slots__ = ("command_arg",)
+
     _SBATCH_COMMAND="#SBATCH"
 
     def command_str(self):
@@ -103,6 +372,9 @@ class SbatchCommand(Command):
 
 
 class JobNameCommand(SbatchCommand):
+
+    __slots__ = ("name",)
+
     command_call="job-name"
     description="Slurm job name."
 
@@ -110,23 +382,241 @@ class JobNameCommand(SbatchCommand):
         self.name=name
         self.command_arg=self.name
 
+class Profiler(object):
+    """Runs the python of a job under `script`, a copy of `slurm_tools.profiler`.
+
+    `sampler` is `"cprofile"`, or `"py-spy"` to sample with `py-spy` on nodes where it is
+    installed. Profiles and resource usage are written to files starting with the output
+    prefix of each python command, see `python`.
+    """
+
+    __slots__ = ("script", "sampler")
+
+    def __init__(self, script, sampler="cprofile"):
+        self.script=script
+        self.sampler=sampler
+
+    def python(self, output_prefix):
+        """Returns the command that runs python, writing files starting with `output_prefix`."""
+        return f"python {self.script} --output_prefix \"{output_prefix}\" --sampler {self.sampler}"
+
+
 class RunPythonScript(BashCommand):
+    """Runs python script with `job_args`.
+
+    `python` is the command that runs python, e.g. `Profiler.python`.
+    """
 
-    command_call="python -m"
+    __slots__ = ("job_script", "job_args", "command_call")
 
-    def __init__(self, job_script, job_args):
+    def __init__(self, job_script, job_args, python=PYTHON):
+        self.command_call=f"{python} -m"
         self.job_script=job_script
         self.job_args=job_args
         self.command_arg = f"{self.job_script} {self.python_command_arg(self.job_args)}"
 
     def python_command_arg(self, job_args):
-        """Creates argument for python script."""
+        """Creates argument for python script.
+
+        `job_args` that are already a string (e.g. a template field) are used as is.
+        """
+        if isinstance(job_args, str):
+            return job_args
         return csv_util.dict_to_CLI_args(job_args)
 
 
+class RunPythonScriptArray(BashCommand):
+    """Runs python script with arguments read from line `SLURM_ARRAY_TASK_ID` of `args_file`.
+
+    `args_file` contains one line of CLI arguments per array task. The line is split into
+    arguments at whitespace, without expanding globs or variables in it.
+    """
+
+    __slots__ = ("job_script", "args_file", "command_call")
+
+    def __init__(self, job_script, args_file, python=PYTHON):
+        self.command_call=f"{python} -m"
+        self.job_script=job_script
+        self.args_file=args_file
+        self.command_arg = f"{self.job_script} \"${{ROW_ARGS[@]}}\""
+
+    def command_str(self):
+        return "\n".join([
+            f"read -ra ROW_ARGS < <({self.array_line_command(self.args_file)})",
+            super().command_str(),
+        ])
+
+    def array_line_command(self, args_file):
+        """Prints the line of `args_file` for this array task."""
+        return f"sed -n \"$((SLURM_ARRAY_TASK_ID + 1))p\" {args_file}"
+
+
+class RunPackedPythonScriptArray(RunPythonScriptArray):
+    """Runs `pack_size` consecutive lines of `args_file` within a single array task.
+
+    Rows are dispatched as background processes, at most `SLURM_NTASKS` at a time. If
+    `step_launcher` is `"srun"`, each row runs as its own job step. Each row writes its
+    logs to `row_{ROW}_output.txt`/`row_{ROW}_error.txt` and its result to
+    `row_{ROW}_result.json` in `output_directory`. The task exits with status 1 if any
+    of its rows failed, after all rows have ended.
+    """
+
+    __slots__ = ("pack_size", "output_directory", "step_launcher")
+
+    STEP_LAUNCHERS = {
+        "srun": "srun --exclusive --ntasks=1 ",
+        "local": "",
+    }
+
+    def __init__(self, job_script, args_file, pack_size, output_directory, step_launcher="srun", python=PYTHON):
+        if step_launcher not in self.STEP_LAUNCHERS:
+            raise ValueError(f"`step_launcher` must be one of {list(self.STEP_LAUNCHERS)}.")
+        self.pack_size=pack_size
+        self.output_directory=output_directory
+        self.step_launcher=step_launcher
+        super().__init__(job_script, args_file, python)
+
+    def command_str(self):
+        step = self.STEP_LAUNCHERS[self.step_launcher]
+        return "\n".join([
+            f"ROW=$((SLURM_ARRAY_TASK_ID * {self.pack_size}))",
+            "ROW_PIDS=()",
+            "ROWS_STATUS=0",
+            "while IFS= read -r ROW_LINE; do",
+            "    read -ra ROW_ARGS <<< \"${ROW_LINE}\"",
+            f"    {RESULT_FILE_VARIABLE}=\"{self.output_directory}/row_${{ROW}}_{RESULT_FILE_NAME}\" \\",
+            f"        {step}{self.command_call} {self.job_script} \"${{ROW_ARGS[@]}}\" \\",
+            f"        > {self.output_directory}/row_${{ROW}}_output.txt \\",
+            f"        2> {self.output_directory}/row_${{ROW}}_error.txt &",
+            "    ROW_PIDS+=($!)",
+            "    ROW=$((ROW + 1))",
+            "    # Run at most `SLURM_NTASKS` rows at once.",
+            "    while [ \"$(jobs -rp | wc -l)\" -ge \"${SLURM_NTASKS:-1}\" ]; do",
+            "        wait -n || ROWS_STATUS=1",
+            "    done",
+            f"done < <({self.pack_lines_command()})",
+            "# `wait PID` also returns the status of rows already reaped by `wait -n`.",
+            "for ROW_PID in \"${ROW_PIDS[@]}\"; do",
+            "    wait \"${ROW_PID}\" || ROWS_STATUS=1",
+            "done",
+            "if [ \"${ROWS_STATUS}\" -ne 0 ]; then",
+            "    echo \"Rows of array task ${SLURM_ARRAY_TASK_ID} failed.\" >&2",
+            "    exit 1",
+            "fi",
+        ])
+
+    def pack_lines_command(self):
+        """Prints the lines of `args_file` for this array task."""
+        first = f"$((SLURM_ARRAY_TASK_ID * {self.pack_size} + 1))"
+        last = f"$(((SLURM_ARRAY_TASK_ID + 1) * {self.pack_size}))"
+        return f"sed -n \"{first},{last}p\" {self.args_file}"
+
+
+class RunPythonScriptSweep(RunPythonScriptArray):
+    """Runs python script with row `SLURM_ARRAY_TASK_ID` of sweep spec `spec_file`.
+
+    The row is computed in the job by `spec_script` (a copy of `slurm_tools.sweep_spec`),
+    so the rows of the sweep are never written out.
+    """
+
+    __slots__ = ("spec_script",)
+
+    def __init__(self, job_script, spec_script, spec_file, python=PYTHON):
+        self.spec_script=spec_script
+        super().__init__(job_script, spec_file, python)
+
+    def array_line_command(self, args_file):
+        """Computes the row of `args_file` for this array task."""
+        return f"python {self.spec_script} {args_file} --index ${{SLURM_ARRAY_TASK_ID}}"
+
+
+class RunPackedPythonScriptSweep(RunPackedPythonScriptArray):
+    """Runs `pack_size` consecutive rows of sweep spec `spec_file` within a single array task.
+
+    See `RunPackedPythonScriptArray` and `RunPythonScriptSweep`.
+    """
+
+    __slots__ = ("spec_script",)
+
+    def __init__(
+        self, job_script, spec_script, spec_file, pack_size, output_directory, step_launcher="srun", python=PYTHON,
+    ):
+        self.spec_script=spec_script
+        super().__init__(job_script, spec_file, pack_size, output_directory, step_launcher, python)
+
+    def pack_lines_command(self):
+        """Prints the rows of `args_file` for this array task."""
+        return (
+            f"python {self.spec_script} {self.args_file} "
+            f"--index ${{SLURM_ARRAY_TASK_ID}} --count {self.pack_size}"
+        )
+
+
+class RunPythonWorkers(BashCommand):
+    """Starts `SLURM_NTASKS` long-lived python workers that share the tasks in `tasks_file`.
+
+    See `slurm_tools.worker` for the worker script.
+    """
+
+    __slots__ = (
+        "worker_script",
+        "job_script",
+        "tasks_file",
+        "output_directory",
+        "function",
+        "call",
+        "chunk_size",
+        "step_launcher",
+        "command_call",
+    )
+
+    def __init__(
+        self,
+        worker_script,
+        job_script,
+        tasks_file,
+        output_directory,
+        function="main",
+        call="kwargs",
+        chunk_size=1,
+        step_launcher="srun",
+        python=PYTHON,
+    ):
+        if step_launcher not in RunPackedPythonScriptArray.STEP_LAUNCHERS:
+            raise ValueError(
+                f"`step_launcher` must be one of {list(RunPackedPythonScriptArray.STEP_LAUNCHERS)}.")
+        self.command_call=python
+        self.worker_script=worker_script
+        self.job_script=job_script
+        self.tasks_file=tasks_file
+        self.output_directory=output_directory
+        self.function=function
+        self.call=call
+        self.chunk_size=chunk_size
+        self.step_launcher=step_launcher
+        self.command_arg = (
+            f"{self.worker_script} --module {self.job_script} --function {self.function} "
+            f"--tasks_file {self.tasks_file} --output_directory {self.output_directory} "
+            f"--call {self.call} --chunk_size {self.chunk_size}"
+        )
+
+    def command_str(self):
+        if self.step_launcher == "srun":
+            # `srun` starts one worker per task of the allocation.
+            return f"srun {super().command_str()}"
+        return "\n".join([
+            "for WORKER in $(seq 1 ${SLURM_NTASKS:-1}); do",
+            f"    {super().command_str()} &",
+            "done",
+            "wait",
+        ])
+
+
 class MailAddressCommand(SbatchCommand):
     """Emails status of job."""
 
+    __slots__ = ("email",)
+
     command_call="mail-user"
     description="Set email address for update."
 
@@ -138,6 +628,8 @@ class MailAddressCommand(SbatchCommand):
 class MailTypeCommand(SbatchCommand):
     """Emails status of job."""
 
+    __slots__ = ("mail_type",)
+
     command_call="mail-type"
     description="Notify user by email at given status."
 
@@ -148,26 +640,94 @@ class MailTypeCommand(SbatchCommand):
 
 class STDOUTCommand(SbatchCommand):
     """Sets location to save STDOUT."""
+
+    __slots__ = ("output_directory",)
+
     command_call="output"
     description="Set file for `stdout`."
 
-    def __init__(self, output_directory):
+    def __init__(self, output_directory, file_name="output.txt"):
         self.output_directory=output_directory
-        self.command_arg=f"{self.output_directory}/output.txt"
+        self.command_arg=f"{self.output_directory}/{file_name}"
 
 
 class STDERRCommand(SbatchCommand):
     """Sets location to save STDERR."""
+
+    __slots__ = ("output_directory",)
+
     command_call="error"
     description="Set file for `stderr`."
 
-    def __init__(self, output_directory):
+    def __init__(self, output_directory, file_name="error.txt"):
         self.output_directory=output_directory
-        self.command_arg=f"{self.output_directory}/error.txt"
+        self.command_arg=f"{self.output_directory}/{file_name}"
+
+
+class ArrayCommand(SbatchCommand):
+    """Submits job as a slurm job array.
+
+    Each task in the array is given `SLURM_ARRAY_TASK_ID` in `[0, task_count)`.
+    If `max_concurrent` is given, at most that many tasks run at once.
+    """
+
+    __slots__ = ("task_count", "max_concurrent")
+
+    command_call="array"
+    description="Set job array indices."
+
+    def __init__(self, task_count, max_concurrent=None):
+        self.task_count=task_count
+        self.max_concurrent=max_concurrent
+        self.command_arg=f"0-{self.task_count - 1}"
+        if self.max_concurrent is not None:
+            self.command_arg=f"{self.command_arg}%{self.max_concurrent}"
+
+
+class SignalCommand(SbatchCommand):
+    """Sends `signal` to the batch shell `signal_time` seconds before the time limit."""
+
+    __slots__ = ("signal", "signal_time")
+
+    command_call="signal"
+    description="Signal the batch shell before the time limit."
+
+    def __init__(self, signal_time, signal="USR1"):
+        self.signal=signal
+        self.signal_time=signal_time
+        self.command_arg=f"B:{self.signal}@{self.signal_time}"
+
+
+class RequeueCommand(SbatchCommand):
+    """Allows the job to be requeued, e.g. by `RequeueTrapCommand` or after preemption."""
+
+    __slots__ = ()
+
+    command_call="requeue"
+    description="Allow job to be requeued."
+
+    def command_str(self):
+        return f"{self._SBATCH_COMMAND} --{self.command_call}"
+
+
+class OpenModeCommand(SbatchCommand):
+    """Sets whether logs are appended to or truncated, e.g. when a job is requeued."""
+
+    __slots__ = ("open_mode",)
+
+    command_call="open-mode"
+    description="Append to logs of earlier runs of a requeued job."
+
+    def __init__(self, open_mode="append"):
+        self.open_mode=open_mode
+        self.command_arg=self.open_mode
 
 
 class PartitionCommand(SbatchCommand):
     """Sets partition on which to run job."""
+
+    __slots__ = ("partition",)
+
     command_call="partition"
     description="Set partition for job" 
 
@@ -178,6 +738,9 @@ class PartitionCommand(SbatchCommand):
 
 class TimeCommand(SbatchCommand):
     """Sets partition on which to run job."""
+
+    __slots__ = ("time",)
+
     command_call="time"
     description="Set total run time for job" 
 
@@ -191,6 +754,9 @@ class NTaskCommand(SbatchCommand):
     The default is for 1 cpu per task, so for simple jobs this is equivalent to setting
     the number of CPUs.
     """
+
+    __slots__ = ("task_count",)
+
     command_call="ntasks"
     description="Set number of requeted tasks (default 1 cpu/task)." 
 
@@ -201,6 +767,9 @@ class NTaskCommand(SbatchCommand):
 
 class MemoryPerCpuCommand(SbatchCommand):
     """Sets partition on which to run job."""
+
+    __slots__ = ("mem_per_cpu",)
+
     command_call="mem-per-cpu"
     description="Set memory for each cpu in job" 
 
@@ -0,0 +1,132 @@
+"""Concurrent, rate-limited submission of sbatch files."""
+
+from concurrent import futures
+from pathlib import Path
+import subprocess
+import threading
+import time
+
+_SBATCH_COMMAND="sbatch"
+_PARSABLE_FLAG="--parsable"
+# Errors returned by `sbatch` when the controller is busy. These are safe to retry.
+_TRANSIENT_ERRORS=(
+    "Socket timed out",
+    "Resource temporarily unavailable",
+    "temporarily unable to accept job",
+)
+
+
+class SubmissionError(RuntimeError):
+    """Raised when `sbatch` fails to submit a job."""
+
+
+class TokenBucket(object):
+    """Limits the rate of an operation to `rate` per second with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int=1):
+        self.rate=rate
+        self.capacity=capacity
+        self._tokens=capacity
+        self._last=time.monotonic()
+        self._lock=threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_job_id(sbatch_stdout: str):
+    """Parses job id from output of `sbatch --parsable` (`jobid[;cluster]`)."""
+    return sbatch_stdout.strip().split(";")[0]
+
+
+class SbatchSubmitter(object):
+    """Submits sbatch files with a bounded pool of workers.
+
+    args:
+        max_workers: Maximum number of concurrent `sbatch` calls.
+        rate: Optionally, maximum number of submissions per second.
+        burst: Number of submissions allowed at once before `rate` applies.
+        max_retries: Number of times to retry a submission that failed with a transient error.
+        backoff: Seconds to wait before the first retry, doubled after each attempt.
+        sbatch_command: Command used to submit, e.g. a local fake `sbatch` script for testing.
+    """
+
+    def __init__(
+        self,
+        max_workers: int=4,
+        rate: float=None,
+        burst: int=1,
+        max_retries: int=3,
+        backoff: float=1.0,
+        sbatch_command: str=_SBATCH_COMMAND,
+    ):
+        self.max_workers=max_workers
+        self.max_retries=max_retries
+        self.backoff=backoff
+        self.sbatch_command=sbatch_command
+        self.bucket=None if rate is None else TokenBucket(rate, burst)
+        self.errors=[]
+
+    def submit(self, sbatch_file: Path, sbatch_args=()):
+        """Submits `sbatch_file` and returns its job id.
+
+        Transient controller errors are retried with exponential backoff. Raises
+        `SubmissionError` if `sbatch` fails or cannot be run, e.g. outside of a cluster.
+        """
+        command = [self.sbatch_command, _PARSABLE_FLAG, *sbatch_args, str(sbatch_file)]
+        for attempt in range(self.max_retries + 1):
+            if self.bucket is not None:
+                self.bucket.acquire()
+            try:
+                result = subprocess.run(command, capture_output=True, text=True)
+            except OSError as e:
+                raise SubmissionError(f"`{' '.join(command)}` could not be run: {e}") from e
+            if result.returncode == 0:
+                return parse_job_id(result.stdout)
+            if not _is_transient(result.stderr) or attempt == self.max_retries:
+                break
+            time.sleep(self.backoff * 2 ** attempt)
+        raise SubmissionError(
+            f"`{' '.join(command)}` failed with exit status {result.returncode}: {result.stderr.strip()}")
+
+    def submit_all(self, sbatch_files):
+        """Submits each of `sbatch_files` concurrently and returns their job ids in order.
+
+        `sbatch_files` may be a generator; at most `2 * max_workers` files are waiting to be
+        submitted at once. Failed submissions return `None` and are recorded in `errors`,
+        which only holds the errors of the last call.
+        """
+        self.errors = []
+        job_ids = []
+        pending = []
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for sbatch_file in sbatch_files:
+                pending.append(executor.submit(self._submit_or_record, sbatch_file))
+                # Bound the number of queued submissions so that `sbatch_files` is consumed lazily.
+                if len(pending) >= 2 * self.max_workers:
+                    job_ids.append(pending.pop(0).result())
+            job_ids.extend(f.result() for f in pending)
+        return job_ids
+
+    def _submit_or_record(self, sbatch_file):
+        """Submits `sbatch_file`, returning `None` and recording the error on failure."""
+        try:
+            return self.submit(sbatch_file)
+        except SubmissionError as e:
+            self.errors.append((sbatch_file, e))
+            return None
+
+
+def _is_transient(stderr: str):
+    """Returns `True` if `stderr` from `sbatch` indicates a retryable error."""
+    return any(e in stderr for e in _TRANSIENT_ERRORS)
@@ -0,0 +1,289 @@
+"""Compact sweep specifications that are expanded lazily, one row at a time.
+
+A spec is a JSON (or YAML) file describing an axis, e.g.
+
+    {"product": [
+        {"choice": {"optimizer": ["adam", "sgd"]}},
+        {"logspace": {"lr": {"start": -5, "stop": -1, "num": 5}}},
+        {"zip": [{"choice": {"width": [64, 128]}}, {"choice": {"depth": [2, 4]}}]},
+        {"random": {"count": 20, "seed": 0, "params": {"dropout": {"uniform": [0, 0.5]}}}},
+        {"fixed": {"epochs": 10}}
+    ]}
+
+Any row can be computed from its index without expanding the others, so an array task
+finds its own row from `SLURM_ARRAY_TASK_ID`. This module only depends on the standard
+library since it is copied into the job directory and run with the python of the job's
+environment.
+"""
+
+import argparse
+import json
+import math
+from pathlib import Path
+import random
+
+SPEC_SUFFIXES=(".json", ".yaml", ".yml")
+_TRUE_FLAG="TRUE"
+
+
+class Axis(object):
+    """Base class for axes of a sweep. Subclasses implement `__len__` and `row`."""
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def row(self, index: int):
+        """Returns `dict` of parameters of row `index`."""
+        raise NotImplementedError
+
+    def __iter__(self):
+        return map(self.row, range(len(self)))
+
+
+class Fixed(Axis):
+    """A single row of constant parameters."""
+
+    def __init__(self, params: dict):
+        self.params=dict(params)
+
+    def __len__(self):
+        return 1
+
+    def row(self, index):
+        return dict(self.params)
+
+
+class Choice(Axis):
+    """One row for each of `values` of parameter `name`."""
+
+    def __init__(self, name: str, values):
+        self.name=name
+        self.values=list(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def row(self, index):
+        return {self.name: self.values[index]}
+
+
+class Logspace(Axis):
+    """`num` values of parameter `name` evenly spaced between `base ** start` and `base ** stop`."""
+
+    def __init__(self, name: str, start: float, stop: float, num: int, base: float=10):
+        self.name=name
+        self.start=start
+        self.stop=stop
+        self.num=num
+        self.base=base
+
+    def __len__(self):
+        return self.num
+
+    def row(self, index):
+        step = 0 if self.num == 1 else (self.stop - self.start) / (self.num - 1)
+        return {self.name: self.base ** (self.start + index * step)}
+
+
+def _sample(rng, distribution: str, args):
+    """Draws one value of `distribution` with `args` using `rng`."""
+    if distribution == "uniform":
+        return rng.uniform(*args)
+    if distribution == "loguniform":
+        low, high = args
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    if distribution == "randint":
+        return rng.randint(*args)
+    if distribution == "choice":
+        return rng.choice(args)
+    raise ValueError(f"Unknown distribution `{distribution}`.")
+
+
+class Random(Axis):
+    """`count` random samples of `params`, each a `{distribution: args}` `dict`.
+
+    Each row is drawn from its own generator seeded by `seed` and the row index, so
+    rows do not depend on the rows before them.
+    """
+
+    def __init__(self, count: int, params: dict, seed: int=0):
+        self.count=count
+        self.params=params
+        self.seed=seed
+
+    def __len__(self):
+        return self.count
+
+    def row(self, index):
+        rng = random.Random(f"{self.seed}:{index}")
+        row = {}
+        for name, distribution in self.params.items():
+            (kind, args), = distribution.items()
+            row[name] = _sample(rng, kind, args)
+        return row
+
+
+class Product(Axis):
+    """Cartesian product of `axes`, the last axis changing fastest."""
+
+    def __init__(self, axes):
+        self.axes=list(axes)
+        self._length=math.prod(len(a) for a in self.axes)
+
+    def __len__(self):
+        return self._length
+
+    def row(self, index):
+        if not 0 <= index < self._length:
+            raise IndexError(f"Row {index} out of range for {self._length} rows.")
+        rows = []
+        for axis in reversed(self.axes):
+            index, axis_index = divmod(index, len(axis))
+            rows.append(axis.row(axis_index))
+        row = {}
+        for r in reversed(rows):
+            row.update(r)
+        return row
+
+
+class Zip(Axis):
+    """Rows of `axes` taken together, all axes must have the same length."""
+
+    def __init__(self, axes):
+        self.axes=list(axes)
+        lengths = {len(a) for a in self.axes}
+        if len(lengths) > 1:
+            raise ValueError(f"Zipped axes have different lengths {sorted(lengths)}.")
+        self._length=lengths.pop() if lengths else 0
+
+    def __len__(self):
+        return self._length
+
+    def row(self, index):
+        row = {}
+        for axis in self.axes:
+            row.update(axis.row(index))
+        return row
+
+
+def _parameter_axes(params: dict, make_axis):
+    """Returns one axis per parameter, combined by `Product` if there are several."""
+    axes = [make_axis(name, value) for name, value in params.items()]
+    return axes[0] if len(axes) == 1 else Product(axes)
+
+
+def parse_axis(spec: dict):
+    """Builds an `Axis` from a spec `dict`, see the module docstring."""
+    if not isinstance(spec, dict) or len(spec) != 1:
+        raise ValueError(f"Each axis must be a `dict` with a single key, got {spec!r}.")
+    (kind, value), = spec.items()
+    if kind == "product":
+        return Product(parse_axis(s) for s in value)
+    if kind == "zip":
+        return Zip(parse_axis(s) for s in value)
+    if kind == "fixed":
+        return Fixed(value)
+    if kind == "choice":
+        return _parameter_axes(value, Choice)
+    if kind == "logspace":
+        return _parameter_axes(value, lambda name, v: Logspace(name, **v))
+    if kind == "random":
+        return Random(**value)
+    raise ValueError(f"Unknown axis `{kind}`.")
+
+
+def _format_value(value):
+    """Formats values like entries of a csv: `str`, `TRUE` for flags and `None` to omit."""
+    if value is True:
+        return _TRUE_FLAG
+    if value is False or value is None:
+        return None
+    if isinstance(value, float):
+        # Drop floating point noise, e.g. of `10 ** -3`.
+        return f"{value:.12g}"
+    return str(value)
+
+
+class SweepSpec(object):
+    """Rows of a sweep, computed on demand from an `Axis`.
+
+    Rows are `dict`s of `str` like rows read by `csv_util.iter_csv`, with the row index as
+    `experiment_id`.
+    """
+
+    def __init__(self, axis: Axis):
+        self.axis=axis
+
+    def __len__(self):
+        return len(self.axis)
+
+    def row(self, index: int):
+        """Returns row `index`."""
+        if not 0 <= index < len(self):
+            raise IndexError(f"Row {index} out of range for {len(self)} rows.")
+        row = {"experiment_id": str(index)}
+        row.update((k, _format_value(v)) for k, v in self.axis.row(index).items())
+        return row
+
+    def rows(self, start: int=0, stop: int=None):
+        """Yields rows `start` up to, but not including, `stop`."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for index in range(start, stop):
+            yield self.row(index)
+
+    def __iter__(self):
+        return self.rows()
+
+
+def is_spec_file(path):
+    """Returns `True` if `path` names a sweep spec rather than a csv."""
+    return Path(path).suffix in SPEC_SUFFIXES
+
+
+def read_spec(path):
+    """Reads the spec `dict` of a JSON or YAML file. YAML requires `PyYAML`."""
+    path = Path(path)
+    with path.open() as f:
+        if path.suffix == ".json":
+            return json.load(f)
+        try:
+            import yaml
+        except ImportError as e:
+            raise ImportError("Reading YAML sweep specs requires `PyYAML`, or use a JSON spec.") from e
+        return yaml.safe_load(f)
+
+
+def load_spec(path):
+    """Returns the `SweepSpec` of a spec file."""
+    return SweepSpec(parse_axis(read_spec(path)))
+
+
+def cli_args(row: dict):
+    """Formats a row as CLI arguments, as `csv_util.dict_to_CLI_args` does for csv rows."""
+    args = []
+    for k, v in row.items():
+        if k == "experiment_id" or v is None:
+            continue
+        args.append(f"--{k}" if v == _TRUE_FLAG else f"--{k}={v}")
+    return " ".join(args)
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("spec_file", type=str)
+    parser.add_argument("--index", type=int, default=0)
+    parser.add_argument("--count", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    """Prints the CLI arguments of rows `index * count` to `(index + 1) * count`, one per line."""
+    args = parse_args()
+    spec = load_spec(args.spec_file)
+    for row in spec.rows(args.index * args.count, (args.index + 1) * args.count):
+        print(cli_args(row))
+
+
+if __name__ == "__main__":
+    main()
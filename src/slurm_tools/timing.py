@@ -0,0 +1,128 @@
+"""Per-phase startup timing of instrumented jobs (see `JobLauncher(instrument=True)`).
+
+Instrumented jobs append `EVENT<TAB>EPOCH_SECONDS` lines to `timing.tsv` (or
+`{ARRAY_INDEX}_timing.tsv`) in their job directory as each phase ends. The time spent
+in queue is measured from the modification time of the job's sbatch file, which is
+written just before submission.
+"""
+
+import os
+from pathlib import Path
+import re
+import time
+
+from slurm_tools import launch_job
+from slurm_tools import sbatch_command as scommand
+
+TIMING_FILE_NAME=scommand.TIMING_FILE_NAME
+# Environment variable holding the timing file of a running job.
+TIMING_FILE_VARIABLE=scommand.TIMING_FILE_VARIABLE
+START=scommand.TimingFileCommand.start_event
+QUEUE="queue"
+TOTAL="total"
+_TIMING_FILE_PATTERN = re.compile(r"(?:(?P<prefix>.+)_)?" + re.escape(TIMING_FILE_NAME))
+_SBATCH_FILE_NAME="sbatch.txt"
+DEFAULT_PERCENTILES=(50, 90, 99)
+
+
+def mark(event: str):
+    """Records `event` in the timing file of the running job, if it is instrumented.
+
+    e.g. call `mark("imported")` after the imports of a script to time them separately.
+    """
+    timing_file = os.environ.get(TIMING_FILE_VARIABLE)
+    if not timing_file:
+        return
+    with open(timing_file, "a") as f:
+        f.write(f"{event}\t{time.time():.6f}\n")
+
+
+def read_timing(timing_file: Path):
+    """Returns `(event, time)` of `timing_file` in order of time, keeping the first of repeated events."""
+    events = {}
+    with open(timing_file) as f:
+        for line in f:
+            event, _, t = line.rstrip("\n").partition("\t")
+            if not t:
+                continue
+            t = float(t)
+            if event not in events or t < events[event]:
+                events[event] = t
+    return sorted(events.items(), key=lambda e: e[1])
+
+
+def phase_durations(events, submit_time: float=None):
+    """Returns `dict` of phase to seconds, the time from the previous event to each event.
+
+    Also includes `queue` (from `submit_time` to `start`) if `submit_time` is given and
+    `total` (from `start` to the last event).
+    """
+    durations = {}
+    start = dict(events).get(START)
+    if start is None:
+        return durations
+    if submit_time is not None:
+        durations[QUEUE] = start - submit_time
+    previous = None
+    for event, t in events:
+        if previous is not None:
+            durations[event] = t - previous
+        previous = t
+    durations[TOTAL] = previous - start
+    return durations
+
+
+def iter_timing_files(sweep_directory: Path):
+    """Yields `(job, timing_file)` for every timing file in `sweep_directory`.
+
+    The job is the directory relative to `sweep_directory` without shard directories,
+    followed by `[{ARRAY_INDEX}]` for array tasks.
+    """
+    sweep_directory = Path(sweep_directory)
+    shard_levels = launch_job.read_layout(sweep_directory)["shard_levels"]
+    for directory, _, files in os.walk(sweep_directory):
+        for name in sorted(files):
+            match = _TIMING_FILE_PATTERN.fullmatch(name)
+            if match is None:
+                continue
+            job = str(Path(*Path(directory).relative_to(sweep_directory).parts[shard_levels:]))
+            if match["prefix"] is not None:
+                job = f"{job}[{match['prefix']}]"
+            yield job, Path(directory).joinpath(name)
+
+
+def _submit_time(job_directory: Path):
+    """Returns the modification time of the sbatch file of `job_directory`, or `None`."""
+    try:
+        return os.stat(Path(job_directory).joinpath(_SBATCH_FILE_NAME)).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def sweep_durations(sweep_directory: Path):
+    """Returns `dict` of job to its `phase_durations`."""
+    return {
+        job: phase_durations(read_timing(timing_file), _submit_time(timing_file.parent))
+        for job, timing_file in iter_timing_files(sweep_directory)
+    }
+
+
+def percentile(values, q: float):
+    """Returns the `q`th percentile of `values`, interpolating linearly."""
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(durations: dict, percentiles=DEFAULT_PERCENTILES):
+    """Aggregates `sweep_durations` into `dict` of phase to count and percentiles of seconds."""
+    by_phase = {}
+    for job_durations in durations.values():
+        for phase, seconds in job_durations.items():
+            by_phase.setdefault(phase, []).append(seconds)
+    return {
+        phase: {"count": len(values), **{f"p{q:g}": percentile(values, q) for q in percentiles}}
+        for phase, values in by_phase.items()
+    }
@@ -0,0 +1,193 @@
+"""Long-lived python worker that runs many tasks after importing the target module once.
+
+Workers are started inside an allocation and claim tasks from a shared `tasks_file`.
+This module only depends on the standard library since it is copied into the job
+directory and run with the python of the job's environment.
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+from pathlib import Path
+import shlex
+import sys
+import time
+import traceback
+
+_CLAIM_DIRECTORY_NAME="claims"
+_CALL_KWARGS="kwargs"
+_CALL_ARGV="argv"
+# Timing file of instrumented jobs, see `slurm_tools.timing`.
+_TIMING_FILE_VARIABLE="SLURM_TOOLS_TIMING_FILE"
+# Result file of each row, see `slurm_tools.results`.
+_RESULT_FILE_NAME="result.json"
+_RESULT_FILE_VARIABLE="SLURM_TOOLS_RESULT_FILE"
+
+
+def load_module(module: str):
+    """Imports `module`, given either as a path to a `.py` file or as a module name.
+
+    Module names are imported from the cwd, as with `python -m`, since `python worker.py`
+    puts the directory of the worker script first on `sys.path` instead.
+    """
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    module_path = Path(module)
+    if module_path.suffix == ".py" and module_path.exists():
+        spec = importlib.util.spec_from_file_location(module_path.stem, module_path)
+        loaded = importlib.util.module_from_spec(spec)
+        sys.modules[module_path.stem] = loaded
+        spec.loader.exec_module(loaded)
+        return loaded
+    return importlib.import_module(module)
+
+
+def iter_tasks(tasks_file: Path):
+    """Yields `(row, task)` for each line of the jsonl `tasks_file`."""
+    with open(tasks_file) as f:
+        for row, line in enumerate(f):
+            yield row, json.loads(line)
+
+
+def mark_timing(event: str):
+    """Records `event` in the timing file of the job, if it is instrumented."""
+    timing_file = os.environ.get(_TIMING_FILE_VARIABLE)
+    if not timing_file:
+        return
+    with open(timing_file, "a") as f:
+        f.write(f"{event}\t{time.time():.6f}\n")
+
+
+def claim(claim_directory: Path, chunk: int):
+    """Atomically claims `chunk` of tasks, returns `False` if another worker owns it."""
+    try:
+        fd = os.open(claim_directory.joinpath(str(chunk)), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.write(fd, f"{os.uname().nodename} {os.getpid()}".encode())
+    os.close(fd)
+    return True
+
+
+class _RedirectOutput(object):
+    """Redirects stdout and stderr file descriptors, including output from extensions."""
+
+    def __init__(self, output_file: Path, error_file: Path):
+        self.output_file=output_file
+        self.error_file=error_file
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self._saved = [os.dup(1), os.dup(2)]
+        self._files = [open(self.output_file, "w"), open(self.error_file, "w")]
+        os.dup2(self._files[0].fileno(), 1)
+        os.dup2(self._files[1].fileno(), 2)
+        return self
+
+    def __exit__(self, *exc):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved in zip([1, 2], self._saved):
+            os.dup2(saved, fd)
+            os.close(saved)
+        for f in self._files:
+            f.close()
+
+
+def write_result(result_file: Path, result: dict):
+    """Writes `result` as JSON, replacing `result_file` at once so readers never see part of it."""
+    partial_file = Path(f"{result_file}.{os.getpid()}.tmp")
+    with open(partial_file, "w") as f:
+        json.dump(result, f)
+    os.replace(partial_file, result_file)
+
+
+def run_task(function, task: dict, call: str=_CALL_KWARGS):
+    """Calls `function` with the arguments of `task`."""
+    if call == _CALL_KWARGS:
+        return function(**task["args"])
+    # Scripts that parse `sys.argv` see the same arguments as `python -m script ARGS`.
+    sys.argv = [sys.argv[0], *shlex.split(task["argv"])]
+    return function()
+
+
+def run_worker(
+    module: str,
+    function: str,
+    tasks_file: Path,
+    output_directory: Path,
+    call: str=_CALL_KWARGS,
+    chunk_size: int=1,
+):
+    """Imports `module` once, then runs `function` for each task this worker claims.
+
+    Tasks are claimed in chunks of `chunk_size` consecutive rows so that many workers,
+    possibly on different nodes, can share `tasks_file`. Each row logs to
+    `row_{ROW}_output.txt`/`row_{ROW}_error.txt` in `output_directory`. A `dict`
+    returned by `function` is written to the row's result file, `row_{ROW}_result.json`.
+
+    returns:
+        failed: number of tasks that raised an exception.
+    """
+    output_directory = Path(output_directory)
+    claim_directory = output_directory.joinpath(_CLAIM_DIRECTORY_NAME)
+    claim_directory.mkdir(parents=True, exist_ok=True)
+    entry = getattr(load_module(module), function)
+    mark_timing("imported")
+
+    failed = 0
+    owned_chunk = None
+    for row, task in iter_tasks(tasks_file):
+        chunk = row // chunk_size
+        if chunk != owned_chunk:
+            if not claim(claim_directory, chunk):
+                continue
+            owned_chunk = chunk
+        result_file = output_directory.joinpath(f"row_{row}_{_RESULT_FILE_NAME}")
+        os.environ[_RESULT_FILE_VARIABLE] = str(result_file)
+        with _RedirectOutput(
+            output_directory.joinpath(f"row_{row}_output.txt"),
+            output_directory.joinpath(f"row_{row}_error.txt"),
+        ):
+            try:
+                result = run_task(entry, task, call)
+                if isinstance(result, dict):
+                    write_result(result_file, result)
+            except (Exception, SystemExit) as e:
+                if not (isinstance(e, SystemExit) and e.code in (None, 0)):
+                    traceback.print_exc()
+                    failed += 1
+    return failed
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", type=str)
+    parser.add_argument("--function", type=str, default="main")
+    parser.add_argument("--tasks_file", type=str)
+    parser.add_argument("--output_directory", type=str)
+    parser.add_argument("--call", choices=[_CALL_KWARGS, _CALL_ARGV], default=_CALL_KWARGS)
+    parser.add_argument("--chunk_size", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    """Runs a worker until all tasks in `tasks_file` are claimed."""
+    args = parse_args()
+    failed = run_worker(
+        module=args.module,
+        function=args.function,
+        tasks_file=Path(args.tasks_file),
+        output_directory=Path(args.output_directory),
+        call=args.call,
+        chunk_size=args.chunk_size,
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
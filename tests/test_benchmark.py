@@ -0,0 +1,64 @@
+"""Smoke tests of the fake slurm commands (see `fake_slurm`) and of the launch benchmark."""
+
+import json
+import subprocess
+
+from slurm_tools import benchmark
+from slurm_tools import fake_slurm
+from slurm_tools import submit
+
+
+def _run(executable, *args):
+    return subprocess.run([str(executable), *args], capture_output=True, text=True, check=True).stdout
+
+
+def test_fake_sbatch_records_submissions(tmp_path):
+    executables = fake_slurm.install(tmp_path.joinpath("bin"), state_directory=tmp_path.joinpath("state"))
+    sbatch_files = []
+    for i, array in enumerate(["", "#SBATCH --array=0-2%2\n"]):
+        sbatch_file = tmp_path.joinpath(f"job_{i}.sbatch")
+        sbatch_file.write_text(f"#!/bin/bash\n{array}echo hello\n")
+        sbatch_files.append(sbatch_file)
+    submitter = submit.SbatchSubmitter(max_workers=1, sbatch_command=str(executables["sbatch"]))
+    assert submitter.submit_all(sbatch_files) == ["1000", "1001"]
+    assert submitter.errors == []
+
+    lines = tmp_path.joinpath("state", fake_slurm.SUBMISSIONS_FILE_NAME).read_text().splitlines()
+    assert [line.split("\t")[0] for line in lines] == ["1000", "1001"]
+    submissions = fake_slurm.read_submissions(tmp_path.joinpath("state"))
+    assert [s["array"] for s in submissions] == [None, "0-2%2"]
+    assert [s["sbatch_file"] for s in submissions] == [str(f) for f in sbatch_files]
+    assert _run(executables["sbatch"], str(sbatch_files[0])) == "Submitted batch job 1002\n"
+
+
+def test_fake_squeue_sacct_and_scancel(tmp_path):
+    executables = fake_slurm.install(tmp_path, runtime=3600)
+    sbatch_file = tmp_path.joinpath("job.sbatch")
+    sbatch_file.write_text("#!/bin/bash\n#SBATCH --array=0-1\necho hello\n")
+    job_id = _run(executables["sbatch"], "--parsable", str(sbatch_file)).strip()
+    assert _run(executables["squeue"], "--me", "-h", "-o", "%i|%T").splitlines() == [
+        f"{job_id}_0|RUNNING", f"{job_id}_1|RUNNING"]
+    _run(executables["scancel"], f"{job_id}_1")
+    assert _run(
+        executables["sacct"], "--parsable2", "--format=JobID,State", f"--jobs={job_id}").splitlines() == [
+        f"{job_id}_0|RUNNING", f"{job_id}_1|CANCELLED"]
+
+
+def test_run_benchmarks_reports_each_phase(tmp_path):
+    progress = []
+    report = benchmark.run_benchmarks(
+        sizes=(5,), directory=tmp_path, max_submissions=3, progress=progress.append)
+    report = json.loads(json.dumps(report))
+    assert set(report) == {"environment", "settings", "results"}
+    assert report["settings"]["sizes"] == [5]
+    assert [r["phase"] for r in report["results"]] == list(benchmark.PHASES)
+    assert len(progress) == len(benchmark.PHASES)
+    for result in report["results"]:
+        assert set(result) == {
+            "phase", "size", "rows", "seconds", "rows_per_second", "peak_rss_bytes", "rss_growth_bytes"}
+        assert result["rows"] == (3 if result["phase"] == "submit" else 5)
+    # The `submit` phase submitted its rows to fake `sbatch`.
+    assert len(fake_slurm.read_submissions(tmp_path.joinpath("bin"))) >= 3
+
+    comparisons = benchmark.compare(report, report)
+    assert all(c["ratio"] == 1 and not c["regressed"] for c in comparisons)
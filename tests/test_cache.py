@@ -0,0 +1,49 @@
+"""Tests of skipping and linking rows with completed runs in the result cache."""
+
+from slurm_tools import cache as result_cache
+from slurm_tools import launch_python_jobs_array
+
+
+def _skip(tmp_path, cache, cache_key, rows, test=False):
+    cached_rows = []
+    launched = list(launch_python_jobs_array._skip_cached(
+        enumerate(rows), cache, cache_key, tmp_path.joinpath("sweep"), "job", result_cache.CACHE_LINK,
+        cached_rows, test))
+    return launched, cached_rows
+
+
+def test_skip_cached_links_rows_and_replaces_earlier_links(tmp_path):
+    script = tmp_path.joinpath("train.py")
+    script.write_text("print('train')\n")
+    cache_key = result_cache.CacheKey(script, "env", {"cpu_count": 1})
+    cache = result_cache.ResultCache(tmp_path.joinpath("cache.sqlite"))
+    rows = [{"experiment_id": "1", "lr": "0.1"}, {"experiment_id": "2", "lr": "0.2"}]
+    for name in ("first", "stale"):
+        tmp_path.joinpath(name).mkdir()
+    cache.add(cache_key(rows[0]), tmp_path.joinpath("first"), "1")
+    # A relaunch within the same minute reuses the sweep directory and its links.
+    link = tmp_path.joinpath("sweep", "job_id_1_cached")
+    link.parent.mkdir()
+    link.symlink_to(tmp_path.joinpath("stale"))
+
+    launched, cached_rows = _skip(tmp_path, cache, cache_key, rows)
+    assert launched == [(1, rows[1])]
+    assert [row["state"] for row in cached_rows] == ["CACHED"]
+    assert link.resolve() == tmp_path.joinpath("first")
+    _skip(tmp_path, cache, cache_key, rows)
+    assert link.resolve() == tmp_path.joinpath("first")
+    cache.close()
+
+
+def test_skip_cached_does_not_link_in_test_runs(tmp_path):
+    script = tmp_path.joinpath("train.py")
+    script.write_text("print('train')\n")
+    cache_key = result_cache.CacheKey(script, "env", {})
+    cache = result_cache.ResultCache(tmp_path.joinpath("cache.sqlite"))
+    tmp_path.joinpath("first").mkdir()
+    cache.add(cache_key({"lr": "0.1"}), tmp_path.joinpath("first"))
+    launched, cached_rows = _skip(tmp_path, cache, cache_key, [{"experiment_id": "1", "lr": "0.1"}], test=True)
+    assert launched == []
+    assert len(cached_rows) == 1
+    assert not tmp_path.joinpath("sweep").exists()
+    cache.close()
@@ -0,0 +1,191 @@
+"""Tests of successive halving against a fake scheduler and synthetic metrics files."""
+
+import math
+
+import pytest
+
+from slurm_tools import halving
+from slurm_tools import results
+
+
+class FakeScheduler(object):
+    """Records submissions and cancellations, and reports the states set by the test."""
+
+    def __init__(self):
+        self.submitted=[]
+        self.cancelled=[]
+        self.job_states={}
+
+    def submit(self, sbatch_file):
+        self.submitted.append(sbatch_file)
+        return str(1000 + len(self.submitted))
+
+    def cancel(self, job_ids):
+        self.cancelled.extend(job_ids)
+        for job_id in job_ids:
+            self.job_states[job_id] = "CANCELLED"
+
+    def states(self, job_ids):
+        return {job_id: self.job_states[job_id] for job_id in job_ids if job_id in self.job_states}
+
+
+def _report(monkeypatch, directory, key, step, **metrics):
+    """Reports `metrics` as the job of row `key` does, returning its metrics file."""
+    monkeypatch.setenv(results.RESULT_FILE_VARIABLE, str(directory.joinpath(f"{key}_{results.RESULT_FILE_NAME}")))
+    return results.report(step, **metrics)
+
+
+def _rows(directory, keys):
+    """Returns `(key, sbatch_file, metrics_file)` of each row, with the metrics file written by `_report`."""
+    return [
+        (
+            key,
+            directory.joinpath(f"{key}.sbatch"),
+            results.metrics_file(directory.joinpath(f"{key}_{results.RESULT_FILE_NAME}")),
+        )
+        for key in keys
+    ]
+
+
+def _job_id(sweep, key):
+    return next(row.job_id for row in sweep.rows if row.key == key)
+
+
+def test_promote_keeps_rows_until_rung_fills():
+    successive_halving = halving.SuccessiveHalving([1], reduction_factor=3)
+    assert successive_halving._promote(1, "a", 0.5)
+    assert successive_halving._promote(1, "b", 0.9)
+    # Three rows reached the rung, so only the best third continues.
+    assert not successive_halving._promote(1, "c", 0.7)
+    assert successive_halving._promote(1, "d", 0.1)
+    assert not successive_halving._promote(1, "e", 0.6)
+
+
+def test_promote_max_mode_ranks_nan_last():
+    successive_halving = halving.SuccessiveHalving([1], metric="accuracy", mode=halving.MAX, reduction_factor=2)
+    assert successive_halving._promote(1, "a", 0.8)
+    assert not successive_halving._promote(1, "b", math.nan)
+    assert successive_halving._promote(1, "c", 0.9)
+    assert successive_halving.scores[1]["b"] == math.inf
+
+
+def test_update_ranks_first_report_at_or_past_each_rung():
+    successive_halving = halving.SuccessiveHalving([1, 3], reduction_factor=2)
+    assert successive_halving.update("a", [{"step": 2, "loss": 0.1}])
+    # Only the first report at or past a rung is ranked.
+    assert successive_halving.update("b", [{"step": 1, "loss": 0.05}, {"step": 2, "loss": 0.5}])
+    assert successive_halving.scores[1] == {"a": 0.1, "b": 0.05}
+    # Reports without the metric or the step are ignored.
+    assert successive_halving.update("c", [{"step": 5}, {"loss": 0.3}])
+    assert not successive_halving.update("c", [{"step": 3, "loss": 0.3}, {"step": 4, "loss": 0.3}])
+    assert successive_halving.scores[1]["c"] == 0.3
+    assert successive_halving.scores[3] == {}
+
+
+def test_successive_halving_rejects_invalid_arguments():
+    with pytest.raises(ValueError):
+        halving.SuccessiveHalving([1], mode="median")
+    with pytest.raises(ValueError):
+        halving.SuccessiveHalving([1], reduction_factor=1)
+    with pytest.raises(ValueError):
+        halving.SuccessiveHalving([])
+
+
+def test_geometric_rungs():
+    assert halving.geometric_rungs(1, 27) == [1, 3, 9]
+    assert halving.geometric_rungs(2, 2) == []
+
+
+def test_read_reports_only_returns_complete_lines(tmp_path):
+    path = tmp_path.joinpath(results.METRICS_FILE_NAME)
+    assert results.read_reports(path) == ([], 0)
+    path.write_text('{"step": 1, "loss": 0.5}\n{"step": 2, "lo')
+    reports, offset = results.read_reports(path)
+    assert reports == [{"step": 1, "loss": 0.5}]
+    with path.open("a") as f:
+        f.write('ss": 0.25}\nnot json\n')
+    reports, offset = results.read_reports(path, offset)
+    assert reports == [{"step": 2, "loss": 0.25}]
+    assert offset == path.stat().st_size
+    assert results.read_reports(path, offset) == ([], offset)
+
+
+def test_report_appends_to_metrics_file_of_job(tmp_path, monkeypatch):
+    monkeypatch.delenv(results.RESULT_FILE_VARIABLE, raising=False)
+    assert results.report(1, loss=0.5) is None
+    path = _report(monkeypatch, tmp_path, "a", 1, loss=0.5)
+    _report(monkeypatch, tmp_path, "a", 2, loss=0.25)
+    assert path == tmp_path.joinpath(f"a_{results.METRICS_FILE_NAME}")
+    assert results.read_reports(path)[0] == [{"step": 1, "loss": 0.5}, {"step": 2, "loss": 0.25}]
+
+
+def test_poll_cancels_losing_rows_and_launches_waiting_rows(tmp_path, monkeypatch):
+    scheduler = FakeScheduler()
+    submitted = []
+    sweep = halving.HalvingSweep(
+        _rows(tmp_path, "abcd"),
+        halving.SuccessiveHalving([1], reduction_factor=3),
+        scheduler,
+        max_concurrent=3,
+        on_submit=lambda row: submitted.append(row.key),
+    )
+    assert sweep.poll()
+    assert submitted == ["a", "b", "c"]
+    assert sweep.counts() == {halving.WAITING: 1, halving.ACTIVE: 3, halving.STOPPED: 0, halving.FINISHED: 0}
+
+    _report(monkeypatch, tmp_path, "a", 1, loss=0.1)
+    _report(monkeypatch, tmp_path, "b", 1, loss=0.2)
+    _report(monkeypatch, tmp_path, "c", 1, loss=0.9)
+    assert sweep.poll()
+    assert scheduler.cancelled == [_job_id(sweep, "c")]
+    # The slot of the cancelled row goes to the waiting row.
+    assert submitted == ["a", "b", "c", "d"]
+    assert sweep.counts() == {halving.WAITING: 0, halving.ACTIVE: 3, halving.STOPPED: 1, halving.FINISHED: 0}
+
+    scheduler.job_states[_job_id(sweep, "a")] = "COMPLETED"
+    scheduler.job_states[_job_id(sweep, "b")] = "FAILED"
+    _report(monkeypatch, tmp_path, "d", 1, loss=0.05)
+    scheduler.job_states[_job_id(sweep, "d")] = "COMPLETED"
+    assert not sweep.poll()
+    assert {row.key: row.state for row in sweep.rows if row.status == halving.FINISHED} == {
+        "a": "COMPLETED", "b": "FAILED", "d": "COMPLETED"}
+    # Metrics are read before states, so the last rung of a row that just finished counts.
+    assert sweep.successive_halving.scores[1]["d"] == 0.05
+    assert scheduler.cancelled == [_job_id(sweep, "c")]
+
+
+def test_poll_does_not_cancel_rows_that_finished(tmp_path, monkeypatch):
+    scheduler = FakeScheduler()
+    sweep = halving.HalvingSweep(
+        _rows(tmp_path, "abc"), halving.SuccessiveHalving([1], reduction_factor=3), scheduler)
+    sweep.poll()
+    _report(monkeypatch, tmp_path, "a", 1, loss=0.1)
+    _report(monkeypatch, tmp_path, "b", 1, loss=0.2)
+    _report(monkeypatch, tmp_path, "c", 1, loss=0.9)
+    scheduler.job_states[_job_id(sweep, "c")] = "COMPLETED"
+    sweep.poll()
+    assert scheduler.cancelled == []
+    assert sweep.rows[2].status == halving.FINISHED
+
+
+def test_run_polls_until_all_rows_end(tmp_path, monkeypatch):
+    scheduler = FakeScheduler()
+    sweep = halving.HalvingSweep(
+        _rows(tmp_path, "abcd"), halving.SuccessiveHalving([1, 2], reduction_factor=2), scheduler, max_concurrent=2)
+    losses = {"a": 0.4, "b": 0.3, "c": 0.5, "d": 0.1}
+    polls = []
+
+    def sleep(interval):
+        # Each active row reports its loss at both rungs and finishes before the next poll.
+        for row in sweep.rows:
+            if row.status == halving.ACTIVE:
+                _report(monkeypatch, tmp_path, row.key, 2, loss=losses[row.key])
+                scheduler.job_states[row.job_id] = "COMPLETED"
+
+    counts = sweep.run(interval=0, callback=polls.append, sleep=sleep)
+    assert counts == {halving.WAITING: 0, halving.ACTIVE: 0, halving.STOPPED: 0, halving.FINISHED: 4}
+    assert len(scheduler.submitted) == 4
+    assert polls[-1] == counts
+    # `c` lost at both rungs but had already finished, so it was not cancelled.
+    assert scheduler.cancelled == []
+    assert set(sweep.successive_halving.scores[2]) == {"a", "b", "d"}
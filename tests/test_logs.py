@@ -0,0 +1,21 @@
+"""Tests of reading the logs of jobs in a sweep."""
+
+import io
+
+from slurm_tools import logs
+
+
+def test_tail_reads_last_lines_across_blocks(tmp_path):
+    path = tmp_path.joinpath("output.txt")
+    path.write_bytes(b"".join(b"line %d\n" % i for i in range(100)))
+    assert logs.tail(path, 2, block_size=4) == b"line 98\nline 99"
+    assert logs.tail(path, 200) == b"\n".join(b"line %d" % i for i in range(100))
+
+
+def test_copy_streams_whole_file_ending_with_newline(tmp_path):
+    path = tmp_path.joinpath("output.txt")
+    for data, copied in ((b"a\nb\n", b"a\nb\n"), (b"a\nb", b"a\nb\n"), (b"", b"\n")):
+        path.write_bytes(data)
+        output = io.BytesIO()
+        logs.copy(path, output, block_size=1)
+        assert output.getvalue() == copied
@@ -0,0 +1,101 @@
+"""Tests of sweep monitoring from recorded `squeue --me -h -o` and `sacct --parsable2` output in `fixtures`."""
+
+from pathlib import Path
+
+from slurm_tools import monitor
+
+FIXTURES = Path(__file__).parent.joinpath("fixtures")
+_JOB_IDS = ["200", "201", "202", "204"]
+
+
+def _recorded_output():
+    return monitor.RecordedOutput({
+        "squeue": FIXTURES.joinpath("squeue_me.txt").read_text(),
+        "sacct": FIXTURES.joinpath("sacct_states.txt").read_text(),
+    })
+
+
+class RecordedSequence(object):
+    """Replays each of `outputs` (`RecordedOutput`) for one poll, then repeats the last one."""
+
+    def __init__(self, outputs):
+        self.outputs=outputs
+        self.polls=0
+
+    def __call__(self, command):
+        output = self.outputs[min(self.polls, len(self.outputs) - 1)]
+        # Each poll ends with its `squeue` call.
+        if command[0] == "squeue":
+            self.polls += 1
+        return output(command)
+
+
+def test_expand_array_ids():
+    assert monitor.expand_array_ids("123_[0-2,5%4]") == ["123_0", "123_1", "123_2", "123_5"]
+    assert monitor.expand_array_ids("123_[7]") == ["123_7"]
+    assert monitor.expand_array_ids("123_4") == ["123_4"]
+    assert monitor.expand_array_ids("123") == ["123"]
+
+
+def test_category_counts_unknown_states_as_failed():
+    assert monitor.category("PENDING") == monitor.PENDING
+    assert monitor.category("REQUEUED") == monitor.PENDING
+    assert monitor.category("COMPLETING") == monitor.RUNNING
+    assert monitor.category("COMPLETED") == monitor.COMPLETED
+    for state in ("FAILED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL", "CANCELLED", "SOME_NEW_STATE"):
+        assert monitor.category(state) == monitor.FAILED
+
+
+def test_parse_sacct_states_expands_arrays_and_drops_reasons():
+    states = monitor.parse_sacct_states(FIXTURES.joinpath("sacct_states.txt").read_text())
+    assert states["200_3"] == states["200_4"] == "PENDING"
+    assert states["202"] == "CANCELLED"
+    assert "200_[3-4%2]" not in states
+
+
+def test_poll_prefers_squeue_and_ignores_untracked_jobs_and_steps():
+    sweep_monitor = monitor.SweepMonitor(_JOB_IDS, runner=_recorded_output())
+    assert sweep_monitor.poll() == {
+        "200_0": "COMPLETED",
+        "200_1": "FAILED",
+        "200_2": "RUNNING",
+        "200_3": "PENDING",
+        "200_4": "PENDING",
+        # `sacct` lags behind `squeue`.
+        "201": "RUNNING",
+        "202": "CANCELLED",
+    }
+    # `204` was not reported yet, so it counts as pending.
+    assert sweep_monitor.counts() == {
+        monitor.PENDING: 3, monitor.RUNNING: 2, monitor.COMPLETED: 1, monitor.FAILED: 2}
+    assert not sweep_monitor.finished()
+
+
+def test_poll_issues_one_squeue_and_one_sacct_call():
+    commands = []
+    recorded = _recorded_output()
+
+    def runner(command):
+        commands.append(command)
+        return recorded(command)
+
+    monitor.SweepMonitor(_JOB_IDS, runner=runner).poll()
+    assert [command[0] for command in commands] == ["sacct", "squeue"]
+    assert "--jobs=200,201,202,204" in commands[0]
+
+
+def test_watch_backs_off_while_counts_are_unchanged():
+    done = monitor.RecordedOutput({
+        "sacct": "200_[0-4]|COMPLETED\n201|COMPLETED\n202|CANCELLED\n204|FAILED\n"})
+    changed = monitor.RecordedOutput({"sacct": "200_[0-4]|COMPLETED\n201|RUNNING\n202|CANCELLED\n"})
+    runner = RecordedSequence([_recorded_output()] * 3 + [changed, done])
+    sweep_monitor = monitor.SweepMonitor(_JOB_IDS, runner=runner)
+    sleeps = []
+    polls = []
+    counts = sweep_monitor.watch(
+        interval=10, max_interval=20, backoff=1.5, callback=polls.append, sleep=sleeps.append)
+    assert counts == {monitor.PENDING: 0, monitor.RUNNING: 0, monitor.COMPLETED: 6, monitor.FAILED: 2}
+    # The interval grows while counts are unchanged, up to `max_interval`, and resets when they change.
+    assert sleeps == [10, 15, 20, 10]
+    assert len(polls) == 5
+    assert sweep_monitor.finished()
@@ -0,0 +1,136 @@
+"""Tests of partition choice from recorded `sinfo`, `squeue` and `sshare` output in `fixtures`."""
+
+import collections
+from pathlib import Path
+
+import pytest
+
+from slurm_tools import monitor
+from slurm_tools import partitions
+
+FIXTURES = Path(__file__).parent.joinpath("fixtures")
+_DAY = 24 * 3600
+
+
+def _snapshot(sshare=True):
+    return partitions.read_snapshot(partitions.recorded_runner(
+        FIXTURES.joinpath("sinfo.txt"),
+        FIXTURES.joinpath("squeue.txt"),
+        FIXTURES.joinpath("sshare.txt") if sshare else None,
+    ))
+
+
+def _chooser(names=("shared", "serial", "short")):
+    return partitions.PartitionChooser(_snapshot(), names)
+
+
+def test_parse_sinfo_sums_lines_of_a_partition():
+    parsed = partitions.parse_sinfo(FIXTURES.joinpath("sinfo.txt").read_text())
+    assert list(parsed) == ["shared", "serial", "short", "down"]
+    # Other (drained or down) cpus are not counted.
+    assert (parsed["shared"].total_cpus, parsed["shared"].idle_cpus) == (150, 10)
+    assert parsed["shared"].max_time == 3 * _DAY
+    assert parsed["short"].max_time == 3600
+    assert parsed["down"].max_time is None
+    assert parsed["down"].total_cpus == 0
+    assert not parsed["down"].up
+
+
+def test_add_jobs_counts_backlog_and_running_time_left():
+    parsed = partitions.parse_sinfo(FIXTURES.joinpath("sinfo.txt").read_text())
+    partitions.add_jobs(parsed, FIXTURES.joinpath("squeue.txt").read_text())
+    shared = parsed["shared"]
+    assert shared.running_cpu_seconds == 4 * 1800
+    # Ten pending array tasks of 2 cpus and a job pending on both `shared` and `serial`.
+    assert shared.pending_cpus == 10 * 2 + 8
+    assert shared.pending_cpu_seconds == 10 * 2 * 7200 + 8 * 3600
+    serial = parsed["serial"]
+    # Jobs without a time limit count with the limit of the partition.
+    assert serial.pending_cpus == 8 + 4
+    assert serial.pending_cpu_seconds == 8 * 3600 + 4 * 7 * _DAY
+    assert parsed["short"].pending_cpus == 0
+
+
+def test_parse_fairshare():
+    assert partitions.parse_fairshare("FairShare\n0.25\n") == 0.25
+    assert partitions.parse_fairshare("") is None
+
+
+def test_read_snapshot_from_recorded_output():
+    snapshot = _snapshot()
+    assert snapshot.fairshare == 0.5
+    assert snapshot.partitions["serial"].pending_cpus == 12
+    # Missing `sshare` output leaves the fairshare unknown, so all pending jobs count as ahead.
+    snapshot = _snapshot(sshare=False)
+    assert snapshot.fairshare is None
+    assert partitions.PartitionChooser(snapshot, ["shared"]).fairshare == 0.0
+
+
+def test_read_snapshot_runs_each_command_once():
+    commands = []
+    recorded = monitor.RecordedOutput({"sinfo": FIXTURES.joinpath("sinfo.txt").read_text()})
+
+    def runner(command):
+        commands.append(command[0])
+        return recorded(command)
+
+    partitions.read_snapshot(runner)
+    assert commands == ["sinfo", "squeue", "sshare"]
+
+
+def test_chooser_rejects_partitions_missing_from_sinfo():
+    with pytest.raises(ValueError):
+        partitions.PartitionChooser(_snapshot(), ["shared", "gpu"])
+
+
+def test_eligible_partitions_fit_the_job():
+    chooser = partitions.PartitionChooser(_snapshot(), ["shared", "serial", "short", "down"])
+    assert chooser.eligible(4, 7200) == ["shared", "serial"]
+    assert chooser.eligible(4, 1800) == ["shared", "serial", "short"]
+    assert chooser.eligible(100, 1800) == ["shared"]
+
+
+def test_estimates_account_for_jobs_ahead():
+    chooser = _chooser()
+    # Half of the 28 pending cpus on `shared` are ahead, more than its 10 idle cpus.
+    assert chooser.estimate_start("shared", 4) == (4 * 1800 + (10 * 2 * 7200 + 8 * 3600) / 2) / 150
+    assert chooser.estimate_start("serial", 4) == 0.0
+    assert chooser.slots("shared", 4) == 75 // 4
+    assert chooser.slots("serial", 4) == (40 - 6) // 4
+    assert chooser.estimate_finish("serial", 9, 4, 7200) == 2 * 7200
+    assert chooser.estimate_finish("serial", 0, 4, 7200) == 0.0
+    assert chooser.choose(4, 7200) == "serial"
+    with pytest.raises(ValueError):
+        chooser.choose(4, 8 * _DAY)
+
+
+def test_assign_spreads_rows_over_partitions():
+    chooser = _chooser()
+    rows = list(chooser.assign(({"experiment_id": i} for i in range(30)), {"time": "2:00:00", "cpu_count": 4}))
+    assert [row["experiment_id"] for row in rows] == list(range(30))
+    # `serial` runs 8 rows at once and starts now, `shared` runs 18 at once after a wait.
+    assert [row[partitions.PARTITION] for row in rows[:9]] == ["serial"] * 8 + ["shared"]
+    assert collections.Counter(row[partitions.PARTITION] for row in rows) == {"serial": 12, "shared": 18}
+
+
+def test_assign_chunks_and_row_resources():
+    chooser = _chooser()
+    rows = list(chooser.assign(({} for _ in range(10)), {"time": "2:00:00", "cpu_count": 4}, chunk_size=10))
+    # Ten rows take two rounds on `serial`, but one on `shared`.
+    assert {row[partitions.PARTITION] for row in rows} == {"shared"}
+
+    rows = list(chooser.assign(
+        [{"partition": "shared"}, {"time": "30:00", "cpu_count": 40}, {"time": "30:00"}],
+        {"time": "2:00:00", "cpu_count": 4},
+    ))
+    # Rows keep their own partition, and only fit partitions that can run their resources.
+    assert [row[partitions.PARTITION] for row in rows] == ["shared", "short", "serial"]
+    with pytest.raises(ValueError):
+        list(chooser.assign([{"cpu_count": 200}], {"time": "2:00:00"}))
+
+
+def test_requested_resources():
+    assert partitions.requested_resources({"cpu_count": "2"}, {"time": "1:00:00", "cpu_count": 4}) == (2, 3600)
+    assert partitions.requested_resources({"time": "2-0"}, {}) == (1, 2 * _DAY)
+    with pytest.raises(ValueError):
+        partitions.requested_resources({}, {"cpu_count": 4})
@@ -0,0 +1,132 @@
+"""Tests of right-sizing `time` and `mem_per_cpu` from saved `sacct --parsable2` output in `fixtures`."""
+
+from pathlib import Path
+
+from slurm_tools import launch_python_jobs_array
+from slurm_tools import registry as job_registry
+from slurm_tools import rightsize
+
+FIXTURES = Path(__file__).parent.joinpath("fixtures")
+_MB = 1 << 20
+_GB = 1 << 30
+
+
+def _usage():
+    return rightsize.parse_sacct_usage(FIXTURES.joinpath("sacct_usage.txt").read_text())
+
+
+def _completed():
+    return [u for key, u in _usage().items() if key in ("300", "301_0", "301_1")]
+
+
+def test_parse_sacct_usage_merges_steps_into_jobs():
+    usage = _usage()
+    assert sorted(usage) == ["300", "301_0", "301_1", "302", "303", "304"]
+    # The largest `MaxRSS` of the steps, the rest from the job's own line.
+    assert usage["300"] == {
+        "state": "COMPLETED", "elapsed": 600.0, "total_cpu": 2100.0, "max_rss": _GB, "alloc_cpus": 4}
+    assert usage["301_1"]["max_rss"] == 3 * _GB
+    assert usage["302"]["state"] == "CANCELLED"
+    # The batch step of a timed out job is cancelled, but the job keeps its own state.
+    assert usage["303"]["state"] == "TIMEOUT"
+    assert usage["303"]["elapsed"] == 24 * 3600 + 3
+
+
+def test_parse_sacct_usage_without_header():
+    usage = rightsize.parse_sacct_usage("400|COMPLETED|01:00:00|02:00:00|500M|2\n400.0|COMPLETED|||700M|2\n")
+    assert usage["400"] == {
+        "state": "COMPLETED", "elapsed": 3600.0, "total_cpu": 7200.0, "max_rss": 700 * _MB, "alloc_cpus": 2}
+
+
+def test_parse_requests():
+    assert rightsize.parse_duration("1-02:03:04.5") == 24 * 3600 + 2 * 3600 + 3 * 60 + 4.5
+    assert rightsize.parse_duration("UNLIMITED") is None
+    assert rightsize.parse_time_request("90") == 90 * 60
+    assert rightsize.parse_time_request("1:30:00") == 90 * 60
+    assert rightsize.parse_time_request("2-12") == 60 * 3600
+    assert rightsize.parse_memory("4Gc") == 4 * _GB
+    assert rightsize.parse_memory("512", default_unit=_MB) == 512 * _MB
+    assert rightsize.format_time(24 * 3600 + 61) == "1-00:02:00"
+    assert rightsize.format_memory(1.5 * _MB) == "2M"
+
+
+def test_recommend_applies_quantile_and_margin():
+    # Completed jobs ran 10, 20 and 30 minutes with 256M, 512M and 768M per cpu.
+    assert rightsize.recommend(_completed()) == {"time": "00:36:00", "mem_per_cpu": "922M", "jobs": 3}
+    assert rightsize.recommend(_completed(), safety_margin=0) == {
+        "time": "00:30:00", "mem_per_cpu": "768M", "jobs": 3}
+    assert rightsize.recommend(_completed(), quantile=0.5) == {
+        "time": "00:24:00", "mem_per_cpu": "615M", "jobs": 3}
+
+
+def test_recommend_does_not_tighten_resources_jobs_ran_out_of():
+    usage = _usage()
+    # Only completed jobs are used, and the cancelled job does not suppress anything.
+    recommendation = rightsize.recommend(u for key, u in usage.items() if key != "304")
+    assert recommendation == {"time": None, "mem_per_cpu": "922M", "jobs": 3}
+    recommendation = rightsize.recommend(u for key, u in usage.items() if key != "303")
+    assert recommendation == {"time": "00:36:00", "mem_per_cpu": None, "jobs": 3}
+    assert rightsize.recommend(usage.values()) == {"time": None, "mem_per_cpu": None, "jobs": 3}
+    assert rightsize.recommend([]) == {"time": None, "mem_per_cpu": None, "jobs": 0}
+
+
+def test_right_size_only_lowers_requests():
+    recommendation = {"time": "00:36:00", "mem_per_cpu": "922M", "jobs": 3}
+    assert rightsize.right_size({"time": "8:00:00", "mem_per_cpu": "4G", "cpu_count": 4}, recommendation) == {
+        "time": "00:36:00", "mem_per_cpu": "922M", "cpu_count": 4}
+    # Smaller requests are kept, `mem_per_cpu` without a unit is in megabytes.
+    smaller = {"time": "20", "mem_per_cpu": 512}
+    assert rightsize.right_size(smaller, recommendation) == smaller
+    # Missing requests are set.
+    assert rightsize.right_size({}, recommendation) == {"time": "00:36:00", "mem_per_cpu": "922M"}
+    assert rightsize.right_size(
+        {"time": "8:00:00"}, {"time": None, "mem_per_cpu": None, "jobs": 0}) == {"time": "8:00:00"}
+
+
+def _record(registry, job_name, job_id, model):
+    registry.record_submission("sweep", job_name, "train.py", "env", {"time": "1:00:00"}, [{
+        "job_id": job_id,
+        "array_index": None,
+        "row_index": 0,
+        "experiment_id": job_id,
+        "script_args": {"model": model},
+        "job_directory": f"sweep/{job_id}",
+    }])
+
+
+def test_registry_usage_of_job_name_includes_its_array_groups(tmp_path):
+    registry = job_registry.JobRegistry(tmp_path.joinpath("registry.sqlite"))
+    _record(registry, "train", "300", "a")
+    _record(registry, "train_0", "301", "b")
+    _record(registry, "other", "302", "a")
+    registry.record_usage({
+        job_id: {"state": "COMPLETED", "elapsed": 60.0, "total_cpu": 60.0, "max_rss": _GB, "alloc_cpus": 1}
+        for job_id in ("300", "301", "302")
+    })
+    assert len(registry.usage(script="train.py", job_name="train")) == 2
+    assert len(registry.usage(script="train.py", job_name="train", script_args={"model": "a"})) == 1
+    assert len(registry.usage(script="train.py", script_args={"model": "a"})) == 2
+    registry.close()
+
+
+def test_right_size_rows_per_group():
+    usage = {"a": _completed(), "b": []}
+    calls = []
+
+    def group_usage(script_args=None):
+        calls.append(script_args)
+        return usage[script_args["model"]]
+
+    rows = list(launch_python_jobs_array.right_size_rows(
+        [{"model": "a", "seed": 0}, {"model": "b", "time": "00:10:00"}, {"model": "a", "time": "00:20:00"}],
+        {"time": "8:00:00", "mem_per_cpu": "4G"},
+        group_usage,
+        ["model"],
+    ))
+    # Each group is recommended once.
+    assert calls == [{"model": "a"}, {"model": "b"}]
+    assert rows == [
+        {"model": "a", "seed": 0, "time": "00:36:00", "mem_per_cpu": "922M"},
+        {"model": "b", "time": "00:10:00", "mem_per_cpu": "4G"},
+        {"model": "a", "time": "00:20:00", "mem_per_cpu": "922M"},
+    ]
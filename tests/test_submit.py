@@ -0,0 +1,127 @@
+"""Tests of concurrent, rate-limited submission against fake `sbatch` (see `fake_slurm`)."""
+
+import time
+
+import pytest
+
+from slurm_tools import fake_slurm
+from slurm_tools import submit
+
+
+def _sbatch_files(directory, count):
+    """Writes `count` sbatch files to `directory` and returns their paths."""
+    paths = []
+    for i in range(count):
+        path = directory.joinpath(f"job_{i}.sbatch")
+        path.write_text("#!/bin/bash\n#SBATCH --time=00:10:00\necho hello\n")
+        paths.append(path)
+    return paths
+
+
+def _flaky_sbatch(directory, sbatch, failures, error="sbatch: error: Socket timed out on send/recv operation"):
+    """Writes an `sbatch` that fails with `error` on its first `failures` calls, then runs `sbatch`."""
+    calls = directory.joinpath("calls")
+    path = directory.joinpath("flaky_sbatch")
+    path.write_text(f"""#!/bin/sh
+echo >> "{calls}"
+if [ "$(wc -l < "{calls}")" -le {failures} ]; then
+    echo "{error}" >&2
+    exit 1
+fi
+exec "{sbatch}" "$@"
+""")
+    path.chmod(0o755)
+    return path
+
+
+def test_parse_job_id():
+    assert submit.parse_job_id("1234\n") == "1234"
+    assert submit.parse_job_id("1234;cluster\n") == "1234"
+
+
+def test_submit_parses_parsable_job_id(tmp_path):
+    executables = fake_slurm.install(tmp_path.joinpath("bin"))
+    submitter = submit.SbatchSubmitter(sbatch_command=str(executables["sbatch"]))
+    sbatch_files = _sbatch_files(tmp_path, 2)
+    assert [submitter.submit(f) for f in sbatch_files] == ["1000", "1001"]
+    submissions = fake_slurm.read_submissions(tmp_path.joinpath("bin"))
+    assert [s["sbatch_file"] for s in submissions] == [str(f) for f in sbatch_files]
+    # `--parsable` is passed but not recorded as an argument.
+    assert submissions[0]["args"] == []
+
+
+def test_submit_retries_transient_errors_with_backoff(tmp_path, monkeypatch):
+    executables = fake_slurm.install(tmp_path.joinpath("bin"))
+    sleeps = []
+    monkeypatch.setattr(submit.time, "sleep", sleeps.append)
+    submitter = submit.SbatchSubmitter(
+        max_retries=3, backoff=0.5, sbatch_command=str(_flaky_sbatch(tmp_path, executables["sbatch"], 2)))
+    assert submitter.submit(_sbatch_files(tmp_path, 1)[0]) == "1000"
+    # The wait doubles after each attempt.
+    assert sleeps == [0.5, 1.0]
+
+
+def test_submit_raises_after_last_retry_or_other_errors(tmp_path, monkeypatch):
+    executables = fake_slurm.install(tmp_path.joinpath("bin"))
+    monkeypatch.setattr(submit.time, "sleep", lambda seconds: None)
+    sbatch_file = _sbatch_files(tmp_path, 1)[0]
+    submitter = submit.SbatchSubmitter(
+        max_retries=1, sbatch_command=str(_flaky_sbatch(tmp_path, executables["sbatch"], 2)))
+    with pytest.raises(submit.SubmissionError, match="Socket timed out"):
+        submitter.submit(sbatch_file)
+
+    # Errors that are not transient are not retried.
+    submitter = submit.SbatchSubmitter(sbatch_command=str(executables["sbatch"]))
+    with pytest.raises(submit.SubmissionError, match="Unable to open file"):
+        submitter.submit(tmp_path.joinpath("missing.sbatch"))
+    assert fake_slurm.read_submissions(tmp_path.joinpath("bin")) == []
+
+
+def test_submit_raises_submission_error_if_sbatch_cannot_run(tmp_path):
+    submitter = submit.SbatchSubmitter(sbatch_command=str(tmp_path.joinpath("missing_sbatch")))
+    with pytest.raises(submit.SubmissionError, match="could not be run"):
+        submitter.submit(_sbatch_files(tmp_path, 1)[0])
+
+
+def test_token_bucket_limits_rate(tmp_path):
+    executables = fake_slurm.install(tmp_path.joinpath("bin"))
+    submitter = submit.SbatchSubmitter(
+        max_workers=4, rate=20, burst=2, sbatch_command=str(executables["sbatch"]))
+    start = time.monotonic()
+    submitter.submit_all(_sbatch_files(tmp_path, 6))
+    # Two submissions go at once, the other four wait for a token each.
+    assert time.monotonic() - start >= 4 / 20 * 0.9
+    submissions = fake_slurm.read_submissions(tmp_path.joinpath("bin"))
+    assert len(submissions) == 6
+
+
+def test_submit_all_records_errors_of_last_call(tmp_path):
+    executables = fake_slurm.install(tmp_path.joinpath("bin"))
+    submitter = submit.SbatchSubmitter(max_workers=2, sbatch_command=str(executables["sbatch"]))
+    sbatch_files = _sbatch_files(tmp_path, 3)
+    missing = tmp_path.joinpath("missing.sbatch")
+    job_ids = submitter.submit_all([sbatch_files[0], missing, *sbatch_files[1:]])
+    assert job_ids[1] is None
+    assert sorted(job_ids[:1] + job_ids[2:]) == ["1000", "1001", "1002"]
+    assert [sbatch_file for sbatch_file, _ in submitter.errors] == [missing]
+    assert isinstance(submitter.errors[0][1], submit.SubmissionError)
+    submitter.submit_all(sbatch_files)
+    assert submitter.errors == []
+
+
+def test_submit_all_bounds_pending_submissions(tmp_path):
+    state_directory = tmp_path.joinpath("bin")
+    executables = fake_slurm.install(state_directory, latency=0.05)
+    max_workers = 2
+    submitter = submit.SbatchSubmitter(max_workers=max_workers, sbatch_command=str(executables["sbatch"]))
+    behind = []
+
+    def sbatch_files():
+        for i, sbatch_file in enumerate(_sbatch_files(tmp_path, 10)):
+            # Number of files handed out but not yet submitted.
+            behind.append(i - len(fake_slurm.read_submissions(state_directory)))
+            yield sbatch_file
+
+    job_ids = submitter.submit_all(sbatch_files())
+    assert len(job_ids) == 10
+    assert max(behind) <= 2 * max_workers